@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+from farm_data import RISK_LEVELS
+
+# Dimensions of the cube, in axis order
+CUBE_DIMENSIONS = ('region', 'supplier_tier', 'drought_risk', 'flood_risk')
+
+
+def _measures(df):
+    # Additive per-farm quantities behind every dashboard metric and chart
+    return {
+        'count': None,
+        'compliant': df['tnfd_compliant'].to_numpy(dtype=np.float64),
+        'score_sum': df['overall_score'].to_numpy(dtype=np.float64),
+        'habitat_ha': df['size'].to_numpy(dtype=np.float64) * df['natural_habitat'].to_numpy(dtype=np.float64) / 100,
+        'soil_ok': (df['soil_health'].to_numpy() >= 4.0).astype(np.float64),
+        'water_sum': df['water_efficiency'].to_numpy(dtype=np.float64),
+        'water_ok': (df['water_efficiency'].to_numpy() >= 85).astype(np.float64),
+        'biodiversity_sum': df['biodiversity_score'].to_numpy(dtype=np.float64),
+        'milk_volume': df['milk_volume'].to_numpy(dtype=np.float64),
+        'sfi': df['sfi_enrolled'].to_numpy(dtype=np.float64),
+        'cs': df['cs_enrolled'].to_numpy(dtype=np.float64),
+        'both_schemes': (df['sfi_enrolled'].to_numpy() & df['cs_enrolled'].to_numpy()).astype(np.float64)
+    }
+
+
+def _dimension(series, order=None):
+    values = pd.unique(series.astype(str))
+    if order is not None:
+        values = [v for v in order if v in set(values)] + sorted(set(values) - set(order))
+    else:
+        values = sorted(values)
+    return list(values)
+
+
+# Precomputed aggregate cube over region x tier x drought x flood.
+#
+# Every measure is summed per cell once, so any dropdown combination is answered
+# by masking the cube's axes and summing a few hundred cells, independent of the
+# number of farms. A cube can also be built from any row subset (e.g. the result
+# of a free-text search) and queried the same way.
+#
+# add_rows() keeps the cube current as farms are added or edited: it touches only
+# the cells of the changed rows (subtract the old row, add the new one).
+class AggregateCube:
+    def __init__(self, df, dimensions=None):
+        if dimensions is None:
+            dimensions = {
+                'region': _dimension(df['region']),
+                'supplier_tier': _dimension(df['supplier_tier']),
+                'drought_risk': _dimension(df['drought_risk'], RISK_LEVELS),
+                'flood_risk': _dimension(df['flood_risk'], RISK_LEVELS)
+            }
+        self.dimensions = dimensions
+        self.shape = tuple(len(dimensions[d]) for d in CUBE_DIMENSIONS)
+        cells = self._cells(df)
+        n_cells = int(np.prod(self.shape))
+
+        self.measures = {}
+        for name, weights in _measures(df).items():
+            sums = np.bincount(cells, weights=weights, minlength=n_cells).astype(np.float64)
+            self.measures[name] = sums.reshape(self.shape)
+
+    def _codes(self, series, dimension):
+        values = self.dimensions[dimension]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Translate the few categories, then broadcast through the integer codes
+            lookup = pd.Index(values).get_indexer(series.cat.categories.astype(str))
+            return np.append(lookup, -1)[series.cat.codes.to_numpy()]
+        return pd.Categorical(series.astype(str), categories=values).codes
+
+    def _cells(self, df):
+        codes = [self._codes(df[d], d) for d in CUBE_DIMENSIONS]
+        return np.ravel_multi_index(codes, self.shape) if len(df) else np.empty(0, dtype=np.intp)
+
+    # Extend an axis for a dimension value first seen after the cube was built
+    def _grow(self, dimension, value):
+        axis = CUBE_DIMENSIONS.index(dimension)
+        self.dimensions = dict(self.dimensions, **{dimension: self.dimensions[dimension] + [value]})
+        pad = [(0, 0)] * len(CUBE_DIMENSIONS)
+        pad[axis] = (0, 1)
+        self.measures = {name: np.pad(cube, pad) for name, cube in self.measures.items()}
+        self.shape = self.measures['count'].shape
+
+    # Add (sign=1) or remove (sign=-1) the contribution of a few rows
+    def add_rows(self, df, sign=1):
+        for dimension in CUBE_DIMENSIONS:
+            for value in pd.unique(df[dimension].astype(str)):
+                if value not in self.dimensions[dimension]:
+                    self._grow(dimension, value)
+        cells = self._cells(df)
+        for name, weights in _measures(df).items():
+            weights = np.ones(len(cells)) if weights is None else weights
+            np.add.at(self.measures[name].reshape(-1), cells, sign * weights)
+
+    def _axis_mask(self, dimension, value):
+        values = self.dimensions[dimension]
+        if value == 'all':
+            return np.ones(len(values), dtype=bool)
+        return np.array([v == value for v in values], dtype=bool)
+
+    # Boolean mask over cells matching the dashboard dropdowns
+    def cell_mask(self, region='all', tier='all', risk='all'):
+        region_mask = self._axis_mask('region', region)
+        tier_mask = self._axis_mask('supplier_tier', tier)
+        if risk == 'all':
+            risk_mask = np.ones(self.shape[2:], dtype=bool)
+        else:
+            risk_mask = (self._axis_mask('drought_risk', risk)[:, None]
+                         | self._axis_mask('flood_risk', risk)[None, :])
+        return region_mask[:, None, None, None] & tier_mask[None, :, None, None] & risk_mask[None, None]
+
+    # Cube over precomputed measure arrays, e.g. a stored rollup
+    @classmethod
+    def from_measures(cls, dimensions, measures):
+        cube = cls.__new__(cls)
+        cube.dimensions = dimensions
+        cube.shape = tuple(len(dimensions[d]) for d in CUBE_DIMENSIONS)
+        cube.measures = measures
+        return cube
+
+    # A cube that later add_rows() calls on this one leave as it is
+    def copy(self):
+        return AggregateCube.from_measures(self.dimensions, {name: cube.copy() for name, cube in self.measures.items()})
+
+    def _selected(self, region, tier, risk):
+        mask = self.cell_mask(region, tier, risk)
+        return {name: np.where(mask, cube, 0) for name, cube in self.measures.items()}
+
+    def _totals(self, selected):
+        totals = {name: float(cube.sum()) for name, cube in selected.items()}
+        high_risk = (self._axis_mask('drought_risk', 'High')[:, None]
+                     | self._axis_mask('flood_risk', 'High')[None, :])
+        totals['high_risk'] = float(selected['count'][:, :, high_risk].sum())
+        return totals
+
+    # Measure totals (plus high_risk) for a dropdown combination
+    def totals(self, region='all', tier='all', risk='all'):
+        return self._totals(self._selected(region, tier, risk))
+
+    # Totals and per-dimension breakdowns for a dropdown combination
+    def summary(self, region='all', tier='all', risk='all'):
+        selected = self._selected(region, tier, risk)
+        totals = self._totals(selected)
+
+        def breakdown(dimension, measures):
+            axes = tuple(i for i, d in enumerate(CUBE_DIMENSIONS) if d != dimension)
+            frame = pd.DataFrame(
+                {name: selected[name].sum(axis=axes) for name in measures},
+                index=self.dimensions[dimension]
+            )
+            return frame[frame['count'] > 0]
+
+        totals['by_region'] = breakdown('region', ['count', 'score_sum', 'compliant', 'milk_volume'])
+        totals['by_tier'] = breakdown('supplier_tier', ['count'])['count']
+        totals['by_drought'] = breakdown('drought_risk', ['count'])['count']
+        totals['by_flood'] = breakdown('flood_risk', ['count'])['count']
+        return totals
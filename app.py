@@ -1,50 +1,45 @@
 import dash
-from dash import dcc, html, Input, Output, dash_table, State, callback_context, ALL
+from dash import dcc, html, Input, Output, dash_table, State, callback_context, ALL, ClientsideFunction
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import plotly.express as px
 import os
+import json
+import tempfile
+import atexit
+import functools
+import shutil
+import threading
+import time
+import fcntl
+import flask
+import plotly
 
-# Generate comprehensive farm data matching React version
-def generate_farm_data():
-    regions = ['South West', 'South East', 'East Midlands', 'West Midlands', 
-               'North West', 'Yorkshire', 'North East', 'East Anglia']
-    supplier_tiers = ['Gold', 'Silver', 'Bronze']
-    nvz_status = ['NVZ', 'Non-NVZ']
-    risk_levels = ['Low', 'Medium', 'High']
-    
-    farms = []
-    for i in range(270):
-        farm = {
-            'id': f'FARM_{str(i + 1).zfill(3)}',
-            'name': f"{np.random.choice(['Green', 'Hill', 'Valley', 'Brook', 'Meadow', 'Field', 'Oak', 'Manor'])} {np.random.choice(['Farm', 'Dairy', 'Estate', 'Holdings'])}",
-            'region': np.random.choice(regions),
-            'size': np.random.randint(50, 450),
-            'herd_size': np.random.randint(80, 380),
-            'supplier_tier': np.random.choice(supplier_tiers),
-            'nvz_status': np.random.choice(nvz_status),
-            'natural_habitat': np.random.randint(5, 30),
-            'soil_health': round(3 + np.random.random() * 3, 1),
-            'water_efficiency': np.random.randint(70, 95),
-            'biodiversity_score': np.random.randint(40, 90),
-            'nitrogen_efficiency': np.random.randint(45, 85),
-            'phosphorus_efficiency': np.random.randint(50, 85),
-            'drought_risk': np.random.choice(risk_levels),
-            'flood_risk': np.random.choice(risk_levels),
-            'tnfd_compliant': np.random.random() > 0.15,
-            'sfi_enrolled': np.random.random() > 0.4,
-            'cs_enrolled': np.random.random() > 0.6,
-            'overall_score': np.random.randint(50, 90),
-            'milk_volume': np.random.randint(500000, 2500000),
-            'sustainabilit_premium': np.random.randint(0, 5000) if np.random.random() > 0.3 else 0,
-            'last_updated': (datetime.now() - timedelta(days=np.random.randint(0, 30))).strftime('%Y-%m-%d')
-        }
-        farms.append(farm)
-    
-    return pd.DataFrame(farms)
+from farm_data import (generate_farm_data, DEFAULT_FARM_COUNT, REGIONS, SUPPLIER_TIERS,
+                       NVZ_STATUS, RISK_LEVELS)
+from farm_store import load_or_build_farm_store
+from farm_schema import apply_farm_schema
+from live_store import LiveFarmStore
+from farm_history import load_or_build_history, DEFAULT_HISTORY_MONTHS
+from farm_ingest import (FarmFileIngestor, MAX_DELTA_ROWS, drop_lock, open_drop_table, prune_partitions,
+                         write_drop_table)
+from farm_sqlite import load_or_build_farm_sqlite, DEFAULT_POOL_SIZE
+from result_cache import ResultCache, normalize_search
+from aggregate_cube import AggregateCube
+from figures import (REGIONAL_PERFORMANCE, RISK_ASSESSMENT, TIER_DISTRIBUTION, SCHEME_ENROLLMENT,
+                     FARM_SCATTER, FARM_DENSITY, METRIC_TREND, FARM_MAP,
+                     CLIMATE_LOSS_DISTRIBUTION, CLIMATE_REGION_LOSS)
+from binning import SCATTER_AXES, DEFAULT_MAX_POINTS, DEFAULT_BINS, bin_2d
+from spatial_index import DEFAULT_MAX_TILES, DEFAULT_MAX_POINTS as DEFAULT_MAP_POINTS
+from export import EXPORT_FORMATS, export_available, iter_export
+from callback_metrics import CallbackMetrics
+from client_filtering import client_payload
+from background_jobs import BackgroundCallbacks, create_background_manager
+from reports import REPORT_FORMATS, REPORT_SCOPES, report_available, build_report
+from farm_scorecard import farm_scorecard
+from climate_scenarios import (CLIMATE_SCENARIOS, DEFAULT_TRIALS, DEFAULT_MAX_CELLS, run_scenario,
+                               scenario_summary)
 
 # Initialize the Dash app
 app = dash.Dash(__name__, 
@@ -62,8 +57,491 @@ app = dash.Dash(__name__,
 # For deployment
 server = app.server
 
-# Generate the data
-farms_df = generate_farm_data()
+# Generate the data (FARM_COUNT / FARM_SEED let load tests size and pin the portfolio).
+# With FARM_DATA_DIR set, the table is built once into a columnar store and every
+# gunicorn worker maps the same read-only files instead of generating its own copy.
+# Either way the table is held in the compact schema of farm_schema.py.
+FARM_COUNT = int(os.environ.get('FARM_COUNT', DEFAULT_FARM_COUNT))
+FARM_SEED = int(os.environ['FARM_SEED']) if os.environ.get('FARM_SEED') else None
+FARM_DATA_DIR = os.environ.get('FARM_DATA_DIR')
+# FARM_BACKEND=sqlite answers the dashboard filters and aggregates from SQLite (see
+# below); the table is then always a mapped store, in a private temporary directory
+# without FARM_DATA_DIR
+FARM_BACKEND = os.environ.get('FARM_BACKEND', 'pandas')
+if FARM_BACKEND not in ('pandas', 'sqlite'):
+    raise ValueError(f"FARM_BACKEND must be 'pandas' or 'sqlite', not {FARM_BACKEND!r}")
+# FARM_INGEST_DIR loads supplier CSV / Parquet drops instead (see farm_ingest.py).
+# The validated partitions and the drop's farm table are cached in INGEST_CACHE_DIR
+# (next to the shared farm store, or a private temporary directory), so the first
+# worker parses the drop and the others map its table.
+FARM_INGEST_DIR = os.environ.get('FARM_INGEST_DIR')
+INGEST_POLL_SECONDS = int(os.environ.get('INGEST_POLL_SECONDS', 30))
+INGEST_CACHE_DIR = os.environ.get('INGEST_CACHE_DIR') or (f"{FARM_DATA_DIR.rstrip('/')}-ingest"
+                                                          if FARM_DATA_DIR else None)
+if FARM_INGEST_DIR and INGEST_CACHE_DIR is None:
+    ingest_root = tempfile.mkdtemp(prefix='uk-dairy-ingest-')
+    ingest_owner = os.getpid()
+    atexit.register(lambda: os.getpid() == ingest_owner and shutil.rmtree(ingest_root, ignore_errors=True))
+    INGEST_CACHE_DIR = os.path.join(ingest_root, 'ingest')
+INGEST_STATUS_PATH = os.path.join(INGEST_CACHE_DIR, 'status.json') if FARM_INGEST_DIR else None
+
+
+def write_ingest_status():
+    written = f"{INGEST_STATUS_PATH}.{os.getpid()}"
+    with open(written, 'w') as f:
+        json.dump(farm_ingestor.status(), f, default=str)
+    os.replace(written, INGEST_STATUS_PATH)
+
+
+if FARM_INGEST_DIR:
+    os.makedirs(INGEST_CACHE_DIR, exist_ok=True)
+    farm_ingestor = FarmFileIngestor(FARM_INGEST_DIR, cache_dir=INGEST_CACHE_DIR)
+    with drop_lock(INGEST_CACHE_DIR):
+        farms_df = open_drop_table(INGEST_CACHE_DIR)
+        if farms_df is None:
+            farm_ingestor.scan()
+            write_ingest_status()
+            if write_drop_table(INGEST_CACHE_DIR, farm_ingestor) is None:
+                raise RuntimeError(f"No valid farm data in {FARM_INGEST_DIR} "
+                                   "(run farm_ingest.py on it for the rejects)")
+            farms_df = open_drop_table(INGEST_CACHE_DIR)
+elif FARM_DATA_DIR:
+    farms_df = load_or_build_farm_store(FARM_DATA_DIR, FARM_COUNT, seed=FARM_SEED)
+elif FARM_BACKEND == 'sqlite':
+    store_root = tempfile.mkdtemp(prefix='uk-dairy-farms-')
+    store_owner = os.getpid()
+    atexit.register(lambda: os.getpid() == store_owner and shutil.rmtree(store_root, ignore_errors=True))
+    farms_df = load_or_build_farm_store(os.path.join(store_root, 'farms'), FARM_COUNT, seed=FARM_SEED)
+else:
+    farms_df = apply_farm_schema(generate_farm_data(n_farms=FARM_COUNT, seed=FARM_SEED))
+
+# Small portfolios are shipped to the browser once and filtered there
+# (CLIENTSIDE_MAX_FARMS=0 keeps every portfolio on the server path). The mode is
+# chosen at startup from the portfolio size.
+CLIENTSIDE_MAX_FARMS = int(os.environ.get('CLIENTSIDE_MAX_FARMS', 5000))
+CLIENTSIDE_FILTERING = len(farms_df) <= CLIENTSIDE_MAX_FARMS
+
+# The live store owns the farm table and the structures derived from it: the bitmap
+# index over the dropdown columns, the trigram index for the search box, the
+# aggregate cube (none of these three with the sqlite backend) and the table query
+# helper. Its version identifies the data the caches were computed from. Added and
+# edited farms go through a write journal every worker replays before serving a
+# request, so all workers hold the same farms; it sits next to the shared farm
+# store, or in a private temporary directory inherited by the workers of a preloaded
+# app. Changes to a supplier drop reach the workers through the same journal (see
+# reload_farm_drops).
+FARM_JOURNAL_PATH = (os.environ.get('FARM_JOURNAL_PATH')
+                     or (f"{FARM_DATA_DIR.rstrip('/')}-writes.jsonl" if FARM_DATA_DIR else None))
+if FARM_JOURNAL_PATH is None:
+    journal_root = tempfile.mkdtemp(prefix='uk-dairy-writes-')
+    journal_owner = os.getpid()
+    atexit.register(lambda: os.getpid() == journal_owner and shutil.rmtree(journal_root, ignore_errors=True))
+    FARM_JOURNAL_PATH = os.path.join(journal_root, 'writes.jsonl')
+load_drop_table = functools.partial(open_drop_table, INGEST_CACHE_DIR) if FARM_INGEST_DIR else None
+live_store = LiveFarmStore(farms_df, FARM_JOURNAL_PATH, load_drop_table, indexed=FARM_BACKEND != 'sqlite')
+live_store.sync()
+
+# Callbacks reading the live store hold its shared lock, so a write never changes
+# the table or the indexes under them
+def reads_store(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with live_store.reading():
+            return func(*args, **kwargs)
+    return wrapper
+
+# Monthly metric history with precomputed monthly / quarterly rollups, for the
+# quarter-over-quarter changes on the cards. Each month keeps a snapshot of the farm
+# table as loaded in that month, so changes appear once two quarters have been
+# recorded; HISTORY_BACKFILL=1 fills the earlier months with synthetic snapshots
+# instead (for demos of a generated portfolio; ingested drops only ever get their
+# own snapshots). It sits next to the shared farm store; a per-process
+# portfolio gets a private history that is removed on exit.
+HISTORY_MONTHS = int(os.environ.get('HISTORY_MONTHS', DEFAULT_HISTORY_MONTHS))
+HISTORY_BACKFILL = os.environ.get('HISTORY_BACKFILL') == '1' and not FARM_INGEST_DIR
+HISTORY_DIR = os.environ.get('HISTORY_DIR') or (f"{FARM_DATA_DIR.rstrip('/')}-history" if FARM_DATA_DIR else None)
+if HISTORY_MONTHS > 0 and HISTORY_DIR is None:
+    history_root = tempfile.mkdtemp(prefix='uk-dairy-history-')
+    history_owner = os.getpid()
+    atexit.register(lambda: os.getpid() == history_owner and shutil.rmtree(history_root, ignore_errors=True))
+    HISTORY_DIR = os.path.join(history_root, 'history')
+
+
+def record_history(df):
+    if HISTORY_MONTHS <= 0:
+        return None
+    return load_or_build_history(HISTORY_DIR, df, HISTORY_MONTHS, backfill=HISTORY_BACKFILL, seed=FARM_SEED)
+
+
+farm_history = record_history(live_store.df)
+
+# FARM_BACKEND=sqlite answers the dashboard filters and aggregates with SQL over a
+# SQLite copy of the table (indexed dropdown columns, FTS5 search), read through a
+# per-worker connection pool. Like the history it sits next to the shared farm
+# store, or in a private temporary directory without one. Workers then keep no
+# bitmap index, search index or aggregate cube, and the table itself is a shared
+# memory map; added and edited farms reach the database through the write journal
+# (SqliteFarmStore.sync before each request), so it stays current. The default
+# 'pandas' backend keeps everything on the in-memory indexes.
+FARM_SQLITE_PATH = (os.environ.get('FARM_SQLITE_PATH')
+                    or (f"{FARM_DATA_DIR.rstrip('/')}.sqlite" if FARM_DATA_DIR else None))
+SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', DEFAULT_POOL_SIZE))
+if FARM_BACKEND == 'sqlite' and FARM_SQLITE_PATH is None:
+    sqlite_root = tempfile.mkdtemp(prefix='uk-dairy-sqlite-')
+    sqlite_owner = os.getpid()
+    atexit.register(lambda: os.getpid() == sqlite_owner and shutil.rmtree(sqlite_root, ignore_errors=True))
+    FARM_SQLITE_PATH = os.path.join(sqlite_root, 'farms.sqlite')
+farm_sql = (load_or_build_farm_sqlite(FARM_SQLITE_PATH, live_store.df.base, SQLITE_POOL_SIZE, FARM_JOURNAL_PATH,
+                                      load_drop_table)
+            if FARM_BACKEND == 'sqlite' else None)
+
+# Farms matching the filters (None = every farm), from SQLite. The database may
+# already hold a farm another worker added since this one last synced; positions
+# past this worker's table are left out.
+def sql_positions(search_value='', region='all', tier='all', risk='all'):
+    positions = farm_sql.positions(search_value, region, tier, risk)
+    return positions if positions is None else positions[positions < len(live_store.df)]
+
+
+# The dropdown filters, the values of the cube dimensions and the aggregate cube,
+# from whichever backend serves them
+def farm_positions(region='all', tier='all', risk='all'):
+    if farm_sql is not None:
+        return sql_positions('', region, tier, risk)
+    return live_store.index.positions(region, tier, risk)
+
+
+def farm_dimensions():
+    return farm_sql.dimensions() if farm_sql is not None else live_store.cube.dimensions
+
+
+def farm_cube():
+    return farm_sql.cube() if farm_sql is not None else live_store.cube
+
+
+# LRU caches of dashboard panel outputs and of the filtered selections they share,
+# per filter combination
+dashboard_cache = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('RESULT_CACHE_MB', 64)) * 1024 * 1024
+)
+selection_cache = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('RESULT_CACHE_MB', 64)) * 1024 * 1024
+)
+
+
+# Writes to the store bump its version; drop every cached result of older versions
+live_store.subscribe(dashboard_cache.invalidate)
+live_store.subscribe(selection_cache.invalidate)
+
+
+# Heavy callbacks (analytics, reports, scenarios) run as Dash background callbacks
+# on a disk-backed job manager: they report progress and their results are cached
+# per inputs and dataset version. A running analytics or scenario job is cancelled
+# when its inputs change again, and any of them when the user leaves the page.
+# Without diskcache installed, or with BACKGROUND_CALLBACKS=0 (e.g. to profile
+# them in-process), they run inline and cannot be cancelled.
+background = BackgroundCallbacks(app, create_background_manager(
+    os.environ.get('BACKGROUND_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'uk-dairy-background')),
+    cache_by=[lambda: live_store.version],
+    expire=int(os.environ.get('BACKGROUND_CACHE_SECONDS', 3600))
+) if os.environ.get('BACKGROUND_CALLBACKS', '1') != '0' else None)
+
+# Opt-in callback instrumentation (METRICS_ENABLED=1): Server-Timing headers on
+# every callback response and Prometheus metrics at /metrics. METRICS_DIR lets the
+# gunicorn workers share their counters so /metrics reports all of them.
+# /metrics needs METRICS_TOKEN as a bearer token, or is local-only without one.
+callback_metrics = CallbackMetrics(
+    enabled=os.environ.get('METRICS_ENABLED') == '1',
+    directory=os.environ.get('METRICS_DIR'),
+    token=os.environ.get('METRICS_TOKEN')
+)
+callback_metrics.init_app(app)
+
+
+# Drop reloads. One worker of the deployment polls the directory (the first to
+# take the poller lock; another takes over if it exits). A changed file is parsed
+# once into the shared cache, and the change goes into the write journal under the
+# drop lock: the new and changed farms as writes, or, when farms were removed or
+# many changed, a rebuilt drop table every worker moves to. Farms added and edited
+# through the dashboard keep their edits either way (see LiveFarmStore).
+ingest_lock = threading.Lock()
+ingest_poller = {'pid': None}
+
+
+def reload_farm_drops():
+    with ingest_lock:
+        if not farm_ingestor.scan():
+            return False
+        with drop_lock(INGEST_CACHE_DIR):
+            write_ingest_status()
+            live_store.sync()
+            files = farm_ingestor.files()
+            if files == live_store.drop_files:
+                return False
+            changes = farm_ingestor.changes(live_store.drop_files or {})
+            if changes is not None and not changes[1] and len(changes[0]) <= MAX_DELTA_ROWS:
+                live_store.load_drop(files, changes[0])
+            else:
+                version = write_drop_table(INGEST_CACHE_DIR, farm_ingestor)
+                # An emptied drop directory keeps the last good table
+                if version is None:
+                    return False
+                live_store.rebase(version)
+            prune_partitions(INGEST_CACHE_DIR, files)
+        return True
+
+
+def poll_farm_drops():
+    with open(os.path.join(INGEST_CACHE_DIR, 'poller.lock'), 'w') as lock:
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(INGEST_POLL_SECONDS)
+        while True:
+            time.sleep(INGEST_POLL_SECONDS)
+            try:
+                reload_farm_drops()
+            except Exception:
+                server.logger.exception("Reloading farm drops from %s failed", FARM_INGEST_DIR)
+
+
+@server.before_request
+def sync_farm_writes():
+    live_store.sync()
+    if farm_sql is not None:
+        farm_sql.sync()
+
+
+# The first request of a new month snapshots the table as that month's partition;
+# the cached card notes and scorecards were computed from last month's rollups
+history_lock = threading.Lock()
+
+
+@server.before_request
+def roll_history_month():
+    global farm_history
+    if farm_history is None or farm_history.months[-1] == datetime.now().strftime('%Y-%m'):
+        return
+    with history_lock, live_store.reading():
+        if farm_history.months[-1] != datetime.now().strftime('%Y-%m'):
+            farm_history = record_history(live_store.df)
+            dashboard_cache.invalidate()
+            farm_detail_cache.invalidate()
+
+
+# After a drop change each worker snapshots the new table into the history (the
+# first one writes it)
+drop_state = {'files': live_store.drop_files}
+
+
+@server.before_request
+def refresh_drop_snapshots():
+    global farm_history
+    if live_store.drop_files == drop_state['files']:
+        return
+    with history_lock:
+        with live_store.reading():
+            df = live_store.snapshot()
+            files = live_store.drop_files
+        if files != drop_state['files']:
+            farm_history = record_history(df)
+            drop_state['files'] = files
+            dashboard_cache.invalidate()
+            farm_detail_cache.invalidate()
+
+
+# Workers forked from a preloaded app do not inherit threads, so each process starts
+# its poller thread on its first request; all but one wait on the poller lock
+@server.before_request
+def start_ingest_poller():
+    if not FARM_INGEST_DIR or INGEST_POLL_SECONDS <= 0 or ingest_poller['pid'] == os.getpid():
+        return
+    with ingest_lock:
+        if ingest_poller['pid'] != os.getpid():
+            ingest_poller['pid'] = os.getpid()
+            threading.Thread(target=poll_farm_drops, name='farm-ingest', daemon=True).start()
+
+
+@server.route('/ingest-status')
+def ingest_status():
+    if not FARM_INGEST_DIR:
+        flask.abort(404)
+    try:
+        with open(INGEST_STATUS_PATH) as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        status = {'directory': FARM_INGEST_DIR, 'files': [], 'rejects': []}
+    return dict(status, dataset_version=live_store.version)
+
+
+@server.route('/cache-stats')
+def cache_stats():
+    return {'panels': dashboard_cache.stats(), 'selections': selection_cache.stats(),
+            'farm_details': farm_detail_cache.stats()}
+
+# Dashboard building blocks. The static parts of every panel live in the layout;
+# callbacks only fill in values and patch chart data.
+def metric_card(value_id, label, note, color, note_color, note_id=None):
+    note_props = {'id': note_id} if note_id else {}
+    return html.Div([
+        html.Div(id=value_id, style={'fontSize': '2.5rem', 'fontWeight': 'bold', 'color': color}),
+        html.Div(label, style={'color': '#6b7280', 'marginTop': '0.5rem'}),
+        html.Div(note, style={'fontSize': '0.8rem', 'color': note_color}, **note_props)
+    ], style={
+        'width': '24%',
+        'backgroundColor': 'white',
+        'padding': '1.5rem',
+        'borderRadius': '12px',
+        'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)',
+        'textAlign': 'center'
+    })
+
+def metric_row(label, value_id, color, last=False, value=None):
+    style = {'display': 'flex', 'justifyContent': 'space-between'}
+    if not last:
+        style['marginBottom'] = '0.8rem'
+    return html.Div([
+        html.Span(label, style={'color': '#6b7280'}),
+        html.Span(value, id=value_id, style={'fontWeight': 'bold', 'color': color})
+    ], style=style)
+
+# Metrics the farm records do not cover yet are shown as a fixed placeholder
+NOT_MEASURED = "not yet measured"
+
+
+FARM_TABLE_COLUMNS = ['name', 'id', 'region', 'supplier_tier', 'size',
+                      'overall_score', 'tnfd_compliant', 'drought_risk', 'flood_risk']
+
+# Supplier table: paged, sorted and filtered on the server over the whole portfolio,
+# or natively in the browser in client-side mode
+def farm_table():
+    action = 'native' if CLIENTSIDE_FILTERING else 'custom'
+    return dash_table.DataTable(
+        id='farm-table',
+        data=[],
+        columns=[
+            {'name': 'Farm Name', 'id': 'name'},
+            {'name': 'ID', 'id': 'id'},
+            {'name': 'Region', 'id': 'region'},
+            {'name': 'Tier', 'id': 'supplier_tier'},
+            {'name': 'Size (ha)', 'id': 'size', 'type': 'numeric'},
+            {'name': 'Score', 'id': 'overall_score', 'type': 'numeric'},
+            {'name': 'TNFD', 'id': 'tnfd_compliant'},
+            {'name': 'Drought Risk', 'id': 'drought_risk'},
+            {'name': 'Flood Risk', 'id': 'flood_risk'}
+        ],
+        style_cell={
+            'textAlign': 'left',
+            'padding': '10px',
+            'fontFamily': 'Arial, sans-serif'
+        },
+        style_data_conditional=[
+            {
+                'if': {'row_index': 'odd'},
+                'backgroundColor': '#f9fafb'
+            },
+            {
+                'if': {'column_id': 'supplier_tier', 'filter_query': '{supplier_tier} = Gold'},
+                'backgroundColor': '#fef3c7',
+                'color': '#92400e'
+            },
+            {
+                'if': {'column_id': 'supplier_tier', 'filter_query': '{supplier_tier} = Silver'},
+                'backgroundColor': '#f3f4f6',
+                'color': '#374151'
+            },
+            {
+                'if': {'column_id': 'supplier_tier', 'filter_query': '{supplier_tier} = Bronze'},
+                'backgroundColor': '#fed7aa',
+                'color': '#92400e'
+            }
+        ],
+        style_header={
+            'backgroundColor': '#f3f4f6',
+            'fontWeight': 'bold',
+            'borderBottom': '2px solid #e5e7eb'
+        },
+        page_current=0,
+        page_size=20,
+        page_action=action,
+        sort_action=action,
+        sort_mode="multi",
+        sort_by=[],
+        filter_action=action,
+        filter_query='',
+        filter_options={'case': 'insensitive'}
+    )
+
+# Add Farm form: (field, label, dropdown options or input type, default)
+ADD_FARM_FIELDS = [
+    ('name', "Farm Name", 'text', None),
+    ('region', "Region", REGIONS, REGIONS[0]),
+    ('latitude', "Latitude", 'number', 50.9),
+    ('longitude', "Longitude", 'number', -3.75),
+    ('supplier_tier', "Supplier Tier", SUPPLIER_TIERS, 'Bronze'),
+    ('nvz_status', "NVZ Status", NVZ_STATUS, 'Non-NVZ'),
+    ('drought_risk', "Drought Risk", RISK_LEVELS, 'Low'),
+    ('flood_risk', "Flood Risk", RISK_LEVELS, 'Low'),
+    ('size', "Size (ha)", 'number', 200),
+    ('herd_size', "Herd Size", 'number', 200),
+    ('natural_habitat', "Natural Habitat (%)", 'number', 15),
+    ('soil_health', "Soil Health", 'number', 4.5),
+    ('water_efficiency', "Water Efficiency (%)", 'number', 80),
+    ('biodiversity_score', "Biodiversity Score", 'number', 60),
+    ('nitrogen_efficiency', "Nitrogen Efficiency (%)", 'number', 65),
+    ('phosphorus_efficiency', "Phosphorus Efficiency (%)", 'number', 65),
+    ('overall_score', "Overall Score", 'number', 70),
+    ('milk_volume', "Milk Volume (L)", 'number', 1000000),
+    ('sustainabilit_premium', "Sustainability Premium (£)", 'number', 0)
+]
+ADD_FARM_FLAGS = [
+    {'label': ' TNFD Compliant', 'value': 'tnfd_compliant'},
+    {'label': ' SFI Enrolled', 'value': 'sfi_enrolled'},
+    {'label': ' CS Enrolled', 'value': 'cs_enrolled'}
+]
+
+def add_farm_form():
+    fields = []
+    for field, label, kind, default in ADD_FARM_FIELDS:
+        if isinstance(kind, list):
+            control = dcc.Dropdown(id=f'add-farm-{field}', options=[{'label': v, 'value': v} for v in kind],
+                                   value=default, clearable=False)
+        else:
+            control = dcc.Input(id=f'add-farm-{field}', type=kind, value=default,
+                                style={'width': '100%', 'padding': '0.4rem', 'borderRadius': '6px',
+                                       'border': '1px solid #d1d5db'})
+        fields.append(html.Div([
+            html.Label(label, style={'fontWeight': 'bold', 'marginBottom': '0.3rem', 'display': 'block'}),
+            control
+        ], style={'width': '23%', 'marginRight': '2%', 'marginBottom': '1rem'}))
+    
+    return html.Div([
+        html.Div(fields, style={'display': 'flex', 'flexWrap': 'wrap'}),
+        dcc.Checklist(id='add-farm-flags', options=ADD_FARM_FLAGS, value=[],
+                      inline=True, inputStyle={'marginLeft': '1rem'}),
+        html.Div([
+            html.Button("Save Farm", id='add-farm-save',
+                        style={'marginRight': '1rem', 'padding': '0.5rem 1rem', 'backgroundColor': '#10b981',
+                               'color': 'white', 'border': 'none', 'borderRadius': '6px', 'cursor': 'pointer'}),
+            html.Button("Cancel", id='add-farm-cancel',
+                        style={'padding': '0.5rem 1rem', 'border': '1px solid #d1d5db', 'borderRadius': '6px',
+                               'backgroundColor': 'white', 'cursor': 'pointer'})
+        ], style={'marginTop': '1rem'})
+    ], id='add-farm-form', style={'display': 'none', 'padding': '1.5rem', 'marginBottom': '1rem',
+                                  'backgroundColor': '#f9fafb', 'borderRadius': '12px',
+                                  'border': '1px solid #e5e7eb'})
+
+# The date of the newest change to the farms (an added or edited farm, or a farm's
+# own date in the loaded data), for the header. The dashboard layout is rebuilt
+# when the store's version moves, so the date follows the data rather than the
+# time the layout was built.
+def data_last_updated():
+    latest = live_store.df['last_updated'].max()
+    return "—" if pd.isna(latest) else latest.strftime('%d/%m/%Y')
 
 # Page layouts
 def get_dashboard_layout():
@@ -86,11 +564,11 @@ def get_dashboard_layout():
                     ], style={'display': 'flex', 'alignItems': 'center', 'marginRight': '20px'}),
                     
                     html.Div([
-                        html.Span("270 Supplier Farms", style={'color': '#e0e7ff'})
+                        html.Span(f"{len(live_store.df):,} Supplier Farms", style={'color': '#e0e7ff'})
                     ], style={'marginRight': '20px'}),
                     
                     html.Div([
-                        html.Span(f"Last Updated: {datetime.now().strftime('%d/%m/%Y')}", 
+                        html.Span(f"Last Updated: {data_last_updated()}", 
                                  style={'color': '#e0e7ff'})
                     ])
                 ], style={'display': 'flex', 'alignItems': 'center'})
@@ -123,7 +601,7 @@ def get_dashboard_layout():
                         dcc.Dropdown(
                             id='region-dropdown',
                             options=[{'label': 'All Regions', 'value': 'all'}] + 
-                                    [{'label': r, 'value': r} for r in farms_df['region'].unique()],
+                                    [{'label': r, 'value': r} for r in farm_dimensions()['region']],
                             value='all',
                             style={'width': '100%'}
                         )
@@ -134,7 +612,7 @@ def get_dashboard_layout():
                         dcc.Dropdown(
                             id='tier-dropdown',
                             options=[{'label': 'All Tiers', 'value': 'all'}] + 
-                                    [{'label': t, 'value': t} for t in farms_df['supplier_tier'].unique()],
+                                    [{'label': t, 'value': t} for t in farm_dimensions()['supplier_tier']],
                             value='all',
                             style={'width': '100%'}
                         )
@@ -167,7 +645,17 @@ def get_dashboard_layout():
             }),
             
             # Metrics Cards
-            html.Div(id='metrics-cards', style={'marginBottom': '2rem'}),
+            html.Div([
+                html.Div([
+                    metric_card('metric-total-farms', "Total Farms", "suppliers", '#1e40af', '#9ca3af'),
+                    metric_card('metric-tnfd-compliance', "TNFD Compliance", None, '#10b981', '#9ca3af',
+                                'metric-tnfd-compliance-change'),
+                    metric_card('metric-avg-score', "Avg Score", None, '#f59e0b', '#9ca3af',
+                                'metric-avg-score-change'),
+                    metric_card('metric-high-risk', "High Risk Farms", None, '#ef4444', '#9ca3af',
+                                'metric-high-risk-change')
+                ], style={'display': 'flex', 'justifyContent': 'space-between'})
+            ], id='metrics-cards', style={'marginBottom': '2rem'}),
             
             # TNFD Metrics Section
             html.Div([
@@ -175,7 +663,11 @@ def get_dashboard_layout():
                     html.Div([
                         html.Div([
                             html.H4("🌿 Land Metrics", style={'color': '#059669', 'marginBottom': '1rem'}),
-                            html.Div(id='land-metrics-content')
+                            html.Div([
+                                metric_row("Natural Habitat Coverage", 'land-habitat-area', '#059669'),
+                                metric_row("Soil Health Compliance", 'land-soil-compliance', '#059669'),
+                                metric_row("Peatland Exposure", 'land-peatland', '#9ca3af', last=True, value=NOT_MEASURED)
+                            ], id='land-metrics-content')
                         ], style={
                             'backgroundColor': '#ecfdf5',
                             'padding': '1.5rem',
@@ -187,7 +679,11 @@ def get_dashboard_layout():
                     html.Div([
                         html.Div([
                             html.H4("💧 Water Metrics", style={'color': '#2563eb', 'marginBottom': '1rem'}),
-                            html.Div(id='water-metrics-content')
+                            html.Div([
+                                metric_row("Average Efficiency", 'water-avg-efficiency', '#2563eb'),
+                                metric_row("Compliance Rate", 'water-compliance', '#2563eb'),
+                                metric_row("Risk Exposure", 'water-risk-exposure', '#2563eb', last=True)
+                            ], id='water-metrics-content')
                         ], style={
                             'backgroundColor': '#eff6ff',
                             'padding': '1.5rem',
@@ -199,7 +695,12 @@ def get_dashboard_layout():
                     html.Div([
                         html.Div([
                             html.H4("🌳 Biodiversity Metrics", style={'color': '#7c3aed', 'marginBottom': '1rem'}),
-                            html.Div(id='biodiversity-metrics-content')
+                            html.Div([
+                                metric_row("Average Score", 'bio-avg-score', '#7c3aed'),
+                                metric_row("Species Richness", 'bio-species-richness', '#9ca3af', value=NOT_MEASURED),
+                                metric_row("Habitat Connectivity", 'bio-connectivity', '#9ca3af', last=True,
+                                           value=NOT_MEASURED)
+                            ], id='biodiversity-metrics-content')
                         ], style={
                             'backgroundColor': '#f5f3ff',
                             'padding': '1.5rem',
@@ -215,7 +716,7 @@ def get_dashboard_layout():
                 html.Div([
                     html.Div([
                         html.H4("Regional Performance", style={'marginBottom': '1rem'}),
-                        dcc.Graph(id='regional-performance-chart')
+                        dcc.Graph(id='regional-performance-chart', figure=REGIONAL_PERFORMANCE.skeleton())
                     ], style={
                         'backgroundColor': 'white',
                         'padding': '1.5rem',
@@ -227,7 +728,7 @@ def get_dashboard_layout():
                 html.Div([
                     html.Div([
                         html.H4("Risk Assessment", style={'marginBottom': '1rem'}),
-                        dcc.Graph(id='risk-assessment-chart')
+                        dcc.Graph(id='risk-assessment-chart', figure=RISK_ASSESSMENT.skeleton())
                     ], style={
                         'backgroundColor': 'white',
                         'padding': '1.5rem',
@@ -242,7 +743,7 @@ def get_dashboard_layout():
                 html.Div([
                     html.Div([
                         html.H4("Supplier Tier Distribution", style={'marginBottom': '1rem'}),
-                        dcc.Graph(id='tier-distribution-chart')
+                        dcc.Graph(id='tier-distribution-chart', figure=TIER_DISTRIBUTION.skeleton())
                     ], style={
                         'backgroundColor': 'white',
                         'padding': '1.5rem',
@@ -254,7 +755,7 @@ def get_dashboard_layout():
                 html.Div([
                     html.Div([
                         html.H4("Environmental Scheme Enrollment", style={'marginBottom': '1rem'}),
-                        dcc.Graph(id='scheme-enrollment-chart')
+                        dcc.Graph(id='scheme-enrollment-chart', figure=SCHEME_ENROLLMENT.skeleton())
                     ], style={
                         'backgroundColor': 'white',
                         'padding': '1.5rem',
@@ -269,19 +770,42 @@ def get_dashboard_layout():
                 html.Div([
                     html.H3("Supplier Farm Overview", style={'flex': 1}),
                     html.Div([
-                        html.Button("Export Data", id='export-btn', 
-                                   style={'marginRight': '1rem', 'padding': '0.5rem 1rem',
-                                         'border': '1px solid #d1d5db', 'borderRadius': '6px',
-                                         'backgroundColor': 'white', 'cursor': 'pointer'}),
+                        dcc.Dropdown(
+                            id='export-format',
+                            options=[
+                                {'label': 'CSV', 'value': 'csv'},
+                                {'label': 'Parquet', 'value': 'parquet'},
+                                {'label': 'Arrow', 'value': 'arrow'}
+                            ],
+                            value='csv',
+                            clearable=False,
+                            searchable=False,
+                            style={'width': '110px', 'marginRight': '0.5rem'}
+                        ),
+                        html.A(
+                            html.Button("Export Data", id='export-btn', 
+                                       style={'marginRight': '1rem', 'padding': '0.5rem 1rem',
+                                             'border': '1px solid #d1d5db', 'borderRadius': '6px',
+                                             'backgroundColor': 'white', 'cursor': 'pointer'}),
+                            id='export-link', href='/export/farms.csv'
+                        ),
                         html.Button("Add Farm", id='add-farm-btn',
                                    style={'padding': '0.5rem 1rem', 'backgroundColor': '#10b981',
                                          'color': 'white', 'border': 'none', 'borderRadius': '6px',
                                          'cursor': 'pointer'})
-                    ])
+                    ], style={'display': 'flex', 'alignItems': 'center'})
                 ], style={'display': 'flex', 'justifyContent': 'space-between', 'alignItems': 'center',
                          'marginBottom': '1rem'}),
                 
-                html.Div(id='farm-table-container')
+                add_farm_form(),
+                html.Div(id='add-farm-status', style={'marginBottom': '1rem', 'color': '#059669'}),
+                dcc.Store(id='dataset-version', data=live_store.version),
+                dcc.Store(id='farm-data', data=client_payload(live_store.df, farm_history)) if CLIENTSIDE_FILTERING else None,
+                
+                html.Div([
+                    html.Div(id='farm-table-message'),
+                    farm_table()
+                ], id='farm-table-container')
             ], style={
                 'backgroundColor': 'white',
                 'padding': '2rem',
@@ -291,33 +815,229 @@ def get_dashboard_layout():
         ], style={'padding': '2rem', 'backgroundColor': '#f9fafb'})
     ])
 
+def labelled_dropdown(label, dropdown_id, options, value, width='18%'):
+    return html.Div([
+        html.Label(label, style={'fontWeight': 'bold', 'marginBottom': '0.5rem', 'display': 'block'}),
+        dcc.Dropdown(id=dropdown_id, options=options, value=value, clearable=False, style={'width': '100%'})
+    ], style={'width': width})
+
 def get_analytics_layout():
+    axis_options = [{'label': label, 'value': column} for column, label in SCATTER_AXES.items()]
     return html.Div([
         html.H1("Analytics", style={'marginBottom': '2rem'}),
-        html.P("Detailed analytics and insights coming soon...", style={'fontSize': '1.2rem', 'color': '#6b7280'}),
-        # Add analytics content here
-    ], style={'padding': '2rem'})
+        
+        html.Div([
+            labelled_dropdown("X Axis", 'analytics-x', axis_options, 'nitrogen_efficiency'),
+            labelled_dropdown("Y Axis", 'analytics-y', axis_options, 'biodiversity_score'),
+            labelled_dropdown("Region", 'analytics-region',
+                              [{'label': 'All Regions', 'value': 'all'}] +
+                              [{'label': r, 'value': r} for r in farm_dimensions()['region']], 'all'),
+            labelled_dropdown("Supplier Tier", 'analytics-tier',
+                              [{'label': 'All Tiers', 'value': 'all'}] +
+                              [{'label': t, 'value': t} for t in farm_dimensions()['supplier_tier']], 'all'),
+            labelled_dropdown("Risk Level", 'analytics-risk',
+                              [{'label': 'All Risk Levels', 'value': 'all'}] +
+                              [{'label': r, 'value': r} for r in RISK_LEVELS], 'all')
+        ], style={
+            'display': 'flex',
+            'justifyContent': 'space-between',
+            'padding': '2rem',
+            'backgroundColor': 'white',
+            'borderRadius': '12px',
+            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)',
+            'marginBottom': '2rem'
+        }),
+        
+        html.Div([
+            html.H4("Farm Comparison", style={'marginBottom': '0.5rem'}),
+            html.Div(id='farm-scatter-summary', style={'color': '#6b7280', 'fontSize': '0.9rem'}),
+            dcc.Loading(dcc.Graph(id='farm-scatter-chart', figure=FARM_SCATTER.skeleton()))
+        ], style={
+            'backgroundColor': 'white',
+            'padding': '1.5rem',
+            'borderRadius': '12px',
+            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)',
+            'marginBottom': '2rem'
+        }),
+        
+        html.Div([
+            html.H4("Farm Map", style={'marginBottom': '0.5rem'}),
+            html.Div(id='farm-map-summary', style={'color': '#6b7280', 'fontSize': '0.9rem',
+                                                   'marginBottom': '0.5rem'}),
+            dcc.Graph(id='farm-map', figure=FARM_MAP.skeleton(), config={'scrollZoom': True})
+        ], style={
+            'backgroundColor': 'white',
+            'padding': '1.5rem',
+            'borderRadius': '12px',
+            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)',
+            'marginBottom': '2rem'
+        }),
+        
+        html.Div([
+            html.H4("Monthly Trend", style={'marginBottom': '1rem'}),
+            dcc.Graph(id='metric-trend-chart', figure=METRIC_TREND.skeleton())
+        ], style={
+            'backgroundColor': 'white',
+            'padding': '1.5rem',
+            'borderRadius': '12px',
+            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)'
+        })
+    ], style={'padding': '2rem', 'backgroundColor': '#f9fafb'})
 
 def get_tnfd_layout():
+    trial_counts = sorted({500, SCENARIO_TRIALS, 10000})
     return html.Div([
         html.H1("TNFD Metrics", style={'marginBottom': '2rem'}),
-        html.P("Task Force on Nature-related Financial Disclosures metrics...", style={'fontSize': '1.2rem', 'color': '#6b7280'}),
-        # Add TNFD content here
-    ], style={'padding': '2rem'})
+        
+        html.Div([
+            html.H3("Climate Scenario Stress Test", style={'marginBottom': '0.5rem', 'color': '#1f2937'}),
+            html.P("Monte Carlo trials of a bad climate year across the supplier farms: which farms are hit by "
+                   "drought or flood, and how much milk the portfolio loses.",
+                   style={'color': '#6b7280', 'marginBottom': '1.5rem'}),
+            html.Div([
+                labelled_dropdown("Scenario", 'climate-scenario',
+                                  [{'label': params['label'], 'value': name}
+                                   for name, params in CLIMATE_SCENARIOS.items()], 'drought', width='32%'),
+                labelled_dropdown("Region", 'climate-region',
+                                  [{'label': 'All Regions', 'value': 'all'}] +
+                                  [{'label': r, 'value': r} for r in farm_dimensions()['region']], 'all',
+                                  width='32%'),
+                labelled_dropdown("Trials", 'climate-trials',
+                                  [{'label': f"{n:,}", 'value': n} for n in trial_counts], SCENARIO_TRIALS,
+                                  width='32%')
+            ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginBottom': '1.5rem'}),
+            
+            html.Div([
+                metric_card('climate-farms', "Farms Hit (expected)", None, '#f59e0b', '#6b7280',
+                            'climate-farms-note'),
+                metric_card('climate-expected-loss', "Milk Lost (expected)", None, '#ef4444', '#6b7280',
+                            'climate-expected-loss-note'),
+                metric_card('climate-p95-loss', "1-in-20 Year Loss", "95th percentile of trials", '#ef4444',
+                            '#6b7280'),
+                metric_card('climate-p99-loss', "1-in-100 Year Loss", "99th percentile of trials", '#7c3aed',
+                            '#6b7280')
+            ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginBottom': '1.5rem'}),
+            
+            html.Div([
+                html.Div([
+                    html.H4("Loss Distribution", style={'marginBottom': '0.5rem'}),
+                    dcc.Graph(id='climate-loss-chart', figure=CLIMATE_LOSS_DISTRIBUTION.skeleton())
+                ], style={'width': '49%'}),
+                html.Div([
+                    html.H4("Loss by Region", style={'marginBottom': '0.5rem'}),
+                    dcc.Graph(id='climate-region-chart', figure=CLIMATE_REGION_LOSS.skeleton())
+                ], style={'width': '49%'})
+            ], style={'display': 'flex', 'justifyContent': 'space-between'}),
+            html.Div(id='climate-summary', style={'marginTop': '0.5rem', 'color': '#6b7280', 'fontSize': '0.9rem'})
+        ], style={
+            'padding': '2rem',
+            'backgroundColor': 'white',
+            'borderRadius': '12px',
+            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)'
+        })
+    ], style={'padding': '2rem', 'backgroundColor': '#f9fafb'})
 
 def get_farms_layout():
     return html.Div([
         html.H1("Farms Management", style={'marginBottom': '2rem'}),
-        html.P("Manage and view individual farm details...", style={'fontSize': '1.2rem', 'color': '#6b7280'}),
-        # Add farms management content here
-    ], style={'padding': '2rem'})
+        
+        html.Div([
+            html.Div([
+                html.Label("Search", style={'fontWeight': 'bold', 'marginBottom': '0.5rem', 'display': 'block'}),
+                dcc.Input(id='farm-list-search', type='text', placeholder="Farm name or ID...", debounce=True,
+                          style={'width': '100%', 'padding': '0.5rem', 'borderRadius': '6px',
+                                 'border': '1px solid #d1d5db'})
+            ], style={'width': '48%'}),
+            labelled_dropdown("Region", 'farm-list-region',
+                              [{'label': 'All Regions', 'value': 'all'}] +
+                              [{'label': r, 'value': r} for r in farm_dimensions()['region']], 'all',
+                              width='48%')
+        ], style={
+            'display': 'flex',
+            'justifyContent': 'space-between',
+            'padding': '1.5rem 2rem',
+            'backgroundColor': 'white',
+            'borderRadius': '12px',
+            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)',
+            'marginBottom': '2rem'
+        }),
+        
+        html.Div([
+            # Only the rows in view are rendered (assets/farm_list.js); pages are
+            # fetched as the list scrolls towards the end of what is loaded
+            html.Div([
+                html.Div(id='farm-list-status', style={'color': '#6b7280', 'fontSize': '0.9rem',
+                                                       'marginBottom': '0.5rem'}),
+                html.Div(html.Div(id='farm-list-window'), id='farm-list-viewport', style={
+                    'height': '600px',
+                    'overflowY': 'auto',
+                    'border': '1px solid #e5e7eb',
+                    'borderRadius': '8px'
+                })
+            ], style={
+                'width': '40%',
+                'backgroundColor': 'white',
+                'padding': '1.5rem',
+                'borderRadius': '12px',
+                'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)'
+            }),
+            html.Div(id='farm-detail', style={
+                'width': '57%',
+                'backgroundColor': 'white',
+                'padding': '1.5rem',
+                'borderRadius': '12px',
+                'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)'
+            })
+        ], style={'display': 'flex', 'justifyContent': 'space-between', 'alignItems': 'flex-start'}),
+        
+        dcc.Store(id='farm-list-rows', data=[]),
+        dcc.Store(id='farm-list-cursor'),
+        dcc.Store(id='farm-list-scroll', data={'first': 0, 'visible': 15}),
+        dcc.Store(id='farm-list-more'),
+        dcc.Store(id='farm-list-selected')
+    ], style={'padding': '2rem', 'backgroundColor': '#f9fafb'})
 
 def get_reports_layout():
     return html.Div([
         html.H1("Reports", style={'marginBottom': '2rem'}),
-        html.P("Generate and download reports...", style={'fontSize': '1.2rem', 'color': '#6b7280'}),
-        # Add reports content here
-    ], style={'padding': '2rem'})
+        html.Div([
+            html.H3("TNFD Disclosure Pack", style={'marginBottom': '0.5rem', 'color': '#1f2937'}),
+            html.P("Portfolio, regional and supplier-tier disclosures with charts, covering every supplier farm.",
+                   style={'color': '#6b7280', 'marginBottom': '1.5rem'}),
+            html.Div([
+                html.Div([
+                    html.Label("Sections", style={'fontWeight': 'bold', 'marginBottom': '0.5rem', 'display': 'block'}),
+                    dcc.Checklist(id='report-scopes',
+                                  options=[{'label': f" {label}", 'value': scope}
+                                           for scope, label in REPORT_SCOPES.items()],
+                                  value=list(REPORT_SCOPES), inputStyle={'marginRight': '0.3rem'})
+                ], style={'width': '30%'}),
+                html.Div([
+                    html.Label("Format", style={'fontWeight': 'bold', 'marginBottom': '0.5rem', 'display': 'block'}),
+                    dcc.RadioItems(id='report-format',
+                                   options=[{'label': f" {fmt.upper()}", 'value': fmt,
+                                             'disabled': not report_available(fmt)} for fmt in REPORT_FORMATS],
+                                   value='pdf' if report_available('pdf') else 'html',
+                                   inputStyle={'marginRight': '0.3rem'})
+                ], style={'width': '20%'})
+            ], style={'display': 'flex', 'marginBottom': '1.5rem'}),
+            
+            html.Button("Generate Report", id='report-generate',
+                        style={'padding': '0.5rem 1rem', 'backgroundColor': '#10b981', 'color': 'white',
+                               'border': 'none', 'borderRadius': '6px', 'cursor': 'pointer'}),
+            html.Div([
+                html.Progress(id='report-progress', value='0', max='1', style={'width': '300px'})
+            ], style={'marginTop': '1rem'}),
+            html.Div(id='report-status', style={'marginTop': '0.5rem', 'color': '#6b7280'}),
+            html.A("Download report", id='report-download', href='', target='_blank',
+                   style={'display': 'none', 'marginTop': '0.5rem', 'color': '#1e40af', 'fontWeight': 'bold'})
+        ], style={
+            'padding': '2rem',
+            'backgroundColor': 'white',
+            'borderRadius': '12px',
+            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)'
+        })
+    ], style={'padding': '2rem', 'backgroundColor': '#f9fafb'})
 
 def get_settings_layout():
     return html.Div([
@@ -452,390 +1172,867 @@ app.layout = html.Div([
     html.Div(id='page-content', style={'marginLeft': '250px', 'minHeight': '100vh', 'transition': 'margin-left 0.3s ease'})
 ])
 
-# Routing callback
-@app.callback(
-    [Output('page-content', 'children'),
-     Output('nav-dashboard', 'style'),
-     Output('nav-analytics', 'style'),
-     Output('nav-tnfd', 'style'),
-     Output('nav-farms', 'style'),
-     Output('nav-reports', 'style'),
-     Output('nav-settings', 'style')],
-    [Input('url', 'pathname')]
-)
+# Routing. Page skeletons are built once and kept as plain JSON-ready dicts, so a
+# route change only serializes a cached tree. The dashboard, analytics, farms and
+# TNFD skeletons embed the dataset version (farm count, region dropdown options)
+# and are rebuilt when it changes.
+PAGE_LAYOUTS = {
+    '/analytics': get_analytics_layout,
+    '/tnfd-metrics': get_tnfd_layout,
+    '/farms': get_farms_layout,
+    '/reports': get_reports_layout,
+    '/settings': get_settings_layout
+}
+VERSIONED_LAYOUTS = (get_dashboard_layout, get_analytics_layout, get_farms_layout, get_tnfd_layout)
+page_layout_cache = {}
+
+def page_layout(pathname):
+    build = PAGE_LAYOUTS.get(pathname, get_dashboard_layout)
+    version = live_store.version if build in VERSIONED_LAYOUTS else None
+    cached = page_layout_cache.get(build.__name__)
+    if cached is None or cached[0] != version:
+        layout = json.loads(json.dumps(build(), cls=plotly.utils.PlotlyJSONEncoder))
+        cached = page_layout_cache[build.__name__] = (version, layout)
+    return cached[1]
+
+@app.callback(Output('page-content', 'children'), [Input('url', 'pathname')])
+@callback_metrics.observe
+@reads_store
 def display_page(pathname):
-    # Default styles
-    active_style = {
-        'display': 'block',
-        'padding': '0.75rem 1.5rem',
-        'color': 'white',
-        'textDecoration': 'none',
-        'borderRadius': '8px',
-        'marginBottom': '0.5rem',
-        'backgroundColor': 'rgba(255,255,255,0.2)',
-        'transition': 'all 0.3s'
+    with callback_metrics.phase('render'):
+        return page_layout(pathname)
+
+# Nav highlighting runs in the browser; the server never sends link styles
+NAV_LINKS = [('/', 'nav-dashboard'), ('/analytics', 'nav-analytics'), ('/tnfd-metrics', 'nav-tnfd'),
+             ('/farms', 'nav-farms'), ('/reports', 'nav-reports'), ('/settings', 'nav-settings')]
+NAV_INACTIVE_STYLE = {
+    'display': 'block',
+    'padding': '0.75rem 1.5rem',
+    'color': 'rgba(255,255,255,0.8)',
+    'textDecoration': 'none',
+    'borderRadius': '8px',
+    'marginBottom': '0.5rem',
+    'transition': 'all 0.3s'
+}
+NAV_ACTIVE_STYLE = dict(NAV_INACTIVE_STYLE, color='white', backgroundColor='rgba(255,255,255,0.2)')
+
+app.clientside_callback(
+    """
+    function(pathname) {
+        const paths = %s;
+        const current = paths.includes(pathname) ? pathname : '/';
+        return paths.map(path => path === current ? %s : %s);
     }
+    """ % (json.dumps([path for path, _ in NAV_LINKS]), json.dumps(NAV_ACTIVE_STYLE),
+           json.dumps(NAV_INACTIVE_STYLE)),
+    [Output(nav_id, 'style') for _, nav_id in NAV_LINKS],
+    Input('url', 'pathname')
+)
+
+# Dashboard callbacks.
+#
+# Each panel has its own callback so panels render as soon as they are ready and a
+# slow figure never blocks the rest of the page. All of them share one cached
+# selection (row positions + aggregates) per filter combination, and the charts
+# send Patch updates of their data arrays instead of whole figures.
+FILTER_INPUTS = [Input('search-input', 'value'),
+                 Input('region-dropdown', 'value'),
+                 Input('tier-dropdown', 'value'),
+                 Input('risk-dropdown', 'value')]
+
+# Panels also refresh when a write to the farm store publishes a new dataset version
+DATA_INPUTS = FILTER_INPUTS + [Input('dataset-version', 'data')]
+
+# Registers a panel callback on the server, unless the panels are computed in the
+# browser (client-side mode), in which case the function is left unregistered
+def panel_callback(*args, **kwargs):
+    if CLIENTSIDE_FILTERING:
+        return lambda func: func
+    return lambda func: app.callback(*args, **kwargs)(reads_store(func))
+
+def filter_key(search_value, region, tier, risk):
+    return (normalize_search(search_value), region, tier, risk, live_store.version)
+
+def compute_selection(search_value, region, tier, risk):
+    if farm_sql is not None:
+        with callback_metrics.phase('filter'):
+            positions = sql_positions(search_value, region, tier, risk)
+        with callback_metrics.phase('aggregate'):
+            agg = farm_sql.summary(search=search_value, region=region, tier=tier, risk=risk)
+        return {'positions': positions, 'agg': agg}
+
+    # The search box goes through the trigram index and the dropdowns through the
+    # bitmap index; positions is None when every farm is selected
+    with callback_metrics.phase('filter'):
+        if search_value:
+            positions = live_store.index.restrict(live_store.index.filter_bitmap(region, tier, risk),
+                                                  live_store.search_index.positions(search_value))
+        else:
+            positions = live_store.index.positions(region, tier, risk)
     
-    inactive_style = {
-        'display': 'block',
-        'padding': '0.75rem 1.5rem',
-        'color': 'rgba(255,255,255,0.8)',
-        'textDecoration': 'none',
-        'borderRadius': '8px',
-        'marginBottom': '0.5rem',
-        'transition': 'all 0.3s'
-    }
+    # Dropdown-only views are answered from the precomputed cube; a search builds a
+    # small cube over just the matched rows
+    with callback_metrics.phase('aggregate'):
+        if search_value:
+            agg = AggregateCube(live_store.df.iloc[positions], live_store.cube.dimensions).summary()
+        else:
+            agg = live_store.cube.summary(region, tier, risk)
+    return {'positions': positions, 'agg': agg}
+
+def get_selection(key):
+    selection = selection_cache.get(key)
+    if selection is None:
+        selection = compute_selection(*key[:4])
+        positions = selection['positions']
+        selection_cache.put(key, selection, size=4096 + (positions.nbytes if positions is not None else 0))
+    return selection
+
+# Look up a panel's output for a filter combination, rendering it on a miss
+def panel_output(panel, render, search_value, region, tier, risk):
+    key = filter_key(search_value, region, tier, risk)
     
-    # Initialize all styles as inactive
-    styles = [inactive_style] * 6
+    def compute():
+        selection = get_selection(key)
+        with callback_metrics.phase('render'):
+            return render(selection)
+    return dashboard_cache.get_or_compute((panel,) + key, compute)
+
+def chart_title(total_farms):
+    return "No data available" if total_farms == 0 else ''
+
+# Quarter-over-quarter note under a card, green when the change is an improvement
+def change_note(change, metric, unit, higher_is_better=True):
+    if change is None:
+        return "—", {'fontSize': '0.8rem', 'color': '#9ca3af'}
+    delta = change[metric]
+    improved = delta >= 0 if higher_is_better else delta <= 0
+    return (f"{delta:+.1f} {unit} vs last quarter",
+            {'fontSize': '0.8rem', 'color': '#10b981' if improved else '#ef4444'})
+
+CARD_OUTPUTS = [Output('metric-total-farms', 'children'),
+                Output('metric-tnfd-compliance', 'children'),
+                Output('metric-avg-score', 'children'),
+                Output('metric-high-risk', 'children')]
+CARD_CHANGE_OUTPUTS = [Output(f'{card}-change', prop)
+                       for card in ('metric-tnfd-compliance', 'metric-avg-score', 'metric-high-risk')
+                       for prop in ('children', 'style')]
+
+@panel_callback(CARD_OUTPUTS + CARD_CHANGE_OUTPUTS, DATA_INPUTS)
+@callback_metrics.observe
+def update_metric_cards(search_value, region, tier, risk, data_version):
+    def render(selection):
+        agg = selection['agg']
+        total_farms = int(agg['count'])
+        tnfd_compliance = (agg['compliant'] / total_farms * 100) if total_farms > 0 else 0
+        avg_score = agg['score_sum'] / total_farms if total_farms > 0 else 0
+        high_risk_pct = (agg['high_risk'] / total_farms * 100) if total_farms > 0 else 0
+        
+        # Dropdown views read the segment rollups, searches the per-farm rollups
+        change = None
+        if farm_history is not None:
+            change = farm_history.quarter_change(region, tier, risk,
+                                                 positions=selection['positions'] if search_value else None)
+        return (str(total_farms), f"{tnfd_compliance:.1f}%", f"{avg_score:.0f}/100",
+                f"{high_risk_pct:.1f}%",
+                *change_note(change, 'compliance_pct', "pts"),
+                *change_note(change, 'avg_score', "points"),
+                *change_note(change, 'high_risk_pct', "pts", higher_is_better=False))
+    return panel_output('metric-cards', render, search_value, region, tier, risk)
+
+@panel_callback(
+    [Output('land-habitat-area', 'children'),
+     Output('land-soil-compliance', 'children'),
+     Output('water-avg-efficiency', 'children'),
+     Output('water-compliance', 'children'),
+     Output('water-risk-exposure', 'children'),
+     Output('bio-avg-score', 'children')],
+    DATA_INPUTS
+)
+@callback_metrics.observe
+def update_tnfd_panels(search_value, region, tier, risk, data_version):
+    def render(selection):
+        agg = selection['agg']
+        total_farms = int(agg['count'])
+        if total_farms > 0:
+            natural_habitat_area = agg['habitat_ha']
+            soil_health_compliance = agg['soil_ok'] / total_farms * 100
+            avg_water_efficiency = agg['water_sum'] / total_farms
+            water_compliance = agg['water_ok'] / total_farms * 100
+            avg_biodiversity = agg['biodiversity_sum'] / total_farms
+            high_risk_pct = agg['high_risk'] / total_farms * 100
+        else:
+            natural_habitat_area = 0
+            soil_health_compliance = 0
+            avg_water_efficiency = 0
+            water_compliance = 0
+            avg_biodiversity = 0
+            high_risk_pct = 0
+        return (f"{natural_habitat_area:.0f} ha",
+                f"{soil_health_compliance:.1f}%",
+                f"{avg_water_efficiency:.0f}%",
+                f"{water_compliance:.1f}%",
+                f"{high_risk_pct:.1f}%",
+                f"{avg_biodiversity:.0f}/100")
+    return panel_output('tnfd-panels', render, search_value, region, tier, risk)
+
+@panel_callback(Output('regional-performance-chart', 'figure'), DATA_INPUTS)
+@callback_metrics.observe
+def update_regional_chart(search_value, region, tier, risk, data_version):
+    def render(selection):
+        by_region = selection['agg']['by_region']
+        regions = list(by_region.index)
+        return REGIONAL_PERFORMANCE.patch({
+            0: {'x': regions, 'y': by_region['count'].astype(int).tolist()},
+            1: {'x': regions, 'y': (by_region['score_sum'] / by_region['count']).tolist()},
+            2: {'x': regions, 'y': (by_region['compliant'] / by_region['count'] * 100).tolist()}
+        }, chart_title(len(regions)))
+    return panel_output('regional-chart', render, search_value, region, tier, risk)
+
+@panel_callback(Output('risk-assessment-chart', 'figure'), DATA_INPUTS)
+@callback_metrics.observe
+def update_risk_chart(search_value, region, tier, risk, data_version):
+    def render(selection):
+        agg = selection['agg']
+        return RISK_ASSESSMENT.patch({
+            0: {'y': [int(agg['by_drought'].get(r, 0)) for r in RISK_LEVELS]},
+            1: {'y': [int(agg['by_flood'].get(r, 0)) for r in RISK_LEVELS]}
+        }, chart_title(int(agg['count'])))
+    return panel_output('risk-chart', render, search_value, region, tier, risk)
+
+@panel_callback(Output('tier-distribution-chart', 'figure'), DATA_INPUTS)
+@callback_metrics.observe
+def update_tier_chart(search_value, region, tier, risk, data_version):
+    def render(selection):
+        tier_data = selection['agg']['by_tier'].astype(int).sort_values(ascending=False)
+        return TIER_DISTRIBUTION.patch({
+            0: {'labels': list(tier_data.index), 'values': tier_data.tolist()}
+        }, chart_title(len(tier_data)))
+    return panel_output('tier-chart', render, search_value, region, tier, risk)
+
+@panel_callback(Output('scheme-enrollment-chart', 'figure'), DATA_INPUTS)
+@callback_metrics.observe
+def update_scheme_chart(search_value, region, tier, risk, data_version):
+    def render(selection):
+        agg = selection['agg']
+        return SCHEME_ENROLLMENT.patch({
+            0: {'y': [int(agg['sfi']), int(agg['cs']), int(agg['both_schemes'])]}
+        }, chart_title(int(agg['count'])))
+    return panel_output('scheme-chart', render, search_value, region, tier, risk)
+
+@panel_callback(
+    [Output('farm-table', 'data'),
+     Output('farm-table', 'page_count'),
+     Output('farm-table', 'page_current'),
+     Output('farm-table-message', 'children')],
+    DATA_INPUTS + [Input('farm-table', 'page_current'),
+                   Input('farm-table', 'page_size'),
+                   Input('farm-table', 'sort_by'),
+                   Input('farm-table', 'filter_query')]
+)
+@callback_metrics.observe
+def update_farm_table(search_value, region, tier, risk, data_version, page_current, page_size, sort_by,
+                      filter_query):
+    # Any change other than paging starts again from the first page
+    if 'farm-table.page_current' not in dash.ctx.triggered_prop_ids:
+        page_current = 0
+    key = filter_key(search_value, region, tier, risk)
+    
+    # Filtered + sorted positions are cached so paging through them is a slice
+    sort_by = sort_by or []
+    table_key = ('farm-table', filter_query or '', tuple((s['column_id'], s['direction']) for s in sort_by)) + key
+    positions = selection_cache.get(table_key)
+    if positions is None:
+        selection = get_selection(key)
+        with callback_metrics.phase('filter'):
+            positions = live_store.table_query.query(selection['positions'], filter_query, sort_by)
+        selection_cache.put(table_key, positions, size=positions.nbytes)
     
-    # Determine which page to show and which nav item to highlight
-    if pathname == '/analytics':
-        page_content = get_analytics_layout()
-        styles[1] = active_style
-    elif pathname == '/tnfd-metrics':
-        page_content = get_tnfd_layout()
-        styles[2] = active_style
-    elif pathname == '/farms':
-        page_content = get_farms_layout()
-        styles[3] = active_style
-    elif pathname == '/reports':
-        page_content = get_reports_layout()
-        styles[4] = active_style
-    elif pathname == '/settings':
-        page_content = get_settings_layout()
-        styles[5] = active_style
-    else:  # Default to dashboard
-        page_content = get_dashboard_layout()
-        styles[0] = active_style
+    if len(positions) == 0:
+        return [], 1, 0, html.P("No farms match the selected filters", 
+                                style={'textAlign': 'center', 'color': '#6b7280', 'padding': '2rem'})
     
-    return [page_content] + styles
+    page_size = page_size or 20
+    page_count = -(-len(positions) // page_size)
+    page_current = min(page_current or 0, page_count - 1)
+    with callback_metrics.phase('render'):
+        page_rows = live_store.df.iloc[positions[page_current * page_size:(page_current + 1) * page_size]]
+        display_df = page_rows[FARM_TABLE_COLUMNS].copy()
+        
+        # Format TNFD column
+        display_df['tnfd_compliant'] = display_df['tnfd_compliant'].map({True: '✓', False: '✗'})
+        records = display_df.to_dict('records')
+    return records, page_count, page_current, None
 
-# Original callbacks
-@app.callback(
-    [Output('metrics-cards', 'children'),
-     Output('land-metrics-content', 'children'),
-     Output('water-metrics-content', 'children'),
-     Output('biodiversity-metrics-content', 'children'),
-     Output('regional-performance-chart', 'figure'),
-     Output('risk-assessment-chart', 'figure'),
-     Output('tier-distribution-chart', 'figure'),
-     Output('scheme-enrollment-chart', 'figure'),
-     Output('farm-table-container', 'children'),
-     Output('filter-summary', 'children')],
-    [Input('search-input', 'value'),
-     Input('region-dropdown', 'value'),
-     Input('tier-dropdown', 'value'),
-     Input('risk-dropdown', 'value')]
-)
-def update_dashboard(search_value, region, tier, risk):
-    # Filter data
-    filtered_df = farms_df.copy()
+@panel_callback(Output('filter-summary', 'children'), DATA_INPUTS)
+@callback_metrics.observe
+def update_filter_summary(search_value, region, tier, risk, data_version):
+    def render(selection):
+        agg = selection['agg']
+        return html.Div([
+            html.Span(f"Showing {int(agg['count'])} of {len(live_store.df)} farms", style={'marginRight': '2rem'}),
+            html.Span([
+                html.Span("●", style={'color': '#10b981', 'marginRight': '0.3rem'}),
+                f"{int(agg['compliant'])} TNFD Compliant"
+            ], style={'marginRight': '2rem'}),
+            html.Span([
+                html.Span("●", style={'color': '#3b82f6', 'marginRight': '0.3rem'}),
+                f"{int(agg['sfi'])} SFI Enrolled"
+            ])
+        ])
+    return panel_output('filter-summary', render, search_value, region, tier, risk)
+
+# Client-side mode: one browser-side callback filters the shipped portfolio and
+# fills every panel and the table (assets/dashboard_clientside.js). The server is
+# only asked for fresh data after a write publishes a new dataset version.
+if CLIENTSIDE_FILTERING:
+    app.clientside_callback(
+        ClientsideFunction(namespace='farms', function_name='updateDashboard'),
+        CARD_OUTPUTS +
+        [Output('land-habitat-area', 'children'),
+         Output('land-soil-compliance', 'children'),
+         Output('water-avg-efficiency', 'children'),
+         Output('water-compliance', 'children'),
+         Output('water-risk-exposure', 'children'),
+         Output('bio-avg-score', 'children'),
+         Output('regional-performance-chart', 'figure'),
+         Output('risk-assessment-chart', 'figure'),
+         Output('tier-distribution-chart', 'figure'),
+         Output('scheme-enrollment-chart', 'figure'),
+         Output('filter-summary', 'children'),
+         Output('farm-table', 'data'),
+         Output('farm-table', 'page_current'),
+         Output('farm-table-message', 'children')] + CARD_CHANGE_OUTPUTS,
+        [Input('farm-data', 'data')] + FILTER_INPUTS,
+        [State('regional-performance-chart', 'figure'),
+         State('risk-assessment-chart', 'figure'),
+         State('tier-distribution-chart', 'figure'),
+         State('scheme-enrollment-chart', 'figure')]
+    )
     
-    if search_value:
-        filtered_df = filtered_df[
-            filtered_df['name'].str.contains(search_value, case=False) | 
-            filtered_df['id'].str.contains(search_value, case=False)
-        ]
+    @app.callback(Output('farm-data', 'data'), Input('dataset-version', 'data'), prevent_initial_call=True)
+    @callback_metrics.observe
+    @reads_store
+    def refresh_farm_data(data_version):
+        return dashboard_cache.get_or_compute(('farm-data', live_store.version),
+                                              lambda: client_payload(live_store.df, farm_history))
+
+# Analytics page. Farm-level scatters are drawn point by point with WebGL up to
+# ANALYTICS_MAX_POINTS farms; larger selections are binned on the server into at
+# most ANALYTICS_BINS x ANALYTICS_BINS cells, so the browser receives a bounded
+# response whatever the portfolio size. The scatter runs as a background callback.
+ANALYTICS_MAX_POINTS = int(os.environ.get('ANALYTICS_MAX_POINTS', DEFAULT_MAX_POINTS))
+ANALYTICS_BINS = int(os.environ.get('ANALYTICS_BINS', DEFAULT_BINS))
+
+ANALYTICS_FILTER_INPUTS = [Input('analytics-region', 'value'),
+                           Input('analytics-tier', 'value'),
+                           Input('analytics-risk', 'value')]
+
+def axis_values(column, positions):
+    values = live_store.df[column].to_numpy()
+    values = values if positions is None else values[positions]
+    # float32 columns are sent at their stored precision (4.1, not 4.099999904632568)
+    return np.round(values.astype(np.float64), 3) if values.dtype.kind == 'f' else values
+
+def farm_points(x, y, compliant, positions):
+    names = live_store.df['name'] if positions is None else live_store.df['name'].iloc[positions]
+    names = names.astype(str).to_numpy()
+    traces = {}
+    for i, mask in enumerate((compliant, ~compliant)):
+        traces[i] = {'x': x[mask].tolist(), 'y': y[mask].tolist(), 'text': names[mask].tolist()}
+    return traces
+
+def farm_bins(x, y, compliant):
+    bins = bin_2d(x, y, ANALYTICS_BINS, {'compliant': compliant})
+    counts = bins['count']
+    occupied = counts > 0
+    compliance = np.round(np.divide(bins['compliant'] * 100, counts, where=occupied,
+                                    out=np.zeros(counts.shape)), 1)
+    # Empty cells are gaps rather than zero-count tiles
+    z = [[int(c) if c else None for c in row] for row in counts]
+    customdata = [[p if c else None for c, p in zip(count_row, pct_row)]
+                  for count_row, pct_row in zip(counts, compliance.tolist())]
+    return {'x': bins['x'].tolist(), 'y': bins['y'].tolist(), 'z': z, 'customdata': customdata}, \
+        int(occupied.sum())
+
+@background.callback(
+    [Output('farm-scatter-chart', 'figure'),
+     Output('farm-scatter-summary', 'children')],
+    [Input('analytics-x', 'value'),
+     Input('analytics-y', 'value')] + ANALYTICS_FILTER_INPUTS,
+    cancel=[Input('analytics-x', 'value'),
+            Input('analytics-y', 'value'),
+            Input('url', 'pathname')] + ANALYTICS_FILTER_INPUTS
+)
+@callback_metrics.observe
+@reads_store
+def update_farm_scatter(x_column, y_column, region, tier, risk):
+    with callback_metrics.phase('filter'):
+        positions = farm_positions(region, tier, risk)
+        x = axis_values(x_column, positions)
+        y = axis_values(y_column, positions)
+        compliant = axis_values('tnfd_compliant', positions)
     
-    if region != 'all':
-        filtered_df = filtered_df[filtered_df['region'] == region]
+    n_farms = len(x)
+    axes = {'xaxis': {'title': {'text': SCATTER_AXES[x_column]}},
+            'yaxis': {'title': {'text': SCATTER_AXES[y_column]}}}
+    with callback_metrics.phase('render'):
+        if n_farms <= ANALYTICS_MAX_POINTS:
+            figure = FARM_SCATTER.render(farm_points(x, y, compliant, positions),
+                                         chart_title(n_farms), layout=axes)
+            summary = f"Showing {n_farms:,} farms"
+        else:
+            traces, n_cells = farm_bins(x, y, compliant)
+            figure = FARM_DENSITY.render({0: traces}, '', layout=axes)
+            summary = (f"{n_farms:,} farms aggregated into {n_cells:,} cells "
+                       f"(selections over {ANALYTICS_MAX_POINTS:,} farms are binned)")
+    return figure, summary
+
+# Farm map. Each pan or zoom sends the viewport; the spatial grid index answers
+# it with at most MAP_MAX_TILES aggregated tiles from its precomputed pyramid, and
+# once no more than MAP_MAX_POINTS farms are in view they are sent individually.
+MAP_MAX_TILES = int(os.environ.get('MAP_MAX_TILES', DEFAULT_MAX_TILES))
+MAP_MAX_POINTS = int(os.environ.get('MAP_MAX_POINTS', DEFAULT_MAP_POINTS))
+MAP_DEFAULT_VIEW = ((-6.0, 49.9, 2.0, 56.0), 5)
+
+# (west, south, east, north) bounds and zoom of the map from its relayoutData, or
+# None when the event was not a pan or zoom
+def map_viewport(relayout_data):
+    derived = (relayout_data or {}).get('map._derived')
+    if not derived:
+        return None
+    lons, lats = zip(*derived['coordinates'])
+    return (min(lons), min(lats), max(lons), max(lats)), relayout_data.get('map.zoom', MAP_DEFAULT_VIEW[1])
+
+@app.callback(
+    [Output('farm-map', 'figure'),
+     Output('farm-map-summary', 'children')],
+    [Input('farm-map', 'relayoutData')] + ANALYTICS_FILTER_INPUTS
+)
+@callback_metrics.observe
+@reads_store
+def update_farm_map(relayout_data, region, tier, risk):
+    viewport = map_viewport(relayout_data)
+    if viewport is None:
+        if relayout_data and dash.ctx.triggered_id == 'farm-map':
+            raise dash.exceptions.PreventUpdate
+        viewport = MAP_DEFAULT_VIEW
+    bounds, zoom = viewport
     
-    if tier != 'all':
-        filtered_df = filtered_df[filtered_df['supplier_tier'] == tier]
+    with callback_metrics.phase('filter'):
+        positions = farm_positions(region, tier, risk)
+    with callback_metrics.phase('aggregate'):
+        level, tiles = live_store.spatial_index.tiles(live_store.df, bounds, zoom, positions, MAP_MAX_TILES)
     
-    if risk != 'all':
-        filtered_df = filtered_df[
-            (filtered_df['drought_risk'] == risk) | (filtered_df['flood_risk'] == risk)
-        ]
+    n_farms = int(tiles['count'].sum())
+    with callback_metrics.phase('render'):
+        tile_marker = FARM_MAP.skeleton()['data'][0]['marker']
+        farm_marker = FARM_MAP.skeleton()['data'][1]['marker']
+        if n_farms <= MAP_MAX_POINTS:
+            in_view = live_store.spatial_index.positions_in(bounds, positions)
+            farms = live_store.df.iloc[in_view]
+            traces = {
+                0: {'lat': [], 'lon': [], 'customdata': [], 'marker': dict(tile_marker, size=[], color=[])},
+                1: {'lat': farms['latitude'].round(4).tolist(), 'lon': farms['longitude'].round(4).tolist(),
+                    'text': (farms['name'].astype(str) + ' (' + farms['id'].astype(str) + ')').tolist(),
+                    'customdata': farms['overall_score'].tolist(),
+                    'marker': dict(farm_marker, color=farms['overall_score'].tolist())}
+            }
+            summary = f"{len(farms):,} farms in view"
+        else:
+            counts = tiles['count']
+            avg_score = tiles['score_sum'] / counts
+            compliance = tiles['compliant'] / counts * 100
+            sizes = 6 + 24 * np.sqrt(counts / counts.max())
+            traces = {
+                0: {'lat': np.round(tiles['lat_sum'] / counts, 4).tolist(),
+                    'lon': np.round(tiles['lon_sum'] / counts, 4).tolist(),
+                    'customdata': np.column_stack([counts, np.round(avg_score, 1),
+                                                   np.round(compliance, 1)]).tolist(),
+                    'marker': dict(tile_marker, size=np.round(sizes, 1).tolist(),
+                                   color=np.round(avg_score, 1).tolist())},
+                1: {'lat': [], 'lon': [], 'text': [], 'customdata': [], 'marker': dict(farm_marker, color=[])}
+            }
+            summary = f"{n_farms:,} farms in view, grouped into {len(counts):,} areas"
+        return FARM_MAP.patch(traces), summary
+
+# Monthly card metrics of the analytics selection, from the history rollups
+@app.callback(Output('metric-trend-chart', 'figure'), ANALYTICS_FILTER_INPUTS)
+@callback_metrics.observe
+def update_metric_trend(region, tier, risk):
+    if farm_history is None:
+        return METRIC_TREND.render({}, "No history available")
+    with callback_metrics.phase('aggregate'):
+        trend = farm_history.trend('month', region, tier, risk).reindex(
+            columns=['farms', 'compliance_pct', 'avg_score', 'high_risk_pct'])
+    months = list(trend.index)
+    series = [trend[column].round(1).tolist() for column in ('compliance_pct', 'avg_score', 'high_risk_pct')]
+    return METRIC_TREND.render({i: {'x': months, 'y': values} for i, values in enumerate(series)},
+                               chart_title(int(trend['farms'].fillna(0).sum())))
+
+# Climate scenarios (TNFD page). Each run simulates SCENARIO_TRIALS years of the
+# chosen scenario for the selected region's farms as batched array operations,
+# at most SCENARIO_MAX_CELLS farm-trials per batch, optionally across
+# SCENARIO_WORKERS processes. A fixed SCENARIO_SEED makes runs repeatable, and as
+# a background callback the result is cached per inputs and dataset version.
+SCENARIO_TRIALS = int(os.environ.get('SCENARIO_TRIALS', DEFAULT_TRIALS))
+SCENARIO_WORKERS = int(os.environ.get('SCENARIO_WORKERS', 1))
+SCENARIO_MAX_CELLS = int(os.environ.get('SCENARIO_MAX_CELLS', DEFAULT_MAX_CELLS))
+SCENARIO_SEED = int(os.environ.get('SCENARIO_SEED', 0))
+CLIMATE_HISTOGRAM_BINS = 50
+
+def megalitres(litres):
+    return f"{litres / 1e6:,.1f} ML"
+
+@background.callback(
+    [Output('climate-farms', 'children'),
+     Output('climate-farms-note', 'children'),
+     Output('climate-expected-loss', 'children'),
+     Output('climate-expected-loss-note', 'children'),
+     Output('climate-p95-loss', 'children'),
+     Output('climate-p99-loss', 'children'),
+     Output('climate-loss-chart', 'figure'),
+     Output('climate-region-chart', 'figure'),
+     Output('climate-summary', 'children')],
+    [Input('climate-scenario', 'value'),
+     Input('climate-region', 'value'),
+     Input('climate-trials', 'value')],
+    cancel=[Input('climate-scenario', 'value'),
+            Input('climate-region', 'value'),
+            Input('climate-trials', 'value'),
+            Input('url', 'pathname')]
+)
+@callback_metrics.observe
+@reads_store
+def update_climate_scenario(scenario, region, n_trials):
+    with callback_metrics.phase('filter'):
+        positions = farm_positions(region)
+    n_farms = len(live_store.df) if positions is None else len(positions)
+    if n_farms == 0:
+        return ("0", None, megalitres(0), None, megalitres(0), megalitres(0),
+                CLIMATE_LOSS_DISTRIBUTION.render({}, chart_title(0)), CLIMATE_REGION_LOSS.render({}, chart_title(0)),
+                "No farms in this selection.")
     
-    # Calculate metrics
-    total_farms = len(filtered_df)
-    tnfd_compliance = (filtered_df['tnfd_compliant'].sum() / total_farms * 100) if total_farms > 0 else 0
-    avg_score = filtered_df['overall_score'].mean() if total_farms > 0 else 0
-    high_risk = len(filtered_df[(filtered_df['drought_risk'] == 'High') | (filtered_df['flood_risk'] == 'High')])
-    high_risk_pct = (high_risk / total_farms * 100) if total_farms > 0 else 0
+    with callback_metrics.phase('aggregate'):
+        result = run_scenario(live_store.df, scenario, n_trials, SCENARIO_SEED, positions, SCENARIO_WORKERS,
+                              SCENARIO_MAX_CELLS)
+        summary = scenario_summary(result)
     
-    # Create metric cards
-    metrics_cards = html.Div([
-        html.Div([
-            html.Div(str(total_farms), style={'fontSize': '2.5rem', 'fontWeight': 'bold', 'color': '#1e40af'}),
-            html.Div("Total Farms", style={'color': '#6b7280', 'marginTop': '0.5rem'}),
-            html.Div("suppliers", style={'fontSize': '0.8rem', 'color': '#9ca3af'})
-        ], style={
-            'width': '24%',
-            'backgroundColor': 'white',
-            'padding': '1.5rem',
-            'borderRadius': '12px',
-            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)',
-            'textAlign': 'center'
-        }),
-        
-        html.Div([
-            html.Div(f"{tnfd_compliance:.1f}%", style={'fontSize': '2.5rem', 'fontWeight': 'bold', 'color': '#10b981'}),
-            html.Div("TNFD Compliance", style={'color': '#6b7280', 'marginTop': '0.5rem'}),
-            html.Div("+12% this quarter", style={'fontSize': '0.8rem', 'color': '#10b981'})
-        ], style={
-            'width': '24%',
-            'backgroundColor': 'white',
-            'padding': '1.5rem',
-            'borderRadius': '12px',
-            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)',
-            'textAlign': 'center'
-        }),
-        
-        html.Div([
-            html.Div(f"{avg_score:.0f}/100", style={'fontSize': '2.5rem', 'fontWeight': 'bold', 'color': '#f59e0b'}),
-            html.Div("Avg Score", style={'color': '#6b7280', 'marginTop': '0.5rem'}),
-            html.Div("+8.1 points", style={'fontSize': '0.8rem', 'color': '#f59e0b'})
-        ], style={
-            'width': '24%',
-            'backgroundColor': 'white',
-            'padding': '1.5rem',
-            'borderRadius': '12px',
-            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)',
-            'textAlign': 'center'
-        }),
-        
-        html.Div([
-            html.Div(f"{high_risk_pct:.1f}%", style={'fontSize': '2.5rem', 'fontWeight': 'bold', 'color': '#ef4444'}),
-            html.Div("High Risk Farms", style={'color': '#6b7280', 'marginTop': '0.5rem'}),
-            html.Div("-3% vs last quarter", style={'fontSize': '0.8rem', 'color': '#10b981'})
-        ], style={
-            'width': '24%',
-            'backgroundColor': 'white',
-            'padding': '1.5rem',
-            'borderRadius': '12px',
-            'boxShadow': '0 2px 4px rgba(0, 0, 0, 0.05)',
-            'textAlign': 'center'
+    with callback_metrics.phase('render'):
+        counts, edges = np.histogram(result['litres_lost'] / 1e6, bins=CLIMATE_HISTOGRAM_BINS)
+        p95 = summary['lost_p95'] / 1e6
+        loss_chart = CLIMATE_LOSS_DISTRIBUTION.render(
+            {0: {'x': np.round((edges[:-1] + edges[1:]) / 2, 3).tolist(), 'y': counts.tolist(),
+                 'width': np.round(np.diff(edges), 3).tolist()}},
+            layout={'shapes': [{'type': 'line', 'xref': 'x', 'yref': 'paper', 'x0': p95, 'x1': p95,
+                                'y0': 0, 'y1': 1, 'line': {'color': '#ef4444', 'dash': 'dash'}}]})
+        by_region = summary['by_region']
+        region_chart = CLIMATE_REGION_LOSS.render({
+            0: {'x': list(by_region.index), 'y': np.round(by_region['lost_mean'] / 1e6, 2).tolist()},
+            1: {'x': list(by_region.index), 'y': np.round(by_region['lost_p95'] / 1e6, 2).tolist()}
         })
-    ], style={'display': 'flex', 'justifyContent': 'space-between'})
+    return (f"{summary['farms_mean']:,.0f}",
+            f"of {n_farms:,} farms ({summary['farms_p95']:,.0f} in a 1-in-20 year)",
+            megalitres(summary['lost_mean']),
+            f"{summary['lost_share_mean'] * 100:.2f}% of annual milk",
+            megalitres(summary['lost_p95']),
+            megalitres(summary['lost_p99']),
+            loss_chart, region_chart,
+            f"{CLIMATE_SCENARIOS[scenario]['label']}: {n_trials:,} trials over {n_farms:,} farms "
+            f"in {result['seconds']:.2f}s")
+
+# Farms page. The list is paged by keyset on farm id: the cursor holds the last
+# loaded id and each page is a binary search into the selection's id order, so a
+# deep page costs the same as the first one and only pages scrolled to ever reach
+# the browser. The browser renders just the rows in view (assets/farm_list.js).
+# A clicked farm's scorecard comes from a small LRU of recently viewed farms and
+# is published in selected-farm-store.
+FARM_LIST_PAGE_ROWS = int(os.environ.get('FARM_LIST_PAGE_ROWS', 100))
+FARM_LIST_COLUMNS = ['id', 'name', 'region', 'supplier_tier', 'overall_score', 'tnfd_compliant']
+
+farm_detail_cache = ResultCache(
+    max_entries=int(os.environ.get('FARM_DETAIL_CACHE_ENTRIES', 128)),
+    max_bytes=4 * 1024 * 1024
+)
+live_store.subscribe(farm_detail_cache.invalidate)
+
+@app.callback(
+    [Output('farm-list-rows', 'data'),
+     Output('farm-list-cursor', 'data'),
+     Output('farm-list-status', 'children')],
+    [Input('farm-list-more', 'data'),
+     Input('farm-list-search', 'value'),
+     Input('farm-list-region', 'value')],
+    State('farm-list-cursor', 'data')
+)
+@callback_metrics.observe
+@reads_store
+def load_farm_list(more, search_value, region, cursor):
+    key = filter_key(search_value, region, 'all', 'all')
+    list_key = json.dumps(key)
     
-    # TNFD Metrics
-    if total_farms > 0:
-        natural_habitat_area = (filtered_df['size'] * filtered_df['natural_habitat'] / 100).sum()
-        soil_health_compliance = (filtered_df['soil_health'] >= 4.0).sum() / total_farms * 100
-        avg_water_efficiency = filtered_df['water_efficiency'].mean()
-        water_compliance = (filtered_df['water_efficiency'] >= 85).sum() / total_farms * 100
-        avg_biodiversity = filtered_df['biodiversity_score'].mean()
+    # A scroll request for the current cursor appends the next page; a filter change
+    # or a new dataset version starts the list again
+    extend = cursor is not None and cursor['key'] == list_key and more == cursor['loaded']
+    if dash.ctx.triggered_id == 'farm-list-more' and cursor is not None:
+        if not extend or cursor['done']:
+            raise dash.exceptions.PreventUpdate
     else:
-        natural_habitat_area = 0
-        soil_health_compliance = 0
-        avg_water_efficiency = 0
-        water_compliance = 0
-        avg_biodiversity = 0
+        extend = False
     
-    land_metrics = html.Div([
-        html.Div([
-            html.Span("Natural Habitat Coverage", style={'color': '#6b7280'}),
-            html.Span(f"{natural_habitat_area:.0f} ha", style={'fontWeight': 'bold', 'color': '#059669'})
-        ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginBottom': '0.8rem'}),
-        html.Div([
-            html.Span("Soil Health Compliance", style={'color': '#6b7280'}),
-            html.Span(f"{soil_health_compliance:.1f}%", style={'fontWeight': 'bold', 'color': '#059669'})
-        ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginBottom': '0.8rem'}),
-        html.Div([
-            html.Span("Peatland Exposure", style={'color': '#6b7280'}),
-            html.Span(f"{np.random.randint(20, 80)} ha", style={'fontWeight': 'bold', 'color': '#059669'})
-        ], style={'display': 'flex', 'justifyContent': 'space-between'})
-    ])
+    with callback_metrics.phase('filter'):
+        keyset = selection_cache.get(('farm-list',) + key)
+        if keyset is None:
+            keyset = live_store.table_query.keyset(get_selection(key)['positions'], 'id')
+            selection_cache.put(('farm-list',) + key, keyset, size=keyset[0].nbytes + keyset[1].nbytes)
+        after = live_store.position_of(cursor['after']) if extend and cursor['after'] else None
+        positions = live_store.table_query.page_after(keyset, 'id', after, FARM_LIST_PAGE_ROWS)
     
-    water_metrics = html.Div([
-        html.Div([
-            html.Span("Average Efficiency", style={'color': '#6b7280'}),
-            html.Span(f"{avg_water_efficiency:.0f}%", style={'fontWeight': 'bold', 'color': '#2563eb'})
-        ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginBottom': '0.8rem'}),
-        html.Div([
-            html.Span("Compliance Rate", style={'color': '#6b7280'}),
-            html.Span(f"{water_compliance:.1f}%", style={'fontWeight': 'bold', 'color': '#2563eb'})
-        ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginBottom': '0.8rem'}),
-        html.Div([
-            html.Span("Risk Exposure", style={'color': '#6b7280'}),
-            html.Span(f"{high_risk_pct:.1f}%", style={'fontWeight': 'bold', 'color': '#2563eb'})
-        ], style={'display': 'flex', 'justifyContent': 'space-between'})
-    ])
+    with callback_metrics.phase('render'):
+        rows = live_store.df.iloc[positions][FARM_LIST_COLUMNS].to_dict('records')
+    total = len(keyset[0])
+    loaded = (cursor['loaded'] if extend else 0) + len(rows)
+    new_cursor = {
+        'key': list_key,
+        'after': rows[-1]['id'] if rows else (cursor['after'] if extend else None),
+        'loaded': loaded,
+        'done': loaded >= total
+    }
+    status = f"Showing {loaded:,} of {total:,} farms" if total else "No farms match the filters"
+    if extend:
+        patch = dash.Patch()
+        patch.extend(rows)
+        return patch, new_cursor, status
+    return rows, new_cursor, status
+
+# Renders the visible window of the loaded rows and asks for the next page near the end
+app.clientside_callback(
+    ClientsideFunction(namespace='farmList', function_name='render'),
+    [Output('farm-list-window', 'children'),
+     Output('farm-list-more', 'data')],
+    [Input('farm-list-rows', 'data'),
+     Input('farm-list-scroll', 'data'),
+     Input('farm-list-selected', 'data')],
+    State('farm-list-cursor', 'data')
+)
+
+@app.callback(Output('selected-farm-store', 'data'), Input('farm-list-selected', 'data'),
+              prevent_initial_call=True)
+@callback_metrics.observe
+@reads_store
+def select_farm(farm_id):
+    try:
+        position = live_store.position_of(farm_id)
+    except KeyError:
+        return None
     
-    biodiversity_metrics = html.Div([
-        html.Div([
-            html.Span("Average Score", style={'color': '#6b7280'}),
-            html.Span(f"{avg_biodiversity:.0f}/100", style={'fontWeight': 'bold', 'color': '#7c3aed'})
-        ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginBottom': '0.8rem'}),
+    def compute():
+        region_positions = farm_positions(region=live_store.df['region'].iloc[position])
+        return farm_scorecard(live_store.df, position, region_positions, farm_history)
+    return farm_detail_cache.get_or_compute((farm_id, live_store.version), compute)
+
+def farm_fact(label, value):
+    return html.Div([
+        html.Div(label, style={'color': '#6b7280', 'fontSize': '0.8rem'}),
+        html.Div(value, style={'fontWeight': 'bold', 'color': '#1f2937'})
+    ], style={'width': '25%', 'marginBottom': '1rem'})
+
+def farm_badge(label, on):
+    return html.Span(f"{'✓' if on else '✗'} {label}", style={
+        'padding': '0.2rem 0.6rem',
+        'borderRadius': '999px',
+        'marginRight': '0.5rem',
+        'fontSize': '0.8rem',
+        'backgroundColor': '#d1fae5' if on else '#fee2e2',
+        'color': '#065f46' if on else '#991b1b'
+    })
+
+def scorecard_row(metric):
+    return html.Tr([
+        html.Td(metric['label'], style={'padding': '0.5rem 0'}),
+        html.Td(f"{metric['value']:.1f}" if metric['column'] == 'soil_health' else f"{metric['value']:.0f}",
+                style={'fontWeight': 'bold'}),
+        html.Td(html.Div(html.Div(style={
+            'width': f"{metric['percentile']:.0f}%",
+            'height': '100%',
+            'backgroundColor': '#10b981' if metric['percentile'] >= 50 else '#f59e0b',
+            'borderRadius': '4px'
+        }), title=f"{metric['percentile']:.0f}th percentile", style={
+            'width': '120px', 'height': '8px', 'backgroundColor': '#e5e7eb', 'borderRadius': '4px'
+        })),
+        html.Td(f"{metric['region_avg']:.1f}", style={'color': '#6b7280'})
+    ], style={'borderBottom': '1px solid #f3f4f6'})
+
+@app.callback(Output('farm-detail', 'children'), Input('selected-farm-store', 'data'))
+@callback_metrics.observe
+def render_farm_detail(card):
+    if not card:
+        return html.P("Select a farm to see its scorecard",
+                      style={'textAlign': 'center', 'color': '#6b7280', 'padding': '2rem'})
+    profile = card['profile']
+    change = card['change']
+    notes = [("Compliance", change_note(change, 'compliance_pct', "pts")),
+             ("Score", change_note(change, 'avg_score', "points")),
+             ("High risk", change_note(change, 'high_risk_pct', "pts", higher_is_better=False))]
+    return html.Div([
+        html.H3(profile['name'], style={'marginBottom': '0.25rem', 'color': '#1f2937'}),
+        html.Div(f"{profile['id']} · {profile['region']} · {profile['supplier_tier']} tier",
+                 style={'color': '#6b7280', 'marginBottom': '1rem'}),
+        html.Div([farm_badge("TNFD Compliant", profile['tnfd_compliant']),
+                  farm_badge("SFI", profile['sfi_enrolled']),
+                  farm_badge("CS", profile['cs_enrolled'])], style={'marginBottom': '1.5rem'}),
         html.Div([
-            html.Span("Species Richness", style={'color': '#6b7280'}),
-            html.Span(f"{np.random.randint(20, 35)}", style={'fontWeight': 'bold', 'color': '#7c3aed'})
-        ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginBottom': '0.8rem'}),
+            farm_fact("Size", f"{profile['size']:,} ha"),
+            farm_fact("Herd", f"{profile['herd_size']:,}"),
+            farm_fact("Milk Volume", f"{profile['milk_volume']:,} L"),
+            farm_fact("NVZ Status", profile['nvz_status']),
+            farm_fact("Drought Risk", profile['drought_risk']),
+            farm_fact("Flood Risk", profile['flood_risk']),
+            farm_fact("Last Updated", profile['last_updated'])
+        ], style={'display': 'flex', 'flexWrap': 'wrap'}),
+        html.Table([
+            html.Thead(html.Tr([html.Th(h, style={'textAlign': 'left', 'color': '#6b7280', 'fontWeight': 'normal'})
+                                for h in ("Metric", "Value", "Portfolio percentile", "Region avg")])),
+            html.Tbody([scorecard_row(metric) for metric in card['metrics']])
+        ], style={'width': '100%', 'borderCollapse': 'collapse', 'marginBottom': '1.5rem'}),
         html.Div([
-            html.Span("Habitat Connectivity", style={'color': '#6b7280'}),
-            html.Span(f"{np.random.randint(65, 95)}%", style={'fontWeight': 'bold', 'color': '#7c3aed'})
-        ], style={'display': 'flex', 'justifyContent': 'space-between'})
+            html.Div([html.Div(label, style={'color': '#6b7280', 'fontSize': '0.8rem'}),
+                      html.Div(text, style=style)], style={'width': '33%'})
+            for label, (text, style) in notes
+        ], style={'display': 'flex'})
     ])
+
+# Reports. A disclosure pack is generated as a background job: its sections are
+# rendered across REPORT_WORKERS processes (1 renders them in the job itself) and
+# cached under REPORT_CACHE_DIR by a hash of each section's own cube cells and farm
+# rows, so a pack only recomputes the sections whose data changed. The finished file is served from
+# the same directory, which every worker on the host can read.
+REPORT_DIR = os.environ.get('REPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'uk-dairy-reports'))
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', min(4, os.cpu_count() or 1)))
+
+@background.callback(
+    [Output('report-download', 'href'),
+     Output('report-download', 'style'),
+     Output('report-status', 'children')],
+    Input('report-generate', 'n_clicks'),
+    [State('report-scopes', 'value'),
+     State('report-format', 'value'),
+     State('report-download', 'style')],
+    progress=[Output('report-progress', 'value'), Output('report-progress', 'max')],
+    running=[(Output('report-generate', 'disabled'), True, False)],
+    cancel=[Input('url', 'pathname')],
+    prevent_initial_call=True
+)
+@callback_metrics.observe
+def generate_report(set_progress, n_clicks, scopes, fmt, link_style):
+    hidden = dict(link_style, display='none')
+    if not scopes:
+        return '', hidden, "Choose at least one section."
+    if not report_available(fmt):
+        return '', hidden, f"{fmt.upper()} reports are not available on this server."
     
-    # Regional performance chart
-    if total_farms > 0:
-        regional_data = filtered_df.groupby('region').agg({
-            'id': 'count',
-            'overall_score': 'mean',
-            'tnfd_compliant': lambda x: (x.sum() / len(x) * 100),
-            'milk_volume': 'sum'
-        }).reset_index()
-        regional_data.columns = ['Region', 'Farms', 'Avg Score', 'TNFD Compliance %', 'Total Volume']
-        
-        fig1 = make_subplots(
-            rows=1, cols=1,
-            specs=[[{"secondary_y": True}]]
-        )
-        
-        fig1.add_trace(
-            go.Bar(x=regional_data['Region'], y=regional_data['Farms'], 
-                   name='Number of Farms', marker_color='#3b82f6'),
-            secondary_y=False
-        )
-        
-        fig1.add_trace(
-            go.Scatter(x=regional_data['Region'], y=regional_data['Avg Score'], 
-                      name='Avg Score', mode='lines+markers', marker_color='#10b981',
-                      line=dict(width=3)),
-            secondary_y=True
-        )
-        
-        fig1.add_trace(
-            go.Scatter(x=regional_data['Region'], y=regional_data['TNFD Compliance %'], 
-                      name='TNFD Compliance %', mode='lines+markers', marker_color='#f59e0b',
-                      line=dict(width=3)),
-            secondary_y=True
-        )
-        
-        fig1.update_xaxes(title_text="Region")
-        fig1.update_yaxes(title_text="Number of Farms", secondary_y=False)
-        fig1.update_yaxes(title_text="Score / Compliance %", secondary_y=True)
-        fig1.update_layout(height=400, hovermode='x unified', plot_bgcolor='white',
-                          paper_bgcolor='white', font=dict(size=12))
-    else:
-        fig1 = go.Figure()
-        fig1.update_layout(title="No data available", height=400)
-    
-    # Risk assessment chart
-    if total_farms > 0:
-        risk_levels = ['Low', 'Medium', 'High']
-        drought_counts = [len(filtered_df[filtered_df['drought_risk'] == r]) for r in risk_levels]
-        flood_counts = [len(filtered_df[filtered_df['flood_risk'] == r]) for r in risk_levels]
-        
-        fig2 = go.Figure()
-        fig2.add_trace(go.Bar(name='Drought Risk', x=risk_levels, y=drought_counts,
-                             marker_color='#fbbf24'))
-        fig2.add_trace(go.Bar(name='Flood Risk', x=risk_levels, y=flood_counts,
-                             marker_color='#60a5fa'))
-        fig2.update_layout(barmode='stack', height=400, plot_bgcolor='white',
-                          paper_bgcolor='white', font=dict(size=12))
-    else:
-        fig2 = go.Figure()
-        fig2.update_layout(title="No data available", height=400)
-    
-    # Tier distribution chart
-    if total_farms > 0:
-        tier_data = filtered_df['supplier_tier'].value_counts()
-        colors = {'Gold': '#fbbf24', 'Silver': '#9ca3af', 'Bronze': '#f97316'}
-        fig3 = px.pie(values=tier_data.values, names=tier_data.index, 
-                     color_discrete_map=colors, hole=0.4)
-        fig3.update_layout(height=400, showlegend=True)
-    else:
-        fig3 = go.Figure()
-        fig3.update_layout(title="No data available", height=400)
-    
-    # Scheme enrollment chart
-    if total_farms > 0:
-        sfi_enrolled = filtered_df['sfi_enrolled'].sum()
-        cs_enrolled = filtered_df['cs_enrolled'].sum()
-        both_enrolled = len(filtered_df[filtered_df['sfi_enrolled'] & filtered_df['cs_enrolled']])
-        
-        fig4 = go.Figure()
-        fig4.add_trace(go.Bar(
-            x=['SFI Enrolled', 'CS Enrolled', 'Both Schemes'],
-            y=[sfi_enrolled, cs_enrolled, both_enrolled],
-            marker_color=['#10b981', '#3b82f6', '#7c3aed']
-        ))
-        fig4.update_layout(height=400, plot_bgcolor='white', paper_bgcolor='white',
-                          yaxis_title="Number of Farms")
-    else:
-        fig4 = go.Figure()
-        fig4.update_layout(title="No data available", height=400)
+    # The section processes and the PDF render take a while, so like an export the
+    # report reads a snapshot of the table and a copy of the cube taken together,
+    # and writes are not held up while it is built
+    with live_store.reading():
+        snapshot = live_store.snapshot()
+        cube = farm_cube().copy()
+        history = farm_history
+    name, stats = build_report(snapshot, cube, history, scopes, fmt,
+                               REPORT_DIR, REPORT_WORKERS,
+                               progress=lambda done, total: set_progress((str(done), str(total))))
+    reused = stats['sections'] - stats['rendered']
+    return (f"/reports/{name}", dict(link_style, display='inline-block'),
+            f"{stats['sections']} sections ({reused} reused from earlier reports) in {stats['seconds']:.1f}s")
+
+@server.route('/reports/<name>')
+def download_report(name):
+    extension = name.rsplit('.', 1)[-1]
+    mimetypes = {ext: mimetype for mimetype, ext in REPORT_FORMATS.values()}
+    if extension not in mimetypes:
+        flask.abort(404)
+    return flask.send_from_directory(os.path.join(REPORT_DIR, 'artifacts'), name, mimetype=mimetypes[extension],
+                                     as_attachment=True, download_name=f"tnfd-disclosure-report.{extension}")
+
+# Add Farm: toggles the form and writes new farms to the live store. Publishing the
+# new dataset version refreshes every panel; the store updates its aggregates and
+# indexes for just that farm.
+@app.callback(
+    [Output('add-farm-form', 'style'),
+     Output('add-farm-status', 'children'),
+     Output('dataset-version', 'data')],
+    [Input('add-farm-btn', 'n_clicks'),
+     Input('add-farm-cancel', 'n_clicks'),
+     Input('add-farm-save', 'n_clicks')],
+    [State('add-farm-form', 'style'),
+     State('add-farm-flags', 'value')] +
+    [State(f'add-farm-{field}', 'value') for field, _, _, _ in ADD_FARM_FIELDS],
+    prevent_initial_call=True
+)
+@callback_metrics.observe
+def handle_add_farm(open_clicks, cancel_clicks, save_clicks, form_style, flags, *values):
+    shown = dict(form_style, display='block')
+    hidden = dict(form_style, display='none')
+    if dash.ctx.triggered_id == 'add-farm-btn':
+        return shown, None, dash.no_update
+    if dash.ctx.triggered_id == 'add-farm-cancel':
+        return hidden, None, dash.no_update
     
-    # Farm table
-    if total_farms > 0:
-        display_df = filtered_df[['name', 'id', 'region', 'supplier_tier', 'size', 
-                                'overall_score', 'tnfd_compliant', 'drought_risk', 'flood_risk']].head(50)
-        
-        # Format TNFD column
-        display_df_copy = display_df.copy()
-        display_df_copy['tnfd_compliant'] = display_df_copy['tnfd_compliant'].map({True: '✓', False: '✗'})
-        
-        farm_table = dash_table.DataTable(
-            data=display_df_copy.to_dict('records'),
-            columns=[
-                {'name': 'Farm Name', 'id': 'name'},
-                {'name': 'ID', 'id': 'id'},
-                {'name': 'Region', 'id': 'region'},
-                {'name': 'Tier', 'id': 'supplier_tier'},
-                {'name': 'Size (ha)', 'id': 'size'},
-                {'name': 'Score', 'id': 'overall_score'},
-                {'name': 'TNFD', 'id': 'tnfd_compliant'},
-                {'name': 'Drought Risk', 'id': 'drought_risk'},
-                {'name': 'Flood Risk', 'id': 'flood_risk'}
-            ],
-            style_cell={
-                'textAlign': 'left',
-                'padding': '10px',
-                'fontFamily': 'Arial, sans-serif'
-            },
-            style_data_conditional=[
-                {
-                    'if': {'row_index': 'odd'},
-                    'backgroundColor': '#f9fafb'
-                },
-                {
-                    'if': {'column_id': 'supplier_tier', 'filter_query': '{supplier_tier} = Gold'},
-                    'backgroundColor': '#fef3c7',
-                    'color': '#92400e'
-                },
-                {
-                    'if': {'column_id': 'supplier_tier', 'filter_query': '{supplier_tier} = Silver'},
-                    'backgroundColor': '#f3f4f6',
-                    'color': '#374151'
-                },
-                {
-                    'if': {'column_id': 'supplier_tier', 'filter_query': '{supplier_tier} = Bronze'},
-                    'backgroundColor': '#fed7aa',
-                    'color': '#92400e'
-                }
-            ],
-            style_header={
-                'backgroundColor': '#f3f4f6',
-                'fontWeight': 'bold',
-                'borderBottom': '2px solid #e5e7eb'
-            },
-            page_size=20,
-            sort_action="native",
-            filter_action="native"
-        )
-    else:
-        farm_table = html.P("No farms match the selected filters", 
-                           style={'textAlign': 'center', 'color': '#6b7280', 'padding': '2rem'})
+    record = {field: value for (field, _, _, _), value in zip(ADD_FARM_FIELDS, values)}
+    if not (record['name'] or '').strip() or any(v is None for v in record.values()):
+        return shown, "Please fill in every field before saving.", dash.no_update
+    record['name'] = record['name'].strip()
+    for flag in ADD_FARM_FLAGS:
+        record[flag['value']] = flag['value'] in (flags or [])
     
-    # Filter summary
-    filter_summary = html.Div([
-        html.Span(f"Showing {total_farms} of {len(farms_df)} farms", style={'marginRight': '2rem'}),
-        html.Span([
-            html.Span("●", style={'color': '#10b981', 'marginRight': '0.3rem'}),
-            f"{filtered_df['tnfd_compliant'].sum() if total_farms > 0 else 0} TNFD Compliant"
-        ], style={'marginRight': '2rem'}),
-        html.Span([
-            html.Span("●", style={'color': '#3b82f6', 'marginRight': '0.3rem'}),
-            f"{filtered_df['sfi_enrolled'].sum() if total_farms > 0 else 0} SFI Enrolled"
-        ])
-    ])
+    try:
+        farm_id = live_store.add_farm(record)
+    except ValueError as error:
+        return shown, str(error), dash.no_update
+    return hidden, f"Added {record['name']} ({farm_id})", live_store.version
+
+# Export: the link always points at the current selection, built in the browser
+app.clientside_callback(
+    """
+    function(search, region, tier, risk, filterQuery, format) {
+        const params = new URLSearchParams({
+            region: region == null ? '' : region,
+            tier: tier == null ? '' : tier,
+            risk: risk == null ? '' : risk
+        });
+        if (search) { params.set('search', search); }
+        if (filterQuery) { params.set('filter_query', filterQuery); }
+        return '/export/farms.' + format + '?' + params.toString();
+    }
+    """,
+    Output('export-link', 'href'),
+    FILTER_INPUTS + [Input('farm-table', 'filter_query'), Input('export-format', 'value')]
+)
+
+# Streams the selection in chunks; the download starts with the first chunk and
+# worker memory is bounded by the chunk size, not the portfolio
+@server.route('/export/farms.<fmt>')
+def export_farms(fmt):
+    if not export_available(fmt):
+        flask.abort(404)
+    args = flask.request.args
+    with live_store.reading():
+        key = filter_key(args.get('search'), args.get('region', 'all'), args.get('tier', 'all'),
+                         args.get('risk', 'all'))
+        positions = get_selection(key)['positions']
+        if args.get('filter_query'):
+            positions = live_store.table_query.query(positions, args['filter_query'])
+        # Writes can land while the download streams, so the export reads a
+        # snapshot: farms added meanwhile are left out and farms edited meanwhile
+        # are exported as they were when the download started
+        snapshot = live_store.snapshot()
+    chunks = iter_export(snapshot, positions, list(snapshot.columns), fmt)
     
-    return (metrics_cards, land_metrics, water_metrics, biodiversity_metrics,
-            fig1, fig2, fig3, fig4, farm_table, filter_summary)
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    return flask.Response(
+        flask.stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=supplier-farms.{extension}'}
+    )
 
 if __name__ == '__main__':
     # Get port from environment variable for deployment
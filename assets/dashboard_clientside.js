@@ -0,0 +1,275 @@
+/* Client-side filtering mode for small portfolios.
+ *
+ * The server ships the portfolio once as a compact columnar payload
+ * (client_filtering.client_payload) in the `farm-data` store; every filter change
+ * is then answered here, without a round trip. The numbers mirror the server
+ * callbacks in app.py: the same filters, the same aggregates, the same formatting.
+ */
+window.dash_clientside = window.dash_clientside || {};
+
+(function() {
+    function decode(data, column, i) {
+        const value = data.columns[column][i];
+        const labels = data.categories[column];
+        return labels ? (value < 0 ? null : labels[value]) : value;
+    }
+
+    // Case folding as str.casefold() on the server: data.search_folding lists the
+    // characters whose casefold is not their lowercase form
+    function fold(data, text) {
+        const casefold = data.search_folding.casefold;
+        let folded = '';
+        for (const char of text) {
+            folded += casefold[char] !== undefined ? casefold[char] : char.toLowerCase();
+        }
+        return folded;
+    }
+
+    // The search box value as result_cache.normalize_search() leaves it: stripped of
+    // the characters str.strip() removes, then case-folded
+    function normalizeSearch(data, search) {
+        const whitespace = data.search_folding.whitespace;
+        const chars = Array.from(search || '');
+        let start = 0;
+        let end = chars.length;
+        while (start < end && whitespace.includes(chars[start])) { start += 1; }
+        while (end > start && whitespace.includes(chars[end - 1])) { end -= 1; }
+        return fold(data, chars.slice(start, end).join(''));
+    }
+
+    // Case-folded names and ids, built once per payload
+    const searchTexts = new WeakMap();
+    function searchText(data) {
+        let text = searchTexts.get(data);
+        if (!text) {
+            text = {
+                name: data.columns.name.map(value => fold(data, String(value))),
+                id: data.columns.id.map(value => fold(data, String(value)))
+            };
+            searchTexts.set(data, text);
+        }
+        return text;
+    }
+
+    // Row positions matching the search box and dropdowns, by the server's rules:
+    // 'all' leaves a dropdown unfiltered and any other value, including a cleared
+    // (null) dropdown, matches only farms with exactly that value
+    function select(data, search, region, tier, risk) {
+        const query = normalizeSearch(data, search);
+        const text = query ? searchText(data) : null;
+        const cols = data.columns;
+        const code = (column, value) => value === 'all' ? null : data.categories[column].indexOf(value);
+        const regionCode = code('region', region);
+        const tierCode = code('supplier_tier', tier);
+        const droughtCode = code('drought_risk', risk);
+        const floodCode = code('flood_risk', risk);
+        const positions = [];
+        for (let i = 0; i < data.n_rows; i++) {
+            if (regionCode !== null && cols.region[i] !== regionCode) { continue; }
+            if (tierCode !== null && cols.supplier_tier[i] !== tierCode) { continue; }
+            if (droughtCode !== null && cols.drought_risk[i] !== droughtCode && cols.flood_risk[i] !== floodCode) {
+                continue;
+            }
+            if (query && !text.name[i].includes(query) && !text.id[i].includes(query)) {
+                continue;
+            }
+            positions.push(i);
+        }
+        return positions;
+    }
+
+    function aggregate(data, positions) {
+        const cols = data.columns;
+        const highDrought = data.categories.drought_risk.indexOf('High');
+        const highFlood = data.categories.flood_risk.indexOf('High');
+        const agg = {
+            count: positions.length, compliant: 0, score_sum: 0, habitat_ha: 0, soil_ok: 0,
+            water_sum: 0, water_ok: 0, biodiversity_sum: 0, sfi: 0, cs: 0, both_schemes: 0,
+            high_risk: 0, by_region: {}, by_tier: {}, by_drought: {}, by_flood: {}
+        };
+        const bump = (counts, key) => { counts[key] = (counts[key] || 0) + 1; };
+        for (const i of positions) {
+            agg.compliant += cols.tnfd_compliant[i];
+            agg.score_sum += cols.overall_score[i];
+            agg.habitat_ha += cols.size[i] * cols.natural_habitat[i] / 100;
+            agg.soil_ok += cols.soil_health[i] >= 4.0 ? 1 : 0;
+            agg.water_sum += cols.water_efficiency[i];
+            agg.water_ok += cols.water_efficiency[i] >= 85 ? 1 : 0;
+            agg.biodiversity_sum += cols.biodiversity_score[i];
+            agg.sfi += cols.sfi_enrolled[i];
+            agg.cs += cols.cs_enrolled[i];
+            agg.both_schemes += cols.sfi_enrolled[i] & cols.cs_enrolled[i];
+            if (cols.drought_risk[i] === highDrought || cols.flood_risk[i] === highFlood) {
+                agg.high_risk += 1;
+            }
+            const region = agg.by_region[cols.region[i]] ||
+                (agg.by_region[cols.region[i]] = {count: 0, score_sum: 0, compliant: 0});
+            region.count += 1;
+            region.score_sum += cols.overall_score[i];
+            region.compliant += cols.tnfd_compliant[i];
+            bump(agg.by_tier, decode(data, 'supplier_tier', i));
+            bump(agg.by_drought, decode(data, 'drought_risk', i));
+            bump(agg.by_flood, decode(data, 'flood_risk', i));
+        }
+        return agg;
+    }
+
+    // Card metrics of one quarter from the per-farm history rollups of the selection
+    function quarterMetrics(history, q, positions) {
+        const totals = {count: 0, compliant: 0, score_sum: 0, high_risk: 0};
+        for (const i of positions) {
+            if (i >= history.count[q].length) { continue; }  // added after the history was built
+            for (const name in totals) { totals[name] += history[name][q][i]; }
+        }
+        if (totals.count <= 0) { return null; }
+        return {
+            compliance_pct: totals.compliant / totals.count * 100,
+            avg_score: totals.score_sum / totals.count,
+            high_risk_pct: totals.high_risk / totals.count * 100
+        };
+    }
+
+    // Card metrics of one quarter from the segment rollups (flattened region x tier x
+    // drought x flood cubes) for a dropdown combination, as AggregateCube.totals()
+    function segmentMetrics(segments, q, region, tier, risk) {
+        const [regions, tiers, droughts, floods] = segments.dimensions;
+        const matches = (value, selected) => selected === 'all' || value === selected;
+        const totals = {count: 0, compliant: 0, score_sum: 0, high_risk: 0};
+        let cell = 0;
+        for (const r of regions) {
+            for (const t of tiers) {
+                for (const d of droughts) {
+                    for (const f of floods) {
+                        const risky = risk === 'all' || d === risk || f === risk;
+                        if (matches(r, region) && matches(t, tier) && risky) {
+                            for (const name of ['count', 'compliant', 'score_sum']) {
+                                totals[name] += segments.measures[name][q][cell];
+                            }
+                            if (d === 'High' || f === 'High') {
+                                totals.high_risk += segments.measures.count[q][cell];
+                            }
+                        }
+                        cell += 1;
+                    }
+                }
+            }
+        }
+        if (totals.count <= 0) { return null; }
+        return {
+            compliance_pct: totals.compliant / totals.count * 100,
+            avg_score: totals.score_sum / totals.count,
+            high_risk_pct: totals.high_risk / totals.count * 100
+        };
+    }
+
+    // Quarter-over-quarter note text and style, as change_note() in app.py
+    function changeNote(previous, current, metric, unit, higherIsBetter) {
+        if (!previous || !current) {
+            return ['—', {fontSize: '0.8rem', color: '#9ca3af'}];
+        }
+        const delta = current[metric] - previous[metric];
+        const improved = higherIsBetter ? delta >= 0 : delta <= 0;
+        const sign = delta >= 0 ? '+' : '';
+        return [sign + delta.toFixed(1) + ' ' + unit + ' vs last quarter',
+                {fontSize: '0.8rem', color: improved ? '#10b981' : '#ef4444'}];
+    }
+
+    function chartTitle(total) {
+        return total === 0 ? 'No data available' : '';
+    }
+
+    // The graph's current figure with some trace properties and the title replaced
+    function withTraces(figure, traces, title) {
+        const data = figure.data.map((trace, i) => traces[i] ? Object.assign({}, trace, traces[i]) : trace);
+        return Object.assign({}, figure, {data: data, layout: Object.assign({}, figure.layout, {title: {text: title}})});
+    }
+
+    function span(children, style) {
+        return {namespace: 'dash_html_components', type: 'Span', props: {children: children, style: style}};
+    }
+
+    const TABLE_COLUMNS = ['name', 'id', 'region', 'supplier_tier', 'size', 'overall_score',
+                           'tnfd_compliant', 'drought_risk', 'flood_risk'];
+
+    window.dash_clientside.farms = {
+        updateDashboard: function(data, search, region, tier, risk, regionalFigure, riskFigure, tierFigure,
+                                  schemeFigure) {
+            if (!data) {
+                return window.dash_clientside.no_update;
+            }
+            const positions = select(data, search, region, tier, risk);
+            const agg = aggregate(data, positions);
+            const total = agg.count;
+            const pct = (value) => total > 0 ? value / total * 100 : 0;
+            const avg = (value) => total > 0 ? value / total : 0;
+
+            const cards = [
+                String(total), pct(agg.compliant).toFixed(1) + '%', avg(agg.score_sum).toFixed(0) + '/100',
+                pct(agg.high_risk).toFixed(1) + '%'
+            ];
+            const tnfd = [
+                agg.habitat_ha.toFixed(0) + ' ha', pct(agg.soil_ok).toFixed(1) + '%',
+                avg(agg.water_sum).toFixed(0) + '%', pct(agg.water_ok).toFixed(1) + '%',
+                pct(agg.high_risk).toFixed(1) + '%', avg(agg.biodiversity_sum).toFixed(0) + '/100'
+            ];
+
+            const regionCodes = Object.keys(agg.by_region).map(Number).sort((a, b) => a - b);
+            const regions = regionCodes.map(code => data.categories.region[code]);
+            const byRegion = regionCodes.map(code => agg.by_region[code]);
+            const regional = withTraces(regionalFigure, {
+                0: {x: regions, y: byRegion.map(r => r.count)},
+                1: {x: regions, y: byRegion.map(r => r.score_sum / r.count)},
+                2: {x: regions, y: byRegion.map(r => r.compliant / r.count * 100)}
+            }, chartTitle(regions.length));
+            const riskChart = withTraces(riskFigure, {
+                0: {y: riskFigure.data[0].x.map(level => agg.by_drought[level] || 0)},
+                1: {y: riskFigure.data[1].x.map(level => agg.by_flood[level] || 0)}
+            }, chartTitle(total));
+            const tiers = Object.keys(agg.by_tier).sort((a, b) => agg.by_tier[b] - agg.by_tier[a]);
+            const tierChart = withTraces(tierFigure, {
+                0: {labels: tiers, values: tiers.map(t => agg.by_tier[t])}
+            }, chartTitle(tiers.length));
+            const scheme = withTraces(schemeFigure, {
+                0: {y: [agg.sfi, agg.cs, agg.both_schemes]}
+            }, chartTitle(total));
+
+            const summary = {namespace: 'dash_html_components', type: 'Div', props: {children: [
+                span('Showing ' + total + ' of ' + data.n_rows + ' farms', {marginRight: '2rem'}),
+                span([span('●', {color: '#10b981', marginRight: '0.3rem'}), agg.compliant + ' TNFD Compliant'],
+                     {marginRight: '2rem'}),
+                span([span('●', {color: '#3b82f6', marginRight: '0.3rem'}), agg.sfi + ' SFI Enrolled'])
+            ]}};
+
+            const rows = positions.map(i => {
+                const row = {};
+                for (const column of TABLE_COLUMNS) {
+                    row[column] = decode(data, column, i);
+                }
+                row.tnfd_compliant = row.tnfd_compliant ? '✓' : '✗';
+                return row;
+            });
+            const message = rows.length ? null : {namespace: 'dash_html_components', type: 'P', props: {
+                children: 'No farms match the selected filters',
+                style: {textAlign: 'center', color: '#6b7280', padding: '2rem'}
+            }};
+
+            // Dropdown views read the segment rollups, searches the per-farm rollups
+            let previous = null;
+            let current = null;
+            if (data.history && normalizeSearch(data, search)) {
+                previous = quarterMetrics(data.history, 0, positions);
+                current = quarterMetrics(data.history, 1, positions);
+            } else if (data.history_segments) {
+                previous = segmentMetrics(data.history_segments, 0, region, tier, risk);
+                current = segmentMetrics(data.history_segments, 1, region, tier, risk);
+            }
+            const notes = [].concat(
+                changeNote(previous, current, 'compliance_pct', 'pts', true),
+                changeNote(previous, current, 'avg_score', 'points', true),
+                changeNote(previous, current, 'high_risk_pct', 'pts', false)
+            );
+
+            return cards.concat(tnfd, [regional, riskChart, tierChart, scheme, summary, rows, 0, message], notes);
+        }
+    };
+})();
@@ -0,0 +1,104 @@
+/* Virtualized farm list for the Farms page.
+ *
+ * The loaded rows live in the `farm-list-rows` store; only the rows inside the
+ * scroll viewport (plus a small overscan) are rendered, absolutely positioned in a
+ * spacer as tall as the whole loaded list, so the DOM stays the same size however
+ * far the list is scrolled. Scrolling near the end of the loaded rows asks the
+ * server for the next keyset page through `farm-list-more`; clicks on a row publish
+ * its farm id in `farm-list-selected`.
+ */
+window.dash_clientside = window.dash_clientside || {};
+
+(function() {
+    const ROW_HEIGHT = 48;
+    const OVERSCAN = 10;
+    const PREFETCH = 30;   // rows left below the window that trigger the next page
+    let scrolledKey = null;
+    let requested = null;
+    let pendingFrame = false;
+
+    function viewport() {
+        return document.getElementById('farm-list-viewport');
+    }
+
+    function publishScroll() {
+        pendingFrame = false;
+        const view = viewport();
+        if (!view) { return; }
+        window.dash_clientside.set_props('farm-list-scroll', {data: {
+            first: Math.floor(view.scrollTop / ROW_HEIGHT),
+            visible: Math.ceil(view.clientHeight / ROW_HEIGHT)
+        }});
+    }
+
+    // Scroll events do not bubble; listen in the capture phase so the listener
+    // survives the page being re-rendered
+    document.addEventListener('scroll', function(event) {
+        if (event.target.id === 'farm-list-viewport' && !pendingFrame) {
+            pendingFrame = true;
+            window.requestAnimationFrame(publishScroll);
+        }
+    }, true);
+
+    document.addEventListener('click', function(event) {
+        const row = event.target.closest && event.target.closest('[data-farm-id]');
+        if (row && row.closest('#farm-list-viewport')) {
+            window.dash_clientside.set_props('farm-list-selected', {data: row.getAttribute('data-farm-id')});
+        }
+    });
+
+    function div(children, style, extra) {
+        return {namespace: 'dash_html_components', type: 'Div',
+                props: Object.assign({children: children, style: style}, extra || {})};
+    }
+
+    function farmRow(row, i, selected) {
+        const score = row.overall_score;
+        return div([
+            div([
+                div(row.name, {fontWeight: 'bold', color: '#1f2937', whiteSpace: 'nowrap',
+                               overflow: 'hidden', textOverflow: 'ellipsis'}),
+                div(row.id + ' · ' + row.region + ' · ' + row.supplier_tier, {fontSize: '0.8rem', color: '#6b7280'})
+            ], {minWidth: 0}),
+            div(String(score), {fontWeight: 'bold', color: score >= 70 ? '#10b981' : score >= 50 ? '#f59e0b' : '#ef4444'})
+        ], {
+            position: 'absolute', top: (i * ROW_HEIGHT) + 'px', left: 0, right: 0, height: ROW_HEIGHT + 'px',
+            display: 'flex', justifyContent: 'space-between', alignItems: 'center', padding: '0 1rem',
+            borderBottom: '1px solid #f3f4f6', cursor: 'pointer',
+            borderLeft: '4px solid ' + (row.tnfd_compliant ? '#10b981' : '#e5e7eb'),
+            backgroundColor: row.id === selected ? '#eff6ff' : 'white'
+        }, {'data-farm-id': row.id});
+    }
+
+    window.dash_clientside.farmList = {
+        render: function(rows, scroll, selected, cursor) {
+            rows = rows || [];
+            scroll = scroll || {first: 0, visible: 15};
+            let first = scroll.first;
+            // A new filter or dataset starts the list again from the top
+            if (cursor && cursor.key !== scrolledKey) {
+                scrolledKey = cursor.key;
+                const view = viewport();
+                if (view) { view.scrollTop = 0; }
+                first = 0;
+            }
+            const start = Math.max(0, first - OVERSCAN);
+            const end = Math.min(rows.length, first + scroll.visible + OVERSCAN);
+            const children = [];
+            for (let i = start; i < end; i++) {
+                children.push(farmRow(rows[i], i, selected));
+            }
+            const list = div(children, {position: 'relative', height: (rows.length * ROW_HEIGHT) + 'px'});
+
+            // Ask once per cursor for the page after the last loaded row; the request
+            // carries the loaded count so the server can tell stale requests apart
+            let more = window.dash_clientside.no_update;
+            const position = cursor ? cursor.key + ':' + cursor.loaded : null;
+            if (cursor && !cursor.done && position !== requested && first + scroll.visible + PREFETCH >= rows.length) {
+                requested = position;
+                more = cursor.loaded;
+            }
+            return [list, more];
+        }
+    };
+})();
@@ -0,0 +1,71 @@
+import functools
+
+from dash import DiskcacheManager
+
+try:
+    import diskcache
+except ImportError:  # without diskcache, heavy callbacks run inline in the request
+    diskcache = None
+
+
+def background_available():
+    return diskcache is not None
+
+
+# Disk-backed manager for Dash background callbacks. Jobs run in their own
+# processes and their results live in a diskcache directory, so no Redis or Celery
+# is needed and every gunicorn worker on the host can pick up a finished result.
+# cache_by adds values (e.g. the dataset version) to each result's cache key.
+def create_background_manager(directory, cache_by=None, expire=3600):
+    if diskcache is None:
+        return None
+    return DiskcacheManager(diskcache.Cache(directory), cache_by=cache_by, expire=expire)
+
+
+def _ignore_progress(*args):
+    pass
+
+
+# Registers heavy callbacks as background callbacks.
+#
+# Background callbacks are answered immediately and polled, so a long computation
+# never holds a gunicorn worker thread past its timeout. The function receives a
+# set_progress callable first when progress outputs are given; cancel inputs (e.g.
+# the callback's own inputs, or the page URL) abort a running job as soon as they
+# change, and results are cached on the callback's inputs so repeating a request
+# returns instantly.
+#
+# Without a manager the same callbacks run synchronously: set_progress becomes a
+# no-op and cancel is ignored, so callers never need two code paths. `names` holds
+# the function names of the callbacks registered here either way.
+class BackgroundCallbacks:
+    def __init__(self, app, manager=None):
+        self.app = app
+        self.manager = manager
+        self.names = set()
+
+    def callback(self, *args, progress=None, progress_default=None, cancel=None, running=None, **kwargs):
+        register_background = self._register(*args, progress=progress, progress_default=progress_default,
+                                             cancel=cancel, running=running, **kwargs)
+
+        def register(func):
+            self.names.add(func.__name__)
+            return register_background(func)
+        return register
+
+    def _register(self, *args, progress=None, progress_default=None, cancel=None, running=None, **kwargs):
+        if running is not None:
+            kwargs['running'] = running
+        if self.manager is not None:
+            return self.app.callback(*args, background=True, manager=self.manager, progress=progress,
+                                     progress_default=progress_default, cancel=cancel, **kwargs)
+
+        def register(func):
+            if progress is None:
+                return self.app.callback(*args, **kwargs)(func)
+
+            @functools.wraps(func)
+            def run_inline(*values):
+                return func(_ignore_progress, *values)
+            return self.app.callback(*args, **kwargs)(run_inline)
+        return register
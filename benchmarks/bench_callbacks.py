@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Callback benchmarks across portfolio sizes.
+#
+# Every server-side callback is dispatched through Dash's own update endpoint with
+# the Flask test client (no browser, no HTTP server), so the timings include input
+# parsing and response serialization and the byte counts are exactly what a
+# browser would receive. Each portfolio size runs in its own subprocess because the
+# app builds its farm store at import time from FARM_COUNT.
+#
+#   python benchmarks/bench_callbacks.py --update-baseline     # record a baseline
+#   python benchmarks/bench_callbacks.py                       # run, compare to baseline
+#   python benchmarks/bench_callbacks.py --sizes 270 10000     # subset of sizes
+#   python benchmarks/bench_callbacks.py --backends pandas sqlite  # compare the farm backends
+#
+# The run fails (exit code 1) when a callback's wall time, peak memory or response
+# size regresses past --threshold relative to the baseline. Baselines only hold
+# for the machine they were recorded on, so none is committed (baseline.json is
+# ignored by git like results.json): record one locally, or in the CI job, from
+# the commit to compare against. Results of a
+# non-default backend (FARM_BACKEND) are keyed with an @<backend> suffix.
+#
+# Background callbacks (analytics scatter, climate scenario, reports) are measured
+# inline (BACKGROUND_CALLBACKS=0), so their wall time and peak memory are those of
+# the computation itself. With --background-jobs they run as diskcache jobs, as
+# deployed: wall times then include the polling and peak memory only covers the
+# polling requests, since the job runs in a child process. Each such result records
+# the mode it was measured in ('background': 'inline' / 'job'), and results are
+# only compared with a baseline measured in the same mode.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, 'benchmarks')
+DEFAULT_SIZES = [270, 10000, 100000, 1000000]
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, 'results.json')
+BACKENDS = ('pandas', 'sqlite')
+
+# Input values every callback starts from; scenarios override the filters
+BASE_INPUTS = {
+    'url.pathname': '/',
+    'search-input.value': None,
+    'region-dropdown.value': 'all',
+    'tier-dropdown.value': 'all',
+    'risk-dropdown.value': 'all',
+    'dataset-version.data': None,
+    'farm-table.page_current': 0,
+    'farm-table.page_size': 20,
+    'farm-table.sort_by': [],
+    'farm-table.filter_query': '',
+    'analytics-x.value': 'nitrogen_efficiency',
+    'analytics-y.value': 'biodiversity_score',
+    'analytics-region.value': 'all',
+    'analytics-tier.value': 'all',
+    'analytics-risk.value': 'all',
+    'farm-list-search.value': None,
+    'farm-list-region.value': 'all',
+    'farm-list-more.data': None,
+    'farm-list-cursor.data': None,
+    'selected-farm-store.data': None,
+    'climate-scenario.value': 'drought',
+    'climate-region.value': 'all',
+    'climate-trials.value': 2000
+}
+
+# Representative filter combinations. A callable value is computed from the
+# imported app module.
+SCENARIOS = {
+    'all': {},
+    'region': {'region-dropdown.value': 'South West'},
+    'region-tier-risk': {'region-dropdown.value': 'Yorkshire', 'tier-dropdown.value': 'Gold',
+                         'risk-dropdown.value': 'High'},
+    'search': {'search-input.value': 'oak'},
+    'search-id-region': {'search-input.value': 'FARM_1', 'region-dropdown.value': 'North West'},
+    'table-sort-filter': {'farm-table.sort_by': [{'column_id': 'overall_score', 'direction': 'desc'}],
+                          'farm-table.filter_query': '{size} s> 200'},
+    'analytics-region': {'analytics-x.value': 'milk_volume', 'analytics-y.value': 'overall_score',
+                         'analytics-region.value': 'South West'},
+    'farms-search-region': {'farm-list-search.value': 'oak', 'farm-list-region.value': 'South West'},
+    'climate-compound-region': {'climate-scenario.value': 'compound', 'climate-region.value': 'South West'},
+    # The first farm selected on the Farms page: its scorecard is built and rendered
+    'farm-detail': {'farm-list-selected.data': lambda app_module: app_module.live_store.df['id'].iloc[0],
+                    'selected-farm-store.data': lambda app_module: app_module.farm_scorecard(
+                        app_module.live_store.df, 0, None, app_module.farm_history)}
+}
+
+
+def _prop_id(dependency):
+    return f"{dependency['id']}.{dependency['property']}"
+
+
+def _request_body(output, spec, values):
+    if output.startswith('..'):
+        outputs = [{'id': o.split('.')[0], 'property': o.split('.')[1]}
+                   for o in output.strip('.').split('...')]
+    else:
+        outputs = {'id': output.split('.')[0], 'property': output.split('.')[1]}
+    return {
+        'output': output,
+        'outputs': outputs,
+        'inputs': [dict(i, value=values.get(_prop_id(i))) for i in spec['inputs']],
+        'state': [dict(s, value=values.get(_prop_id(s))) for s in spec['state']],
+        'changedPropIds': [_prop_id(i) for i in spec['inputs']]
+    }
+
+
+# Post a callback request; background callbacks are polled until their job finishes
+def _dispatch(client, body):
+    response = client.post('/_dash-update-component', json=body)
+    job = response.get_json(silent=True) or {}
+    while response.status_code == 200 and 'cacheKey' in job:
+        time.sleep(0.05)
+        response = client.post(f"/_dash-update-component?cacheKey={job['cacheKey']}&job={job['job']}",
+                               json=body)
+        if 'response' in (response.get_json(silent=True) or {}):
+            break
+    return response
+
+
+def _clear_caches(app_module):
+    for name in ('dashboard_cache', 'selection_cache', 'farm_detail_cache'):
+        cache = getattr(app_module, name, None)
+        if cache is not None:
+            cache.invalidate()
+    manager = getattr(getattr(app_module, 'background', None), 'manager', None)
+    if manager is not None:
+        manager.handle.clear()  # cached background results
+
+
+# Runs inside the per-size subprocess and prints its results as JSON
+def run_worker(size, repeats):
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    started = time.perf_counter()
+    import app as app_module
+    startup = time.perf_counter() - started
+    background_mode = 'job' if app_module.background.manager is not None else 'inline'
+
+    client = app_module.server.test_client()
+    dependencies = {d['output']: d for d in client.get('/_dash-dependencies').get_json()}
+
+    results = {}
+    for output, spec in app_module.app.callback_map.items():
+        dependency = dependencies.get(output, {})
+        if 'callback' not in spec or spec['callback'].__name__ == 'cancel_call':
+            continue  # clientside callbacks and Dash's background job cancellation
+        name = spec['callback'].__name__
+        input_props = {_prop_id(i) for i in spec['inputs']}
+
+        for scenario, overrides in SCENARIOS.items():
+            if scenario != 'all' and not input_props & set(overrides):
+                continue  # callback does not depend on this scenario's inputs
+            if dependency.get('prevent_initial_call') and not input_props & set(overrides):
+                continue  # runs on user actions only (e.g. writes), none of which the scenario sets
+            values = {prop: value(app_module) if callable(value) else value
+                      for prop, value in dict(BASE_INPUTS, **overrides).items()}
+            body = _request_body(output, spec, values)
+
+            walls = []
+            n_bytes = 0
+            for _ in range(repeats):
+                _clear_caches(app_module)
+                t0 = time.perf_counter()
+                response = _dispatch(client, body)
+                walls.append(time.perf_counter() - t0)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{name}/{scenario}: HTTP {response.status_code}")
+                n_bytes = len(response.get_data())
+
+            _clear_caches(app_module)
+            tracemalloc.start()
+            _dispatch(client, body)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            result = {
+                'wall_ms': statistics.median(walls) * 1000,
+                'peak_kb': peak / 1024,
+                'response_bytes': n_bytes
+            }
+            if name in app_module.background.names:
+                result['background'] = background_mode
+            results[f"{size}/{scenario}/{name}"] = result
+
+    results[f"{size}/startup/import_app"] = {'wall_ms': startup * 1000, 'peak_kb': 0, 'response_bytes': 0}
+    json.dump(results, sys.stdout)
+
+
+def run_size(size, repeats, seed, backend='pandas', background_jobs=False):
+    # CLIENTSIDE_MAX_FARMS=0 keeps small portfolios on the server path being measured
+    env = dict(os.environ, FARM_COUNT=str(size), FARM_SEED=str(seed), CLIENTSIDE_MAX_FARMS='0',
+               FARM_BACKEND=backend, BACKGROUND_CALLBACKS='1' if background_jobs else '0')
+    for name in ('FARM_DATA_DIR', 'FARM_INGEST_DIR', 'FARM_SQLITE_PATH'):
+        env.pop(name, None)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', str(size), '--repeats', str(repeats)],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    results = json.loads(output)
+    if backend == 'pandas':
+        return results
+    return {f"{key}@{backend}": value for key, value in results.items()}
+
+
+# Wall times of the same callbacks on each backend, side by side
+def print_backend_comparison(results, backends):
+    print()
+    print(f"{'callback':<58} " + ' '.join(f"{b + ' ms':>12}" for b in backends))
+    for key in sorted((k for k in results if '@' not in k), key=lambda k: (int(k.split('/')[0]), k)):
+        walls = [results.get(key if b == 'pandas' else f"{key}@{b}") for b in backends]
+        if all(walls):
+            print(f"{key:<58} " + ' '.join(f"{w['wall_ms']:>12.2f}" for w in walls))
+
+
+def compare(results, baseline, threshold, min_delta_ms, min_delta_kb):
+    regressions = []
+    for key, current in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None or base.get('background') != current.get('background'):
+            continue
+        checks = [
+            ('wall_ms', min_delta_ms),
+            ('peak_kb', min_delta_kb),
+            ('response_bytes', 0)
+        ]
+        for metric, min_delta in checks:
+            if (current[metric] > base[metric] * (1 + threshold)
+                    and current[metric] - base[metric] > min_delta):
+                regressions.append(f"{key} {metric}: {base[metric]:.1f} -> {current[metric]:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard callbacks across portfolio sizes")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=['pandas'],
+                        help="farm backends to run (FARM_BACKEND); several print a side-by-side comparison")
+    parser.add_argument('--background-jobs', action='store_true',
+                        help="run background callbacks as diskcache jobs instead of inline; their peak "
+                             "memory then excludes the job process and wall times include polling")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed relative regression per metric (default 0.25 = 25%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                        help="ignore wall-time regressions smaller than this")
+    parser.add_argument('--min-delta-kb', type=float, default=1024.0,
+                        help="ignore peak-memory regressions smaller than this")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        run_worker(args.worker, args.repeats)
+        return 0
+
+    results = {}
+    for size in args.sizes:
+        for backend in args.backends:
+            print(f"Benchmarking {size:,} farms ({backend})...", file=sys.stderr)
+            results.update(run_size(size, args.repeats, args.seed, backend, args.background_jobs))
+
+    print(f"{'callback':<65} {'wall ms':>10} {'peak KB':>10} {'bytes':>10}  background")
+    for key, r in sorted(results.items(), key=lambda item: (int(item[0].split('/')[0]), item[0])):
+        print(f"{key:<65} {r['wall_ms']:>10.2f} {r['peak_kb']:>10.0f} {r['response_bytes']:>10}  "
+              f"{r.get('background', '')}")
+    if args.background_jobs:
+        print("Background callbacks ran as jobs: their peak KB covers only the polling requests")
+    if len(args.backends) > 1:
+        print_backend_comparison(results, args.backends)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.min_delta_ms, args.min_delta_kb)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import math
+
+import numpy as np
+
+# Server-side 2D binning for the farm-level Analytics scatter.
+#
+# A WebGL scatter copes with tens of thousands of farms, but every point still
+# travels to the browser. Above a threshold the selection is aggregated into a
+# fixed grid instead: one cell per bin with the farm count and per-bin measures,
+# so the response is bounded by bins x bins whatever the portfolio size.
+
+# Farm attributes the Analytics scatter can plot, with their axis titles
+SCATTER_AXES = {
+    'biodiversity_score': 'Biodiversity Score',
+    'nitrogen_efficiency': 'Nitrogen Efficiency (%)',
+    'phosphorus_efficiency': 'Phosphorus Efficiency (%)',
+    'water_efficiency': 'Water Efficiency (%)',
+    'natural_habitat': 'Natural Habitat (%)',
+    'soil_health': 'Soil Health',
+    'overall_score': 'Overall Score',
+    'milk_volume': 'Milk Volume (litres)',
+    'size': 'Farm Size (ha)',
+    'herd_size': 'Herd Size'
+}
+DEFAULT_MAX_POINTS = 20000
+DEFAULT_BINS = 100
+
+
+# Uniform bin edges over the values. Integer columns get whole-number bins centred
+# on the values, so a 0-100 score is never split unevenly across cells.
+def bin_edges(values, bins=DEFAULT_BINS):
+    if len(values) == 0:
+        return np.array([0.0, 1.0])
+    low = float(values.min())
+    high = float(values.max())
+    if values.dtype.kind in 'iu':
+        width = max(1, math.ceil((high - low + 1) / bins))
+        n_bins = math.ceil((high - low + 1) / width)
+        return low - 0.5 + width * np.arange(n_bins + 1, dtype=np.float64)
+    if high == low:
+        high = low + 1
+    return np.linspace(low, high, bins + 1)
+
+
+def _bin_codes(values, edges):
+    n_bins = len(edges) - 1
+    width = (edges[-1] - edges[0]) / n_bins
+    codes = ((values.astype(np.float64) - edges[0]) / width).astype(np.int64)
+    return np.clip(codes, 0, n_bins - 1), n_bins
+
+
+# Counts (and sums of any weights) of the points per grid cell, as arrays of shape
+# (y bins, x bins) ready for a heatmap, with the bin centres of both axes
+def bin_2d(x, y, bins=DEFAULT_BINS, weights=None):
+    x_edges = bin_edges(x, bins)
+    y_edges = bin_edges(y, bins)
+    x_codes, nx = _bin_codes(x, x_edges)
+    y_codes, ny = _bin_codes(y, y_edges)
+    cells = y_codes * nx + x_codes
+
+    result = {
+        'x': (x_edges[:-1] + x_edges[1:]) / 2,
+        'y': (y_edges[:-1] + y_edges[1:]) / 2,
+        'count': np.bincount(cells, minlength=nx * ny).reshape(ny, nx)
+    }
+    for name, values in (weights or {}).items():
+        sums = np.bincount(cells, weights=values.astype(np.float64), minlength=nx * ny)
+        result[name] = sums.reshape(ny, nx)
+    return result
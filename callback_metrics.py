@@ -0,0 +1,297 @@
+import atexit
+import functools
+import hmac
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import flask
+
+DISPATCH_PATH = '/_dash-update-component'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _bucket_label(bound):
+    return f"{bound:g}" if isinstance(bound, float) else str(bound)
+
+
+# One Dash update request: which callback ran and how long each phase took
+class _Timing:
+    def __init__(self, name=None):
+        self.name = name
+        self.started = time.perf_counter()
+        self.callback_end = None
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+# Opt-in per-callback instrumentation.
+#
+# Every request to Dash's update endpoint is timed end to end and its response size
+# recorded, labelled with the name of the callback that served it. Code inside a
+# callback marks its phases with `with callback_metrics.phase('filter'):` and the
+# time between the callback returning and the response being ready is reported as
+# the serialize phase (callbacks decorated with @callback_metrics.observe). Phase
+# timings go back to the browser as a Server-Timing header, and totals are exposed
+# in Prometheus text format at /metrics.
+#
+# The callback name comes from the observed function; other callbacks are named
+# after their output once the request is done, from the body Dash has already
+# parsed, so timing a request never parses it again. /metrics is served to clients
+# presenting `token` as a bearer token, or without a token to loopback clients
+# only (e.g. a scraper on the same host).
+#
+# gunicorn workers each keep their own counters. With a shared directory every
+# worker writes its snapshot to <directory>/<pid>.json from a background thread
+# (every flush_interval while there is something new, and once more at exit) and
+# /metrics sums the snapshots of all workers, so the numbers are the same whichever
+# worker answers the scrape. Files of workers that are no longer running are
+# removed at startup and whenever /metrics is served.
+class CallbackMetrics:
+    def __init__(self, enabled=False, directory=None, flush_interval=1.0, token=None):
+        self.enabled = enabled
+        self.directory = directory
+        self.token = token
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._sizes = {}
+        self._phases = {}
+        self._requests = {}
+        self._dirty = False
+        self._flusher_pid = None
+        self._callback_names = {}
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        self._app = app
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._remove_stale()
+            atexit.register(self._flush_at_exit)
+        server = app.server
+        server.before_request(self._before_request)
+        server.after_request(self._after_request)
+        server.add_url_rule('/metrics', 'metrics', self._metrics_view)
+
+    def _callback_name(self, output):
+        if output not in self._callback_names:
+            spec = self._app.callback_map.get(output, {})
+            callback = spec.get('callback')
+            self._callback_names[output] = getattr(callback, '__name__', None) or output
+        return self._callback_names[output]
+
+    # Snapshot files of workers that are no longer running
+    def _remove_stale(self):
+        for filename in os.listdir(self.directory):
+            stem, extension = os.path.splitext(filename)
+            if extension == '.json' and stem.isdigit() and not _pid_alive(int(stem)):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass  # another worker removed it first
+
+    # Workers forked from a preloaded app do not inherit threads, so each process
+    # starts its own flusher on its first request
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    def _flush_at_exit(self):
+        if self._dirty:
+            self.flush()
+
+    def _before_request(self):
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+        self._local.timing = _Timing() if flask.request.path == DISPATCH_PATH else None
+
+    def _after_request(self, response):
+        timing = getattr(self._local, 'timing', None)
+        self._local.timing = None
+        if timing is None:
+            return response
+        finished = time.perf_counter()
+        if timing.name is None:
+            # Flask keeps the body Dash parsed, so this does not parse it again
+            body = flask.request.get_json(silent=True) or {}
+            timing.name = self._callback_name(body.get('output', 'unknown'))
+        if timing.callback_end is not None:
+            timing.add('serialize', finished - timing.callback_end)
+        n_bytes = response.calculate_content_length() or 0
+        self._record(timing.name, finished - timing.started, n_bytes, timing.phases,
+                     response.status_code)
+
+        entries = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in timing.phases.items()]
+        entries.append(f"total;dur={(finished - timing.started) * 1000:.2f}")
+        response.headers['Server-Timing'] = ', '.join(entries)
+        return response
+
+    # Decorator for callbacks; names the request after the callback and marks where
+    # the callback's own work ends
+    def observe(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timing = getattr(self._local, 'timing', None)
+            if timing is not None:
+                timing.name = func.__name__
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timing = getattr(self._local, 'timing', None)
+                if timing is not None:
+                    timing.callback_end = time.perf_counter()
+        return wrapper
+
+    @contextmanager
+    def phase(self, name):
+        timing = getattr(self._local, 'timing', None)
+        if timing is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            timing.add(name, time.perf_counter() - started)
+
+    def _record(self, name, seconds, n_bytes, phases, status):
+        with self._lock:
+            for store, buckets, value in ((self._latency, LATENCY_BUCKETS, seconds),
+                                          (self._sizes, SIZE_BUCKETS, n_bytes)):
+                histogram = store.setdefault(name, [[0] * len(buckets), 0.0, 0])
+                for i, bound in enumerate(buckets):
+                    if value <= bound:
+                        histogram[0][i] += 1
+                histogram[1] += value
+                histogram[2] += 1
+            for phase, phase_seconds in phases.items():
+                totals = self._phases.setdefault(f"{name}\t{phase}", [0.0, 0])
+                totals[0] += phase_seconds
+                totals[1] += 1
+            key = f"{name}\t{status}"
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps({
+                'latency': self._latency,
+                'sizes': self._sizes,
+                'phases': self._phases,
+                'requests': self._requests
+            }))
+
+    # Write this worker's counters where the other workers can read them
+    def flush(self):
+        self._dirty = False
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _merged(self):
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        self._remove_stale()
+        merged = {'latency': {}, 'sizes': {}, 'phases': {}, 'requests': {}}
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue  # a worker replacing its file right now
+            for kind in ('latency', 'sizes'):
+                for name, (buckets, total, count) in snapshot[kind].items():
+                    current = merged[kind].setdefault(name, [[0] * len(buckets), 0.0, 0])
+                    current[0] = [a + b for a, b in zip(current[0], buckets)]
+                    current[1] += total
+                    current[2] += count
+            for key, (total, count) in snapshot['phases'].items():
+                current = merged['phases'].setdefault(key, [0.0, 0])
+                current[0] += total
+                current[1] += count
+            for key, count in snapshot['requests'].items():
+                merged['requests'][key] = merged['requests'].get(key, 0) + count
+        return merged
+
+    def render(self):
+        merged = self._merged()
+        lines = []
+
+        def histogram(metric, help_text, data, buckets):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, (counts, total, count) in sorted(data.items()):
+                label = f'callback="{_label(name)}"'
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f'{metric}_bucket{{{label},le="{_bucket_label(bound)}"}} {bucket_count}')
+                lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f'{metric}_sum{{{label}}} {total:g}')
+                lines.append(f'{metric}_count{{{label}}} {count}')
+
+        histogram('dash_callback_duration_seconds', 'Time to serve a Dash callback request.',
+                  merged['latency'], LATENCY_BUCKETS)
+        histogram('dash_callback_response_bytes', 'Size of Dash callback responses.',
+                  merged['sizes'], SIZE_BUCKETS)
+
+        lines.append('# HELP dash_callback_phase_seconds Time spent per phase inside Dash callbacks.')
+        lines.append('# TYPE dash_callback_phase_seconds summary')
+        for key, (total, count) in sorted(merged['phases'].items()):
+            name, phase = key.split('\t')
+            label = f'callback="{_label(name)}",phase="{_label(phase)}"'
+            lines.append(f'dash_callback_phase_seconds_sum{{{label}}} {total:g}')
+            lines.append(f'dash_callback_phase_seconds_count{{{label}}} {count}')
+
+        lines.append('# HELP dash_callback_requests_total Dash callback requests by status code.')
+        lines.append('# TYPE dash_callback_requests_total counter')
+        for key, count in sorted(merged['requests'].items()):
+            name, status = key.split('\t')
+            lines.append(f'dash_callback_requests_total{{callback="{_label(name)}",status="{status}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def _authorized(self):
+        if not self.token:
+            return flask.request.remote_addr in LOOPBACK_ADDRESSES
+        scheme, _, credentials = flask.request.headers.get('Authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), self.token.encode())
+
+    def _metrics_view(self):
+        if not self._authorized():
+            flask.abort(401 if self.token else 403)
+        return flask.Response(self.render(), mimetype='text/plain; version=0.0.4')
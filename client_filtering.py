@@ -0,0 +1,79 @@
+import functools
+import sys
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cube import CUBE_DIMENSIONS
+
+# Columns the browser needs to filter the portfolio and compute every dashboard
+# panel and the supplier table without calling back to the server
+CLIENT_CATEGORY_COLUMNS = ('region', 'supplier_tier', 'drought_risk', 'flood_risk')
+CLIENT_COLUMNS = ('id', 'name') + CLIENT_CATEGORY_COLUMNS + (
+    'size', 'overall_score', 'tnfd_compliant', 'natural_habitat', 'soil_health', 'water_efficiency',
+    'biodiversity_score', 'milk_volume', 'sfi_enrolled', 'cs_enrolled'
+)
+
+
+# The search normalization of result_cache.normalize_search (strip, then casefold)
+# spelled out for the browser, which has no casefold: the characters str.strip()
+# removes, and every character whose casefold is not its lowercase form. Built once
+# per process, on the first payload.
+@functools.cache
+def search_folding():
+    whitespace = []
+    casefold = {}
+    for code in range(sys.maxunicode + 1):
+        char = chr(code)
+        if char.isspace():
+            whitespace.append(char)
+        folded = char.casefold()
+        if folded != char.lower():
+            casefold[char] = folded
+    return {'whitespace': ''.join(whitespace), 'casefold': casefold}
+
+
+# Compact columnar copy of the farm table for a dcc.Store.
+#
+# One array per column instead of one object per farm: low-cardinality columns are
+# sent as integer codes into a sorted category list (the same order the aggregate
+# cube uses) and booleans as 0/1, which keeps the payload a fraction of the size of
+# row records. assets/dashboard_clientside.js consumes it.
+#
+# With a farm history, the previous and current quarter's rollups are included so
+# the cards can show quarter-over-quarter changes exactly as the server does:
+# segment rollups (flattened cubes) for dropdown views, per-farm rollups for searches.
+# search_folding() lets the browser normalize searches exactly as the server does.
+def client_payload(df, history=None):
+    columns = {}
+    categories = {}
+    for column in CLIENT_COLUMNS:
+        series = df[column]
+        if column in CLIENT_CATEGORY_COLUMNS:
+            codes, labels = pd.factorize(series.astype(str), sort=True)
+            columns[column] = codes.tolist()
+            categories[column] = [str(label) for label in labels]
+        elif series.dtype == bool:
+            columns[column] = series.to_numpy().astype(np.uint8).tolist()
+        elif pd.api.types.is_float_dtype(series.dtype) and series.dtype.itemsize == 4:
+            # Shortest decimal form of each float32 (4.1, not 4.099999904632568)
+            columns[column] = series.to_numpy().astype(str).astype(np.float64).tolist()
+        elif pd.api.types.is_numeric_dtype(series.dtype):
+            columns[column] = series.to_numpy().tolist()
+        else:
+            columns[column] = series.astype(str).tolist()
+    payload = {'n_rows': len(df), 'columns': columns, 'categories': categories,
+               'search_folding': search_folding()}
+    if history is not None and history.has_quarter_change():
+        payload['history'] = {
+            name: [np.round(rollup[q], 4).tolist() for q in (-2, -1)]
+            for name, rollup in history.farm_rollups.items()
+        }
+        payload['history_segments'] = {
+            'dimensions': [history.dimensions[d] for d in CUBE_DIMENSIONS],
+            'measures': {
+                name: [np.round(np.ravel(history.rollups['quarter'][name][q]), 4).tolist() for q in (-2, -1)]
+                for name in ('count', 'compliant', 'score_sum')
+            }
+        }
+    return payload
@@ -0,0 +1,205 @@
+import concurrent.futures
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+
+from farm_data import RISK_LEVELS
+
+# Monte Carlo climate-risk scenarios over the farm portfolio.
+#
+# A scenario is a bad year for one or both hazards. In every trial each region
+# draws a severity (a national factor times a regional one, both mean 1, so bad
+# years hit several regions together), each farm is hit with a probability set by
+# its drought / flood risk level scaled by its region's severity, and a hit farm
+# loses a share of its milk that grows with the severity and shrinks with its
+# resilience (water efficiency against drought, soil health against floods).
+#
+# Farms are grouped by region x drought level x flood level and sorted so every
+# group is a contiguous block of columns. Within a group all farms share one hit
+# probability per trial, so a batch of trials is one (trials x farms) array of
+# uint16 random draws compared block by block against per-group thresholds, and
+# the exposed and lost litres are two small matrix products per group. Batches
+# are sized to bound memory, and each batch has its own seed, so the results do
+# not depend on how batches are spread over worker processes.
+
+CLIMATE_SCENARIOS = {
+    'drought': {'label': 'Severe drought year', 'drought': 1.0, 'flood': 0.0},
+    'flood': {'label': 'Severe flood year', 'drought': 0.0, 'flood': 1.0},
+    'compound': {'label': 'Drought and flood year', 'drought': 0.8, 'flood': 0.8},
+    'typical': {'label': 'Typical year', 'drought': 0.2, 'flood': 0.2}
+}
+DEFAULT_TRIALS = 2000
+# Random draws per batch (trials x farms); 2**23 keeps a batch around 24 MB
+DEFAULT_MAX_CELLS = 2 ** 23
+
+# Chance that a severe-year hazard hits a farm at each risk level
+HAZARD_PROBABILITY = {'Low': 0.05, 'Medium': 0.2, 'High': 0.45}
+# Share of a year's milk lost by a hit farm of average resilience in an average-severity year
+HAZARD_LOSS = {'drought': 0.2, 'flood': 0.12}
+# Gamma shapes of the national and regional severity factors (mean 1; lower = more volatile)
+NATIONAL_SHAPE = 6.0
+REGIONAL_SHAPE = 8.0
+MAX_SEVERITY = 3.0
+
+# Probabilities are compared as 16-bit fixed point
+PROBABILITY_SCALE = 65536
+
+
+def _resilience(df, hazard):
+    # Loss multiplier: 1 at the portfolio average, lower for better-managed farms
+    if hazard == 'drought':
+        values = df['water_efficiency'].to_numpy(dtype=np.float64) / 100
+    else:
+        values = df['soil_health'].to_numpy(dtype=np.float64) / 10
+    return np.clip(1.5 - values / max(values.mean(), 1e-9) * 0.5, 0.25, 1.5)
+
+
+# The farms of a selection, grouped for the simulation: per-group hit probability
+# and region, and per-farm milk and loss weights sorted by group
+def prepare_portfolio(df, scenario, positions=None):
+    if positions is not None:
+        df = df.iloc[positions]
+    params = CLIMATE_SCENARIOS[scenario]
+    regions = pd.Categorical(df['region'].astype(str))
+    # Risk levels outside RISK_LEVELS get the last slot, with no chance of a hit
+    level_probability = np.array([HAZARD_PROBABILITY[level] for level in RISK_LEVELS] + [0.0])
+    n_levels = len(level_probability)
+
+    def level_codes(column):
+        codes = pd.Categorical(df[column].astype(str), categories=RISK_LEVELS).codes
+        return np.where(codes < 0, n_levels - 1, codes)
+
+    groups = (regions.codes * n_levels + level_codes('drought_risk')) * n_levels + level_codes('flood_risk')
+    order = np.argsort(groups, kind='stable')
+    group_ids, starts = np.unique(groups[order], return_index=True)
+    bounds = np.append(starts, len(order))
+
+    # Per-hazard hit chances of each group, and the combined chance of either
+    p_drought = params['drought'] * level_probability[(group_ids // n_levels) % n_levels]
+    p_flood = params['flood'] * level_probability[group_ids % n_levels]
+    p_any = 1 - (1 - p_drought) * (1 - p_flood)
+
+    # A hit farm's loss mixes the hazards in proportion to their chances
+    milk = df['milk_volume'].to_numpy(dtype=np.float64)[order]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drought_share = np.nan_to_num(p_drought / (p_drought + p_flood))
+    farm_group = np.repeat(np.arange(len(group_ids)), np.diff(bounds))
+    loss_share = (drought_share[farm_group] * HAZARD_LOSS['drought'] * _resilience(df, 'drought')[order]
+                  + (1 - drought_share[farm_group]) * HAZARD_LOSS['flood'] * _resilience(df, 'flood')[order])
+
+    return {
+        'scenario': scenario,
+        'n_farms': len(order),
+        'regions': list(regions.categories),
+        'group_region': group_ids // n_levels ** 2,
+        'group_probability': p_any,
+        'bounds': bounds,
+        # columns: litres exposed, litres lost at severity 1
+        'weights': np.column_stack([milk, milk * loss_share]).astype(np.float32),
+        'total_milk': float(milk.sum())
+    }
+
+
+def _severity(rng, n_trials, n_regions):
+    national = rng.gamma(NATIONAL_SHAPE, 1 / NATIONAL_SHAPE, size=(n_trials, 1))
+    regional = rng.gamma(REGIONAL_SHAPE, 1 / REGIONAL_SHAPE, size=(n_trials, n_regions))
+    return np.minimum(national * regional, MAX_SEVERITY)
+
+
+# One batch of trials: per-trial, per-group farms hit, litres exposed and litres lost
+def simulate_batch(portfolio, n_trials, seed):
+    rng = np.random.Generator(np.random.PCG64(seed))
+    n_groups = len(portfolio['group_probability'])
+    severity = _severity(rng, n_trials, len(portfolio['regions']))
+    group_severity = severity[:, portfolio['group_region']]
+    thresholds = np.minimum(portfolio['group_probability'] * group_severity * PROBABILITY_SCALE,
+                            PROBABILITY_SCALE - 1).astype(np.uint16)
+
+    # Raw generator output reinterpreted as uniform 16-bit draws, 4 per 64-bit word
+    n_farms = portfolio['n_farms']
+    words = -(-n_trials * n_farms // 4)
+    draws = rng.bit_generator.random_raw(words).view(np.uint16)[:n_trials * n_farms].reshape(n_trials, n_farms)
+
+    farms = np.zeros((n_trials, n_groups))
+    exposed = np.zeros((n_trials, n_groups))
+    lost = np.zeros((n_trials, n_groups))
+    bounds = portfolio['bounds']
+    weights = portfolio['weights']
+    for g in range(n_groups):
+        hits = draws[:, bounds[g]:bounds[g + 1]] < thresholds[:, g:g + 1]
+        sums = hits.view(np.uint8) @ weights[bounds[g]:bounds[g + 1]]
+        farms[:, g] = np.count_nonzero(hits, axis=1)
+        exposed[:, g] = sums[:, 0]
+        lost[:, g] = sums[:, 1] * group_severity[:, g]
+    return farms, exposed, lost
+
+
+# Worker-side state: the prepared portfolio, set once per (forked) pool process
+_worker_state = {}
+
+
+def _init_worker(portfolio):
+    _worker_state['portfolio'] = portfolio
+
+
+def _simulate_in_worker(n_trials, seed):
+    return simulate_batch(_worker_state['portfolio'], n_trials, seed)
+
+
+# Run a scenario over the farms at `positions` (None = all). Trials are simulated in
+# batches of at most max_cells draws, across `workers` processes when more than one.
+# Returns per-trial totals and per-region per-trial sums.
+def run_scenario(df, scenario, n_trials=DEFAULT_TRIALS, seed=None, positions=None, workers=1,
+                 max_cells=DEFAULT_MAX_CELLS):
+    started = time.perf_counter()
+    portfolio = prepare_portfolio(df, scenario, positions)
+    batch = max(1, max_cells // max(portfolio['n_farms'], 1))
+    sizes = [min(batch, n_trials - start) for start in range(0, n_trials, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if workers > 1 and len(sizes) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(workers, len(sizes)), mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_worker, initargs=(portfolio,)) as pool:
+            batches = list(pool.map(_simulate_in_worker, sizes, seeds))
+    else:
+        batches = [simulate_batch(portfolio, size, s) for size, s in zip(sizes, seeds)]
+    farms, exposed, lost = (np.concatenate(parts) for parts in zip(*batches))
+
+    # Groups -> regions
+    to_region = np.zeros((len(portfolio['group_region']), len(portfolio['regions'])))
+    to_region[np.arange(len(portfolio['group_region'])), portfolio['group_region']] = 1
+    return {
+        'scenario': scenario,
+        'n_trials': n_trials,
+        'n_farms': portfolio['n_farms'],
+        'total_milk': portfolio['total_milk'],
+        'regions': portfolio['regions'],
+        'farms': farms.sum(axis=1),
+        'litres_exposed': exposed.sum(axis=1),
+        'litres_lost': lost.sum(axis=1),
+        'region_farms': farms @ to_region,
+        'region_lost': lost @ to_region,
+        'seconds': time.perf_counter() - started
+    }
+
+
+# Headline statistics of a scenario run: means and tail percentiles per trial
+def scenario_summary(result):
+    lost = result['litres_lost']
+    return {
+        'farms_mean': float(result['farms'].mean()),
+        'farms_p95': float(np.percentile(result['farms'], 95)),
+        'exposed_mean': float(result['litres_exposed'].mean()),
+        'lost_mean': float(lost.mean()),
+        'lost_p95': float(np.percentile(lost, 95)),
+        'lost_p99': float(np.percentile(lost, 99)),
+        'lost_share_mean': float(lost.mean() / result['total_milk']) if result['total_milk'] else 0.0,
+        'by_region': pd.DataFrame({
+            'farms_mean': result['region_farms'].mean(axis=0),
+            'lost_mean': result['region_lost'].mean(axis=0),
+            'lost_p95': np.percentile(result['region_lost'], 95, axis=0)
+        }, index=result['regions'])
+    }
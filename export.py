@@ -0,0 +1,91 @@
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # CSV export still works without pyarrow
+    pa = None
+    pq = None
+
+EXPORT_CHUNK_ROWS = 50000
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows')
+}
+
+
+def export_available(fmt):
+    return fmt == 'csv' or (fmt in EXPORT_FORMATS and pa is not None)
+
+
+def _chunks(df, positions, columns, chunk_rows):
+    if positions is None:
+        positions = np.arange(len(df))
+    # An empty selection still yields one (empty) chunk so the file has a schema
+    for start in range(0, max(len(positions), 1), chunk_rows):
+        # Plain object/number columns keep the output schema independent of how the
+        # store happens to encode them (categoricals, memory maps)
+        chunk = df.take(positions[start:start + chunk_rows])[columns]
+        yield chunk.astype({c: object for c in chunk.columns if chunk[c].dtype == 'category'})
+
+
+# Accumulates what a pyarrow writer emits so the generator can hand it on per chunk
+class _ChunkSink:
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _iter_csv(df, positions, columns, chunk_rows):
+    yield (','.join(columns) + '\n').encode('utf-8')
+    for chunk in _chunks(df, positions, columns, chunk_rows):
+        yield chunk.to_csv(header=False, index=False).encode('utf-8')
+
+
+def _iter_arrow(df, positions, columns, chunk_rows, parquet):
+    sink = _ChunkSink()
+    writer = None
+    for chunk in _chunks(df, positions, columns, chunk_rows):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            if parquet:
+                writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), table.schema)
+            else:
+                writer = pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+    yield sink.drain()
+
+
+# Stream the selected rows as CSV, Parquet or Arrow IPC, one chunk at a time, so
+# memory stays bounded by the chunk size rather than the number of rows exported.
+# df is a DataFrame or a farm_table.FarmTable.
+def iter_export(df, positions, columns, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    if fmt == 'csv':
+        return _iter_csv(df, positions, columns, chunk_rows)
+    return _iter_arrow(df, positions, columns, chunk_rows, parquet=(fmt == 'parquet'))
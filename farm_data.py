@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+# Value domains shared by the generator, the filters and the dropdowns
+REGIONS = ['South West', 'South East', 'East Midlands', 'West Midlands',
+           'North West', 'Yorkshire', 'North East', 'East Anglia']
+SUPPLIER_TIERS = ['Gold', 'Silver', 'Bronze']
+NVZ_STATUS = ['NVZ', 'Non-NVZ']
+RISK_LEVELS = ['Low', 'Medium', 'High']
+NAME_PREFIXES = ['Green', 'Hill', 'Valley', 'Brook', 'Meadow', 'Field', 'Oak', 'Manor']
+NAME_SUFFIXES = ['Farm', 'Dairy', 'Estate', 'Holdings']
+
+# Approximate extent of each region as (south, north, west, east) in degrees;
+# farms are placed uniformly inside their region's box
+REGION_BOUNDS = {
+    'South West': (50.2, 51.6, -5.5, -2.0),
+    'South East': (50.8, 51.8, -1.5, 1.3),
+    'East Midlands': (52.4, 53.5, -1.9, 0.2),
+    'West Midlands': (52.0, 53.0, -3.1, -1.5),
+    'North West': (53.3, 55.0, -3.3, -2.0),
+    'Yorkshire': (53.5, 54.5, -2.3, -0.2),
+    'North East': (54.5, 55.7, -2.5, -1.3),
+    'East Anglia': (52.0, 52.9, 0.2, 1.7)
+}
+
+DEFAULT_FARM_COUNT = 270
+# Bump when generate_farm_data changes what it draws, so stored portfolios are rebuilt
+GENERATOR_VERSION = 1
+
+
+# Generate comprehensive farm data matching React version.
+# Every column is filled with one batched draw so 1M farms build in about a second;
+# pass a seed to get the same portfolio on every call.
+def generate_farm_data(n_farms=DEFAULT_FARM_COUNT, seed=None):
+    rng = np.random.default_rng(seed)
+    n = int(n_farms)
+
+    def pick(values):
+        return np.asarray(values, dtype=object)[rng.integers(0, len(values), n)]
+
+    ids = pd.Series(np.arange(1, n + 1)).astype(str).str.zfill(3)
+    names = np.array([f"{p} {s}" for p in NAME_PREFIXES for s in NAME_SUFFIXES], dtype=object)
+
+    # Only 30 distinct dates are possible, so format them once and index
+    today = datetime.now()
+    dates = np.array([(today - timedelta(days=d)).strftime('%Y-%m-%d') for d in range(30)], dtype=object)
+
+    premium = rng.integers(0, 5000, n)
+    premium[rng.random(n) <= 0.3] = 0
+
+    df = pd.DataFrame({
+        'id': ('FARM_' + ids).to_numpy(dtype=object),
+        'name': names[rng.integers(0, len(names), n)],
+        'region': pick(REGIONS),
+        'size': rng.integers(50, 450, n),
+        'herd_size': rng.integers(80, 380, n),
+        'supplier_tier': pick(SUPPLIER_TIERS),
+        'nvz_status': pick(NVZ_STATUS),
+        'natural_habitat': rng.integers(5, 30, n),
+        'soil_health': np.round(3 + rng.random(n) * 3, 1),
+        'water_efficiency': rng.integers(70, 95, n),
+        'biodiversity_score': rng.integers(40, 90, n),
+        'nitrogen_efficiency': rng.integers(45, 85, n),
+        'phosphorus_efficiency': rng.integers(50, 85, n),
+        'drought_risk': pick(RISK_LEVELS),
+        'flood_risk': pick(RISK_LEVELS),
+        'tnfd_compliant': rng.random(n) > 0.15,
+        'sfi_enrolled': rng.random(n) > 0.4,
+        'cs_enrolled': rng.random(n) > 0.6,
+        'overall_score': rng.integers(50, 90, n),
+        'milk_volume': rng.integers(500000, 2500000, n),
+        'sustainabilit_premium': premium,
+        'last_updated': dates[rng.integers(0, 30, n)]
+    })
+    # Drawn last so the other columns stay the same for a given seed
+    df['latitude'], df['longitude'] = region_coordinates(df['region'].to_numpy(), rng)
+    return df
+
+
+# Random coordinates inside each farm's region. With keys (e.g. farm ids) each farm
+# is placed by a hash of its key instead, so it lands on the same spot every time.
+def region_coordinates(regions, rng=None, keys=None):
+    bounds = np.array([REGION_BOUNDS[r] for r in REGIONS])
+    codes = pd.Categorical(regions, categories=REGIONS).codes
+    if keys is None:
+        rng = rng or np.random.default_rng()
+        north_share, east_share = rng.random(len(codes)), rng.random(len(codes))
+    else:
+        hashes = pd.util.hash_array(np.asarray(keys, dtype=object))
+        north_share = (hashes >> np.uint64(32)) / 2 ** 32
+        east_share = (hashes & np.uint64(0xFFFFFFFF)) / 2 ** 32
+    south, north, west, east = bounds[codes].T
+    latitude = np.round(south + north_share * (north - south), 4)
+    longitude = np.round(west + east_share * (east - west), 4)
+    return latitude, longitude
@@ -0,0 +1,329 @@
+import fcntl
+import json
+import os
+import re
+import shutil
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cube import AggregateCube, CUBE_DIMENSIONS
+from farm_data import RISK_LEVELS
+from farm_schema import apply_farm_schema
+from farm_store import write_farm_store, open_farm_store, read_farm_store_meta, remove_farm_store
+
+# Monthly farm metric history.
+#
+# Every month holds one snapshot per farm (by farm id) of the attributes behind the
+# dashboard metrics, taken from the live farm table and written in the same
+# columnar .npy format as the farm store to its own partition directory
+# (month=YYYY-MM). The current month's partition is rewritten whenever a new farm
+# table is loaded, and a new one is started when the month rolls over, so each
+# partition holds the table as it last stood in that month. Months before the
+# first snapshot have no history, unless synthetic backfill is asked for.
+#
+# Two kinds of rollups are precomputed from the partitions for the current farm
+# table, so trends and quarter-over-quarter deltas never scan the raw snapshots:
+#   - segment rollups: an aggregate cube (region x tier x drought x flood) per month
+#     and per quarter (the mean of its months), answering any dropdown combination;
+#   - farm rollups: each farm's quarterly means of the card metrics, aligned to the
+#     row positions of the current table, answering any row selection (e.g. a
+#     search) with a few vectorized sums.
+
+HISTORY_META_FILE = 'meta.json'
+HISTORY_FORMAT = 2
+ROLLUP_DIR = 'rollups'
+DEFAULT_HISTORY_MONTHS = 12
+SNAPSHOT_COLUMNS = ('id',) + CUBE_DIMENSIONS + (
+    'size', 'natural_habitat', 'soil_health', 'water_efficiency', 'biodiversity_score',
+    'overall_score', 'milk_volume', 'tnfd_compliant', 'sfi_enrolled', 'cs_enrolled'
+)
+# Per-farm quarterly rollups; summed over farms they match the cube measures
+# count, compliant, score_sum and high_risk
+FARM_ROLLUPS = ('count', 'compliant', 'score_sum', 'high_risk')
+
+
+def month_labels(n_months, today=None):
+    end = pd.Period(today or date.today(), 'M')
+    return [str(month) for month in pd.period_range(end=end, periods=n_months, freq='M')]
+
+
+def quarter_label(month):
+    return str(pd.Period(month, 'M').asfreq('Q'))
+
+
+def _partition_path(path, month):
+    return os.path.join(path, f"month={month}")
+
+
+def _partition_months(path):
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+    return sorted(name[len('month='):] for name in names if re.fullmatch(r'month=\d{4}-\d{2}', name))
+
+
+def _partition_version(path, month):
+    try:
+        source = read_farm_store_meta(_partition_path(path, month)).get('source')
+    except (OSError, ValueError):
+        return None
+    # Partitions not taken from a farm table (e.g. an older synthetic history) are not history
+    return source.get('dataset_version') if isinstance(source, dict) else None
+
+
+def _high_risk(snapshot):
+    return ((snapshot['drought_risk'] == 'High') | (snapshot['flood_risk'] == 'High')).to_numpy()
+
+
+# The farm snapshot one month earlier: scores and efficiencies drift down a little,
+# a few farms lose compliance or scheme membership, and risk ratings are redrawn for
+# a few farms, leaning towards High
+def _step_back(snapshot, rng):
+    n = len(snapshot)
+    previous = snapshot.copy()
+
+    def drift(column, mean, sd, low, high, decimals=0):
+        values = snapshot[column].to_numpy(dtype=np.float64) - rng.normal(mean, sd, n)
+        return np.clip(np.round(values, decimals), low, high).astype(snapshot[column].dtype)
+
+    def redraw(column, probability, levels, weights=None):
+        series = snapshot[column]
+        codes = series.cat.codes.to_numpy().copy()
+        changed = rng.random(n) < probability
+        choices = series.cat.categories.get_indexer(levels)
+        codes[changed] = rng.choice(choices, size=int(changed.sum()), p=weights)
+        return pd.Categorical.from_codes(codes, dtype=series.dtype)
+
+    previous['overall_score'] = drift('overall_score', 0.5, 2.0, 0, 100)
+    previous['biodiversity_score'] = drift('biodiversity_score', 0.3, 1.5, 0, 100)
+    previous['water_efficiency'] = drift('water_efficiency', 0.2, 1.0, 0, 100)
+    previous['soil_health'] = drift('soil_health', 0.01, 0.05, 0, 10, decimals=1)
+    milk = snapshot['milk_volume'].to_numpy(dtype=np.float64) * (1 - rng.normal(0.002, 0.01, n))
+    previous['milk_volume'] = np.clip(np.round(milk), 0, None).astype(snapshot['milk_volume'].dtype)
+
+    compliant = snapshot['tnfd_compliant'].to_numpy()
+    previous['tnfd_compliant'] = (compliant & ~(rng.random(n) < 0.015)) | (~compliant & (rng.random(n) < 0.003))
+    for column in ('sfi_enrolled', 'cs_enrolled'):
+        previous[column] = snapshot[column].to_numpy() & ~(rng.random(n) < 0.01)
+
+    previous['drought_risk'] = redraw('drought_risk', 0.02, RISK_LEVELS, [0.25, 0.35, 0.4])
+    previous['flood_risk'] = redraw('flood_risk', 0.02, RISK_LEVELS, [0.25, 0.35, 0.4])
+    previous['supplier_tier'] = redraw('supplier_tier', 0.005, list(snapshot['supplier_tier'].cat.categories))
+    return previous
+
+
+# Synthetic snapshots for the given earlier months, walking back from a real
+# snapshot. Only used for an explicitly requested backfill.
+def backfill_snapshots(snapshot, months, seed=None):
+    rng = np.random.default_rng(seed)
+    snapshots = []
+    for month in reversed(months):
+        snapshot = _step_back(snapshot, rng)
+        snapshots.append((month, snapshot))
+    return snapshots[::-1]
+
+
+# Snapshot the farm table as this month's partition (replacing an earlier snapshot
+# of the same month) and drop partitions that fell out of the window
+def record_snapshot(path, df, n_months=DEFAULT_HISTORY_MONTHS, today=None):
+    months = month_labels(n_months, today)
+    version = df.attrs.get('dataset_version')
+    if _partition_version(path, months[-1]) != version:
+        snapshot = apply_farm_schema(df[list(SNAPSHOT_COLUMNS)].copy())
+        write_farm_store(snapshot, _partition_path(path, months[-1]), {'dataset_version': version})
+    for month in _partition_months(path):
+        if month < months[0] or _partition_version(path, month) is None:
+            remove_farm_store(_partition_path(path, month))
+
+
+def _dimensions(snapshots):
+    dimensions = {}
+    for d in CUBE_DIMENSIONS:
+        values = set()
+        for _, snapshot in snapshots:
+            values.update(str(c) for c in snapshot[d].cat.categories)
+        order = RISK_LEVELS if d in ('drought_risk', 'flood_risk') else []
+        dimensions[d] = [v for v in order if v in values] + sorted(values - set(order))
+    return dimensions
+
+
+# Precompute the rollups of the recorded partitions for the farm table df
+def write_history_rollups(path, df, n_months=DEFAULT_HISTORY_MONTHS, backfill=False, seed=None,
+                          today=None):
+    window = month_labels(n_months, today)
+    recorded = [month for month in _partition_months(path) if month in window]
+    snapshots = [(month, open_farm_store(_partition_path(path, month))) for month in recorded]
+    synthetic = []
+    if backfill and snapshots:
+        synthetic = window[:window.index(recorded[0])]
+        snapshots = backfill_snapshots(snapshots[0][1], synthetic, seed) + snapshots
+
+    dimensions = _dimensions(snapshots)
+    months = [month for month, _ in snapshots]
+    quarters = list(dict.fromkeys(quarter_label(month) for month in months))
+    farm_ids = pd.Index(df['id'])
+
+    tmp_path = os.path.join(path, f"{ROLLUP_DIR}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    monthly = {}
+    farm_sums = {name: np.zeros((len(quarters), len(df)), dtype=np.float64) for name in FARM_ROLLUPS}
+    for month, snapshot in snapshots:
+        cube = AggregateCube(snapshot, dimensions)
+        for name, measure in cube.measures.items():
+            monthly.setdefault(name, []).append(measure)
+
+        # Farms of the snapshot that are still in the table, at their current positions
+        positions = farm_ids.get_indexer(snapshot['id'])
+        found = positions >= 0
+        positions = positions[found]
+        q = quarters.index(quarter_label(month))
+        farm_sums['count'][q][positions] += 1
+        farm_sums['compliant'][q][positions] += snapshot['tnfd_compliant'].to_numpy()[found]
+        farm_sums['score_sum'][q][positions] += snapshot['overall_score'].to_numpy()[found]
+        farm_sums['high_risk'][q][positions] += _high_risk(snapshot)[found]
+
+    # A quarter's rollup is the mean of its months
+    months_per_quarter = np.array([sum(quarter_label(m) == q for m in months) for q in quarters])
+    quarter_index = np.array([quarters.index(quarter_label(m)) for m in months])
+    for name, measures in monthly.items():
+        stacked = np.stack(measures)
+        quarterly = np.stack([stacked[quarter_index == q].mean(axis=0) for q in range(len(quarters))])
+        np.save(os.path.join(tmp_path, f"month-{name}.npy"), stacked)
+        np.save(os.path.join(tmp_path, f"quarter-{name}.npy"), quarterly)
+    for name, sums in farm_sums.items():
+        means = (sums / months_per_quarter[:, None]).astype(np.float32)
+        np.save(os.path.join(tmp_path, f"farm-quarter-{name}.npy"), means)
+
+    meta = {
+        'format': HISTORY_FORMAT,
+        'dataset_version': df.attrs.get('dataset_version'),
+        'n_farms': len(df),
+        'partitions': {month: _partition_version(path, month) for month in recorded},
+        'backfill': backfill,
+        'synthetic_months': synthetic,
+        'months': months,
+        'quarters': quarters,
+        'dimensions': dimensions
+    }
+    with open(os.path.join(tmp_path, HISTORY_META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(os.path.join(path, ROLLUP_DIR), ignore_errors=True)
+    os.replace(tmp_path, os.path.join(path, ROLLUP_DIR))
+    return meta
+
+
+def _card_metrics(totals):
+    if totals['count'] <= 0:
+        return None
+    return {
+        'compliance_pct': totals['compliant'] / totals['count'] * 100,
+        'avg_score': totals['score_sum'] / totals['count'],
+        'high_risk_pct': totals['high_risk'] / totals['count'] * 100
+    }
+
+
+# Read side of a history directory. Rollups are memory-mapped; partitions are
+# opened on demand.
+class FarmHistory:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, ROLLUP_DIR, HISTORY_META_FILE)) as f:
+            self.meta = json.load(f)
+        self.months = self.meta['months']
+        self.quarters = self.meta['quarters']
+        self.dimensions = self.meta['dimensions']
+        self.n_farms = self.meta['n_farms']
+
+        def load(name):
+            return np.load(os.path.join(path, ROLLUP_DIR, f"{name}.npy"), mmap_mode='r')
+        measures = [f[len('month-'):-len('.npy')] for f in os.listdir(os.path.join(path, ROLLUP_DIR))
+                    if f.startswith('month-')]
+        self.rollups = {freq: {name: load(f"{freq}-{name}") for name in measures}
+                        for freq in ('month', 'quarter')}
+        self.farm_rollups = {name: load(f"farm-quarter-{name}") for name in FARM_ROLLUPS}
+
+    def periods(self, freq='quarter'):
+        return self.months if freq == 'month' else self.quarters
+
+    def partition(self, month):
+        return open_farm_store(_partition_path(self.path, month))
+
+    # Whether the two latest quarters with history are consecutive, i.e. there is a
+    # real previous quarter to compare the current one with
+    def has_quarter_change(self):
+        if len(self.quarters) < 2:
+            return False
+        return pd.Period(self.quarters[-2], 'Q') + 1 == pd.Period(self.quarters[-1], 'Q')
+
+    def cube(self, freq, i):
+        return AggregateCube.from_measures(
+            self.dimensions, {name: np.asarray(rollup[i]) for name, rollup in self.rollups[freq].items()})
+
+    # Card metrics per period for a dropdown combination, from the segment rollups
+    def trend(self, freq='quarter', region='all', tier='all', risk='all'):
+        rows = []
+        for i, period in enumerate(self.periods(freq)):
+            totals = self.cube(freq, i).totals(region, tier, risk)
+            rows.append(dict(period=period, farms=totals['count'], **(_card_metrics(totals) or {})))
+        return pd.DataFrame(rows).set_index('period')
+
+    # Totals of the farm rollups of one quarter over a row selection
+    def selection_totals(self, quarter, positions):
+        positions = np.asarray(positions)
+        positions = positions[positions < self.n_farms]
+        return {name: float(rollup[quarter][positions].sum(dtype=np.float64))
+                for name, rollup in self.farm_rollups.items()}
+
+    # Change of the card metrics from the previous quarter to the current one, for a
+    # dropdown combination or (with positions) a row selection. None without two
+    # consecutive quarters of history or when the selection is empty in either quarter.
+    def quarter_change(self, region='all', tier='all', risk='all', positions=None):
+        if not self.has_quarter_change():
+            return None
+        if positions is None:
+            previous = _card_metrics(self.cube('quarter', -2).totals(region, tier, risk))
+            current = _card_metrics(self.cube('quarter', -1).totals(region, tier, risk))
+        else:
+            previous = _card_metrics(self.selection_totals(-2, positions))
+            current = _card_metrics(self.selection_totals(-1, positions))
+        if previous is None or current is None:
+            return None
+        return {name: current[name] - previous[name] for name in current}
+
+
+def _rollups_are_current(path, df, n_months, backfill):
+    try:
+        with open(os.path.join(path, ROLLUP_DIR, HISTORY_META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    window = month_labels(n_months)
+    partitions = {month: _partition_version(path, month) for month in _partition_months(path) if month in window}
+    return (meta.get('format') == HISTORY_FORMAT
+            and meta.get('dataset_version') == df.attrs.get('dataset_version')
+            and meta.get('n_farms') == len(df)
+            and meta.get('partitions') == partitions
+            and meta.get('backfill') == backfill)
+
+
+# Snapshot a farm table into the history and attach to it, under a lock so only
+# one worker writes. Called whenever a new table is loaded and when the month
+# changes; the rollups are rebuilt when the table or the recorded months change.
+# With backfill, months before the first snapshot are filled with synthetic
+# snapshots drawn from seed.
+def load_or_build_history(path, df, n_months=DEFAULT_HISTORY_MONTHS, backfill=False, seed=None):
+    os.makedirs(path, exist_ok=True)
+    with open(f"{path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            record_snapshot(path, df, n_months)
+            if not _rollups_are_current(path, df, n_months, backfill):
+                write_history_rollups(path, df, n_months, backfill, seed)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return FarmHistory(path)
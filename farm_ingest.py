@@ -0,0 +1,511 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from farm_data import region_coordinates
+from farm_schema import FARM_SCHEMA, apply_farm_schema
+from farm_store import open_farm_store, read_farm_store_meta, write_farm_store
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # CSV drops still load without pyarrow
+    pq = None
+
+# Supplier data drops (CSV / Parquet) loaded into the farm table.
+#
+# Every file in the drop directory is one partition. Files are read in chunks and
+# each chunk is validated column by column with vectorized checks - enum
+# membership, numeric parsing and ranges, whole numbers, booleans and dates - so a
+# bad value costs a mask, not a Python loop; farm ids must then be unique among the
+# rows that passed. Rows failing any check are left out and listed in a reject
+# report (file, row, column, value, reason); the rest are cast to the compact farm
+# schema.
+#
+# The ingestor remembers each file's mtime, size and content hash. A rescan only
+# hashes files whose mtime or size changed and only re-reads files whose content
+# changed, so a new drop reloads just its own partitions. With a cache directory
+# each validated partition is also written there once per content hash, in the
+# farm store format, so a file is parsed once however many workers load it, and
+# changes() can compare a drop with an earlier state of it row by row.
+
+INGEST_CHUNK_ROWS = 100000
+PARTITION_FILE = 'partition.json'
+DROP_TABLE = 'table'
+# Drop changes up to this many farms are applied to the live table as writes;
+# larger ones, and any that remove farms, rebuild the table
+MAX_DELTA_ROWS = 1000
+INGEST_EXTENSIONS = ('.csv', '.parquet')
+MAX_REPORTED_REJECTS = 1000
+
+# Columns a drop may leave out: coordinates are placed inside the farm's region and
+# the update date defaults to the file's modification date
+OPTIONAL_COLUMNS = ('latitude', 'longitude', 'last_updated')
+REQUIRED_COLUMNS = tuple(c for c in FARM_SCHEMA if c not in OPTIONAL_COLUMNS)
+
+# Allowed ranges of the numeric columns (inclusive)
+VALUE_RANGES = {
+    'size': (1, 10000),
+    'herd_size': (0, 10000),
+    'natural_habitat': (0, 100),
+    'soil_health': (0, 10),
+    'water_efficiency': (0, 100),
+    'biodiversity_score': (0, 100),
+    'nitrogen_efficiency': (0, 100),
+    'phosphorus_efficiency': (0, 100),
+    'overall_score': (0, 100),
+    'milk_volume': (0, 2 ** 31 - 1),
+    'sustainabilit_premium': (0, 2 ** 31 - 1),
+    'latitude': (49.8, 60.9),
+    'longitude': (-8.7, 1.8)
+}
+BOOLEAN_VALUES = {'true': True, 'false': False, 't': True, 'f': False, 'yes': True, 'no': False,
+                  'y': True, 'n': False, '1': True, '0': False, '1.0': True, '0.0': False}
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_chunks(path, chunk_rows=INGEST_CHUNK_ROWS):
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise ValueError("reading Parquet files needs pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False,
+                               skipinitialspace=True)
+
+
+def _text(series):
+    return series.astype(str).str.strip()
+
+
+# _text for low-cardinality columns: each distinct value is stripped once
+def _labels(series):
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return pd.Series(_text(pd.Series(uniques)).to_numpy()[codes], index=series.index)
+
+
+# Parsed values and per-reason masks of bad rows for one column of a chunk
+def _check_column(column, series):
+    dtype = FARM_SCHEMA[column]
+    problems = []
+    if isinstance(dtype, pd.CategoricalDtype):
+        values = _labels(series)
+        problems.append((~values.isin(dtype.categories),
+                         f"must be one of {', '.join(map(str, dtype.categories))}"))
+    elif dtype in ('object', 'category'):
+        values = _text(series)
+        problems.append(((values == '') | series.isna().to_numpy(), "must not be empty"))
+    elif dtype == 'bool':
+        values = _labels(series).str.lower().map(BOOLEAN_VALUES)
+        problems.append((values.isna(), "must be true or false"))
+    elif dtype.startswith('datetime64'):
+        codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        dates = pd.to_datetime(_text(pd.Series(uniques)), errors='coerce', format='mixed')
+        values = pd.Series(dates.to_numpy()[codes], index=series.index)
+        problems.append((values.isna(), "must be a date"))
+    else:
+        values = pd.to_numeric(series, errors='coerce')
+        missing = values.isna()
+        problems.append((missing, "must be a number"))
+        low, high = VALUE_RANGES[column]
+        problems.append((~missing & ((values < low) | (values > high)), f"must be between {low} and {high}"))
+        if np.dtype(dtype).kind in 'iu':
+            problems.append((~missing & (values != values.round()), "must be a whole number"))
+    return values, problems
+
+
+# Validate one chunk: the valid rows (raw parsed values, indexed by their row number
+# in the file) and the rejects. Farm ids are only checked for uniqueness across the
+# whole file, over the rows that pass here (see ingest_file).
+def validate_chunk(chunk, source, offset):
+    chunk = chunk.reset_index(drop=True)
+    bad = np.zeros(len(chunk), dtype=bool)
+    parsed = {}
+    rejects = []
+    for column in FARM_SCHEMA:
+        if column not in chunk.columns:
+            continue
+        values, problems = _check_column(column, chunk[column])
+        for mask, reason in problems:
+            rows = np.flatnonzero(np.asarray(mask))
+            if len(rows):
+                bad[rows] = True
+                rejects.append(pd.DataFrame({
+                    'file': source,
+                    'row': rows + offset + 1,
+                    'column': column,
+                    'value': chunk[column].iloc[rows].astype(str).to_numpy(),
+                    'reason': reason
+                }))
+        parsed[column] = values
+
+    valid = pd.DataFrame({column: values[~bad] for column, values in parsed.items()})
+    valid.index = np.flatnonzero(~bad) + offset + 1
+    rejects = pd.concat(rejects, ignore_index=True) if rejects else None
+    return valid, rejects
+
+
+# Read, validate and schema-cast one drop file. Returns the valid farms, indexed by
+# row number in the file, and the rejects (None when there are none).
+#
+# A farm id is claimed by the first row that passes every other check: later valid
+# rows with the same id are rejected as duplicates, while a row rejected for
+# another column (or for a blank id) claims nothing.
+def ingest_file(path, chunk_rows=INGEST_CHUNK_ROWS):
+    source = os.path.basename(path)
+    frames = []
+    rejects = []
+    offset = 0
+    for chunk in read_chunks(path, chunk_rows):
+        missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+        if missing:
+            raise ValueError(f"{source} is missing columns: {', '.join(missing)}")
+        valid, chunk_rejects = validate_chunk(chunk, source, offset)
+        frames.append(valid)
+        if chunk_rejects is not None:
+            rejects.append(chunk_rejects)
+        offset += len(chunk)
+
+    farms = pd.concat(frames) if frames else pd.DataFrame(columns=list(REQUIRED_COLUMNS))
+    duplicated = farms['id'].duplicated().to_numpy()
+    if duplicated.any():
+        rejects.append(pd.DataFrame({
+            'file': source,
+            'row': farms.index[duplicated],
+            'column': 'id',
+            'value': farms['id'].to_numpy()[duplicated],
+            'reason': "duplicate farm id"
+        }))
+        farms = farms[~duplicated]
+    if 'latitude' not in farms.columns or 'longitude' not in farms.columns:
+        farms['latitude'], farms['longitude'] = region_coordinates(farms['region'].to_numpy(),
+                                                                    keys=farms['id'].to_numpy())
+    if 'last_updated' not in farms.columns:
+        farms['last_updated'] = pd.Timestamp(datetime.fromtimestamp(os.path.getmtime(path)).date())
+    farms = apply_farm_schema(farms[list(FARM_SCHEMA)])
+    if not rejects:
+        return farms, None
+    return farms, pd.concat(rejects, ignore_index=True).sort_values('row', kind='stable', ignore_index=True)
+
+
+def _ingest(path, chunk_rows):
+    try:
+        farms, rejects = ingest_file(path, chunk_rows)
+        return farms, rejects, None
+    except (ValueError, OSError) as e:
+        return None, None, str(e)
+
+
+def _partition_path(cache_dir, name, digest):
+    return os.path.join(cache_dir, 'partitions', hashlib.sha256(f"{name}:{digest}".encode()).hexdigest()[:32])
+
+
+# A cached partition (None when it is not cached): the farms map the cached store,
+# indexed by their row number in the file as ingest_file returns them
+def read_partition(cache_dir, name, digest):
+    path = _partition_path(cache_dir, name, digest)
+    try:
+        with open(os.path.join(path, PARTITION_FILE)) as f:
+            partition = json.load(f)
+    except (OSError, ValueError):
+        return None
+    farms = rejects = None
+    if partition['error'] is None:
+        stored = open_farm_store(os.path.join(path, 'farms'))
+        farms = pd.DataFrame({column: stored[column] for column in FARM_SCHEMA}, copy=False)
+        farms.index = stored['source_row'].to_numpy()
+    if partition['rejects']:
+        rejects = pd.read_csv(os.path.join(path, 'rejects.csv'), dtype={'value': str}, keep_default_na=False)
+    return {'hash': digest, 'farms': farms, 'rejects': rejects, 'error': partition['error'],
+            'loaded_at': partition['loaded_at']}
+
+
+# Validate a drop file once per content. The first process to take the lock parses
+# the file and writes the partition to the cache; every later load, in any worker,
+# maps it instead.
+def load_or_ingest_partition(cache_dir, path, digest, chunk_rows=INGEST_CHUNK_ROWS):
+    name = os.path.basename(path)
+    partition_path = _partition_path(cache_dir, name, digest)
+    os.makedirs(partition_path, exist_ok=True)
+    with open(f"{partition_path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            partition = read_partition(cache_dir, name, digest)
+            if partition is None:
+                farms, rejects, error = _ingest(path, chunk_rows)
+                if farms is not None:
+                    write_farm_store(farms.reset_index(names='source_row'), os.path.join(partition_path, 'farms'))
+                if rejects is not None:
+                    rejects.to_csv(os.path.join(partition_path, 'rejects.csv'), index=False)
+                written = os.path.join(partition_path, f"{PARTITION_FILE}.tmp")
+                with open(written, 'w') as f:
+                    json.dump({'name': name, 'error': error, 'rejects': rejects is not None,
+                               'loaded_at': datetime.now().isoformat(timespec='seconds')}, f)
+                os.replace(written, os.path.join(partition_path, PARTITION_FILE))
+                partition = read_partition(cache_dir, name, digest)
+            return partition
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# Remove the cached partitions of file contents no longer in the drop
+def prune_partitions(cache_dir, files):
+    keep = {os.path.basename(_partition_path(cache_dir, name, digest)) for name, digest in files.items()}
+    directory = os.path.join(cache_dir, 'partitions')
+    for entry in os.listdir(directory) if os.path.isdir(directory) else []:
+        if entry.split('.')[0] not in keep:
+            path = os.path.join(directory, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+
+# Farms whose id already appeared in an earlier file (in file name order): per
+# file, a mask of the farms to keep and the rejects for the rest
+def _cross_file_duplicates(partitions):
+    loaded = [(name, p) for name, p in sorted(partitions.items()) if p['farms'] is not None]
+    ids = np.concatenate([p['farms']['id'].astype(str).to_numpy().astype(object) for _, p in loaded]
+                         + [np.array([], dtype=object)])
+    files = np.repeat([name for name, _ in loaded], [len(p['farms']) for _, p in loaded])
+    duplicated = pd.Series(ids, dtype=object).duplicated().to_numpy()
+    first_file = np.empty(len(ids), dtype=object)
+    first_file[duplicated] = files[~duplicated][pd.Index(ids[~duplicated]).get_indexer(ids[duplicated])]
+
+    duplicates = {}
+    start = 0
+    for name, p in loaded:
+        end = start + len(p['farms'])
+        repeated = duplicated[start:end]
+        rejects = None
+        if repeated.any():
+            firsts = first_file[start:end][repeated]
+            rejects = pd.DataFrame({
+                'file': name,
+                'row': p['farms'].index[repeated],
+                'column': 'id',
+                'value': ids[start:end][repeated],
+                'reason': [f"duplicate farm id (first seen in {first})" for first in firsts]
+            })
+        duplicates[name] = (~repeated, rejects)
+        start = end
+    return duplicates
+
+
+# The kept farms of the named files, in file name order (None when there are none)
+def _kept_farms(partitions, duplicates, names):
+    frames = [partitions[name]['farms'][duplicates[name][0]] for name in sorted(names)
+              if name in partitions and partitions[name]['farms'] is not None]
+    return pd.concat(frames) if frames else None
+
+
+# Watches a drop directory and keeps one validated partition per file (cached in
+# cache_dir when one is given)
+class FarmFileIngestor:
+    def __init__(self, directory, chunk_rows=INGEST_CHUNK_ROWS, cache_dir=None):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.cache_dir = cache_dir
+        self.partitions = {}
+        self._duplicates = None
+
+    def _files(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.endswith(INGEST_EXTENSIONS) and not name.startswith('.'))
+
+    # Pick up added, changed and removed files; True when the farm table changed
+    def scan(self):
+        changed = False
+        names = self._files()
+        for name in set(self.partitions) - set(names):
+            del self.partitions[name]
+            changed = True
+
+        for name in names:
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            partition = self.partitions.get(name)
+            if partition and (partition['mtime'], partition['size']) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            digest = file_digest(path)
+            if partition and partition['hash'] == digest:
+                partition.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+                continue
+            if self.cache_dir is not None:
+                partition = load_or_ingest_partition(self.cache_dir, path, digest, self.chunk_rows)
+            else:
+                farms, rejects, error = _ingest(path, self.chunk_rows)
+                partition = {'hash': digest, 'farms': farms, 'rejects': rejects, 'error': error,
+                             'loaded_at': datetime.now().isoformat(timespec='seconds')}
+            self.partitions[name] = dict(partition, mtime=stat.st_mtime_ns, size=stat.st_size)
+            changed = True
+        if changed:
+            self._duplicates = None
+        return changed
+
+    # The loaded content as {file name: content hash}
+    def files(self):
+        return {name: p['hash'] for name, p in sorted(self.partitions.items())}
+
+    # Identifies the loaded content: the same files give the same version in every worker
+    def version(self):
+        digest = hashlib.sha256()
+        for name, file_hash in self.files().items():
+            digest.update(f"{name}:{file_hash};".encode())
+        return digest.hexdigest()[:32]
+
+    def _cross_file_duplicates(self):
+        if self._duplicates is None:
+            self._duplicates = _cross_file_duplicates(self.partitions)
+        return self._duplicates
+
+    # The farm table of all valid partitions, in file name order. A farm id that
+    # appears in more than one file is kept from the first file only; the later
+    # ones are rejected.
+    def table(self):
+        df = _kept_farms(self.partitions, self._cross_file_duplicates(), self.partitions)
+        if df is None:
+            return None
+        df = apply_farm_schema(df.reset_index(drop=True))
+        df.attrs['dataset_version'] = self.version()
+        return df
+
+    # How the table differs from the one of an earlier state of the drop (files()
+    # of that state): the farms that are new or changed, as ingested (indexed by
+    # row number), and the ids of the farms no longer in it. Only files whose
+    # content or kept rows differ are compared. The update date is left out of the
+    # comparison, as a file without the column dates every farm in it with the
+    # file's own date. None when a partition of the earlier state is not cached.
+    def changes(self, files):
+        previous = {}
+        for name, file_hash in files.items():
+            partition = self.partitions.get(name)
+            if partition is None or partition['hash'] != file_hash:
+                partition = read_partition(self.cache_dir, name, file_hash) if self.cache_dir else None
+                if partition is None:
+                    return None
+            previous[name] = partition
+        old_duplicates = _cross_file_duplicates(previous)
+        new_duplicates = self._cross_file_duplicates()
+        touched = [name for name in set(previous) | set(self.partitions)
+                   if previous.get(name) is not self.partitions.get(name)
+                   or not np.array_equal(old_duplicates.get(name, (None,))[0],
+                                         new_duplicates.get(name, (None,))[0])]
+        old = _kept_farms(previous, old_duplicates, touched)
+        new = _kept_farms(self.partitions, new_duplicates, touched)
+        if new is None:
+            new = pd.DataFrame({column: pd.Series(dtype=object) for column in FARM_SCHEMA})
+        if old is None:
+            return new, []
+
+        old_ids = pd.Index(old['id'].astype(str))
+        new_ids = new['id'].astype(str).to_numpy()
+        match = old_ids.get_indexer(new_ids)
+        changed = match < 0
+        for column in FARM_SCHEMA:
+            if column != 'last_updated':
+                old_values = old[column].to_numpy()[match[~changed]]
+                changed[~changed] = new[column].to_numpy()[~changed] != old_values
+        return new[changed], old_ids.difference(pd.Index(new_ids)).tolist()
+
+    def _rejects(self, name):
+        frames = [self.partitions[name]['rejects'], self._cross_file_duplicates().get(name, (None, None))[1]]
+        frames = [frame for frame in frames if frame is not None]
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+    def rejects(self):
+        frames = [self._rejects(name) for name in sorted(self.partitions)]
+        frames = [frame for frame in frames if frame is not None]
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+    def status(self):
+        files = []
+        duplicates = self._cross_file_duplicates()
+        for name, p in sorted(self.partitions.items()):
+            rejects = self._rejects(name)
+            files.append({
+                'file': name,
+                'hash': p['hash'][:12],
+                'loaded_at': p['loaded_at'],
+                'farms': 0 if p['farms'] is None else int(duplicates[name][0].sum()),
+                'rejected_rows': 0 if rejects is None else int(rejects['row'].nunique()),
+                'error': p['error']
+            })
+        rejects = self.rejects()
+        return {
+            'directory': self.directory,
+            'version': self.version(),
+            'files': files,
+            'rejects': [] if rejects is None else rejects.head(MAX_REPORTED_REJECTS).to_dict('records')
+        }
+
+
+# Held while a drop change is worked out and journalled, so the workers of a
+# deployment apply each change once
+@contextmanager
+def drop_lock(cache_dir):
+    with open(os.path.join(cache_dir, 'drops.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# The farm table of a drop, written to the cache as a farm store (each build in
+# its own directory, see farm_store.py) so every worker maps the same files. The
+# drop's files() are kept with it. Returns the build's version, or None when the
+# drop holds no valid farms.
+def write_drop_table(cache_dir, ingestor):
+    df = ingestor.table()
+    if df is None:
+        return None
+    return write_farm_store(df, os.path.join(cache_dir, DROP_TABLE), {'files': ingestor.files()})['version']
+
+
+# Open a build of the drop table (the current one without a version); None when
+# there is none
+def open_drop_table(cache_dir, version=None):
+    path = os.path.join(cache_dir, DROP_TABLE)
+    if version is not None:
+        path = f"{path}.build-{version}"
+    try:
+        meta = read_farm_store_meta(path)
+    except (OSError, ValueError):
+        return None
+    df = open_farm_store(path)
+    df.attrs['drop_files'] = meta['source']['files']
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validate supplier farm drops (CSV / Parquet) and report rejects")
+    parser.add_argument('directory')
+    parser.add_argument('--rejects', help="write every rejected value to this CSV file")
+    args = parser.parse_args()
+
+    ingestor = FarmFileIngestor(args.directory)
+    ingestor.scan()
+    for entry in ingestor.status()['files']:
+        problem = f"  ERROR: {entry['error']}" if entry['error'] else ''
+        print(f"{entry['file']:<40} {entry['farms']:>10,} farms {entry['rejected_rows']:>8,} rejected rows{problem}")
+    rejects = ingestor.rejects()
+    if rejects is not None:
+        print(rejects.groupby(['column', 'reason']).size().rename('rejects').to_string())
+        if args.rejects:
+            rejects.to_csv(args.rejects, index=False)
@@ -0,0 +1,113 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from farm_data import REGIONS, SUPPLIER_TIERS, NVZ_STATUS, RISK_LEVELS, generate_farm_data
+
+# Compact in-memory schema of the farm table.
+#
+# Low-cardinality strings are categoricals (one byte per farm plus a small
+# dictionary), scores and percentages fit in uint8, sizes in int16, volumes and
+# premiums in int32, soil health and coordinates in float32 and the update date is
+# a real datetime64. 'category' means a categorical whose values come from the data.
+FARM_SCHEMA = {
+    'id': 'object',
+    'name': 'category',
+    'region': pd.CategoricalDtype(REGIONS),
+    'size': 'int16',
+    'herd_size': 'int16',
+    'supplier_tier': pd.CategoricalDtype(SUPPLIER_TIERS),
+    'nvz_status': pd.CategoricalDtype(NVZ_STATUS),
+    'natural_habitat': 'uint8',
+    'soil_health': 'float32',
+    'water_efficiency': 'uint8',
+    'biodiversity_score': 'uint8',
+    'nitrogen_efficiency': 'uint8',
+    'phosphorus_efficiency': 'uint8',
+    'drought_risk': pd.CategoricalDtype(RISK_LEVELS),
+    'flood_risk': pd.CategoricalDtype(RISK_LEVELS),
+    'tnfd_compliant': 'bool',
+    'sfi_enrolled': 'bool',
+    'cs_enrolled': 'bool',
+    'overall_score': 'uint8',
+    'milk_volume': 'int32',
+    'sustainabilit_premium': 'int32',
+    'last_updated': 'datetime64[ns]',
+    'latitude': 'float32',
+    'longitude': 'float32'
+}
+
+
+# Cast one column to its schema dtype. Integers that do not fit the narrower type
+# raise ValueError instead of silently wrapping.
+def cast_column(series, dtype):
+    name = series.name
+    if isinstance(dtype, pd.CategoricalDtype):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            current = series.cat.categories
+            if set(dtype.categories) <= set(current):
+                return series
+            return series.cat.add_categories([c for c in dtype.categories if c not in set(current)])
+        extra = sorted(set(pd.unique(series.dropna().astype(str))) - set(dtype.categories))
+        return series.astype(pd.CategoricalDtype(list(dtype.categories) + extra))
+    if dtype == 'category':
+        return series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype('category')
+    if dtype == 'object':
+        return series.astype(object, copy=False)
+    if dtype.startswith('datetime64'):
+        return series if series.dtype == dtype else pd.to_datetime(series).astype(dtype)
+
+    numpy_dtype = np.dtype(dtype)
+    if series.dtype == numpy_dtype:
+        return series
+    if numpy_dtype.kind in 'iu' and len(series):
+        info = np.iinfo(numpy_dtype)
+        values = pd.to_numeric(series)
+        if values.isna().any() or values.min() < info.min or values.max() > info.max:
+            raise ValueError(f"{name} must be a whole number between {info.min} and {info.max}")
+        if not np.array_equal(values, np.round(values)):
+            raise ValueError(f"{name} must be a whole number")
+    if numpy_dtype == bool and not series.isin([0, 1]).all():
+        raise ValueError(f"{name} must be true or false")
+    return series.astype(numpy_dtype, copy=False)
+
+
+# Enforce FARM_SCHEMA on a farm table. Columns already in their schema dtype are
+# passed through untouched, so memory-mapped stores written with the schema stay
+# zero-copy; columns outside the schema are left as they are.
+def apply_farm_schema(df):
+    data = {
+        column: cast_column(df[column], FARM_SCHEMA[column]) if column in FARM_SCHEMA else df[column]
+        for column in df.columns
+    }
+    result = pd.DataFrame(data, copy=False)
+    result.attrs.update(df.attrs)
+    return result
+
+
+# Bytes per column of two versions of the same table, e.g. before and after
+# apply_farm_schema()
+def memory_report(before, after):
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'bytes_before': before.memory_usage(index=False, deep=True),
+        'dtype_after': after.dtypes.astype(str),
+        'bytes_after': after.memory_usage(index=False, deep=True)
+    })
+    report.loc['TOTAL'] = ['', report['bytes_before'].sum(), '', report['bytes_after'].sum()]
+    report['saving_pct'] = (1 - report['bytes_after'] / report['bytes_before']) * 100
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Per-column memory of the farm table before and after the compact schema")
+    parser.add_argument('--farms', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    raw = generate_farm_data(n_farms=args.farms, seed=args.seed)
+    report = memory_report(raw, apply_farm_schema(raw))
+    with pd.option_context('display.width', 120, 'display.float_format', '{:,.1f}'.format):
+        print(f"Memory per column for {args.farms:,} farms (bytes)")
+        print(report.to_string(formatters={'bytes_before': '{:,}'.format, 'bytes_after': '{:,}'.format}))
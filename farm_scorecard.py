@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from binning import SCATTER_AXES
+
+# Per-farm detail scorecard for the Farms page.
+#
+# A farm's environmental metrics are placed against the whole portfolio (percentile
+# rank) and against the other farms of its region (regional mean), with its
+# quarter-over-quarter change from the metric history. Each of these is a pass
+# over a full column, so scorecards are cached per farm by the caller.
+
+SCORECARD_METRICS = ('overall_score', 'biodiversity_score', 'water_efficiency', 'nitrogen_efficiency',
+                     'phosphorus_efficiency', 'natural_habitat', 'soil_health')
+PROFILE_FIELDS = ('id', 'name', 'region', 'supplier_tier', 'nvz_status', 'size', 'herd_size', 'milk_volume',
+                  'drought_risk', 'flood_risk', 'tnfd_compliant', 'sfi_enrolled', 'cs_enrolled', 'last_updated')
+
+
+def _plain(value):
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# The scorecard of the farm at a row position, as JSON-ready values. region_positions
+# are the row positions of the farm's region (None = every farm).
+def farm_scorecard(df, position, region_positions=None, history=None):
+    metrics = []
+    for column in SCORECARD_METRICS:
+        values = df[column].to_numpy()
+        value = values[position]
+        region_values = values if region_positions is None else values[region_positions]
+        metrics.append({
+            'column': column,
+            'label': SCATTER_AXES[column],
+            'value': float(value),
+            # Mid-rank percentile: ties count half
+            'percentile': float(((values < value).sum() + (values == value).sum() / 2) / len(values) * 100),
+            'region_avg': float(region_values.mean())
+        })
+
+    change = None
+    if history is not None:
+        change = history.quarter_change(positions=np.array([position]))
+    row = df.iloc[position]
+    return {
+        'profile': {field: _plain(row[field]) for field in PROFILE_FIELDS},
+        'metrics': metrics,
+        'change': change
+    }
@@ -0,0 +1,389 @@
+import fcntl
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cube import CUBE_DIMENSIONS, AggregateCube
+from farm_data import RISK_LEVELS
+from result_cache import normalize_search
+
+# SQLite copy of the farm table for the dashboard queries.
+#
+# The farms are written once into a single database file: one row per farm keyed
+# by its row position in the in-memory table, B-tree indexes on the four dropdown
+# columns and an FTS5 trigram index over name and id for the search box. The search
+# table holds the casefolded name and id, and queries are casefolded the same way,
+# so it answers exactly the substring queries of search_index.py (SQLite's own case
+# folding covers ASCII only, and would miss e.g. 'ß' against 'ss'). The
+# dashboard's filters become a WHERE clause and its aggregates one GROUP BY over
+# the cube dimensions, so only a few hundred grouped rows and the matching
+# positions leave SQLite. Dropdown-only views read farm_segments, the measures
+# pre-grouped per region x tier x drought x flood cell (the SQL twin of the
+# aggregate cube); searches group the matched farms along a composite index.
+#
+# Workers open the file read-only through a small per-process connection pool.
+# Statement texts depend only on which filters are set (values are parameters),
+# so every connection's statement cache keeps them prepared after first use.
+#
+# Farms added and edited through the live store reach the database through the
+# store's write journal (see apply_farm_journal): each journalled row is written to
+# farms and farm_search and the farm_segments cells it leaves and enters are
+# regrouped, so the database stays current without being rebuilt.
+
+SQLITE_FORMAT = 3
+DEFAULT_POOL_SIZE = 4
+INDEXED_COLUMNS = ('region', 'supplier_tier', 'drought_risk', 'flood_risk')
+SEARCH_COLUMNS = ('name', 'id')
+# FTS5 trigrams need at least this many characters; shorter queries scan the search table
+MIN_MATCH_LENGTH = 3
+
+# Per-cell sums behind the dashboard metrics, as AggregateCube._measures()
+MEASURE_SQL = {
+    'count': 'COUNT(*)',
+    'compliant': 'SUM(tnfd_compliant)',
+    'score_sum': 'SUM(overall_score)',
+    'habitat_ha': 'SUM(size * natural_habitat / 100.0)',
+    'soil_ok': 'SUM(soil_health >= 4.0)',
+    'water_sum': 'SUM(water_efficiency)',
+    'water_ok': 'SUM(water_efficiency >= 85)',
+    'biodiversity_sum': 'SUM(biodiversity_score)',
+    'milk_volume': 'SUM(milk_volume)',
+    'sfi': 'SUM(sfi_enrolled)',
+    'cs': 'SUM(cs_enrolled)',
+    'both_schemes': 'SUM(sfi_enrolled AND cs_enrolled)'
+}
+
+SEGMENTS_SQL = (f"SELECT {', '.join(CUBE_DIMENSIONS)}, "
+                f"{', '.join(f'{sql} AS {name}' for name, sql in MEASURE_SQL.items())} "
+                f"FROM farms{{where}} GROUP BY {', '.join(CUBE_DIMENSIONS)}")
+SEGMENT_SUMMARY_SQL = f"SELECT {', '.join(CUBE_DIMENSIONS)}, {', '.join(MEASURE_SQL)} FROM farm_segments{{where}}"
+POSITIONS_SQL = "SELECT position FROM farms{where} ORDER BY position"
+
+
+def _sql_type(dtype):
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == object:
+        return 'TEXT'
+    if dtype == bool or np.issubdtype(dtype, np.integer):
+        return 'INTEGER'
+    if np.issubdtype(dtype, np.floating):
+        return 'REAL'
+    return 'TEXT'
+
+
+# Column values as SQLite-friendly Python objects (strings, ints, floats, ISO dates)
+def _sql_column(series):
+    if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+        return series.astype(str).tolist()
+    if np.issubdtype(series.dtype, np.datetime64):
+        return series.dt.strftime('%Y-%m-%d').tolist()
+    if series.dtype == bool:
+        return series.astype(np.int8).tolist()
+    return series.tolist()
+
+
+def _search_values(values):
+    return [str(value).casefold() for value in values]
+
+
+# `journal_offset` is where in the write journal the table df stands (0 for a table
+# no journalled write was made against yet)
+def write_farm_sqlite(df, path, batch_rows=100000, journal_offset=0):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        columns = ', '.join(f"{name} {_sql_type(df.dtypes[name])}" for name in df.columns)
+        connection.execute(f"CREATE TABLE farms (position INTEGER PRIMARY KEY, {columns})")
+        insert = f"INSERT INTO farms VALUES (?{', ?' * len(df.columns)})"
+        for start in range(0, len(df), batch_rows):
+            chunk = df.iloc[start:start + batch_rows]
+            values = [range(start, start + len(chunk))] + [_sql_column(chunk[name]) for name in df.columns]
+            connection.executemany(insert, zip(*values))
+
+        for column in INDEXED_COLUMNS + ('id',):
+            connection.execute(f"CREATE INDEX farms_{column} ON farms ({column})")
+        connection.execute(f"CREATE INDEX farms_segment ON farms ({', '.join(CUBE_DIMENSIONS)})")
+        connection.execute(f"CREATE TABLE farm_segments AS {SEGMENTS_SQL.format(where='')}")
+        connection.execute(f"CREATE VIRTUAL TABLE farm_search USING fts5({', '.join(SEARCH_COLUMNS)}, "
+                           f"tokenize='trigram case_sensitive 1')")
+        insert = f"INSERT INTO farm_search (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (?{', ?' * len(SEARCH_COLUMNS)})"
+        for start in range(0, len(df), batch_rows):
+            chunk = df.iloc[start:start + batch_rows]
+            values = [range(start, start + len(chunk))] + [chunk[name].astype(str).str.casefold().tolist()
+                                                           for name in SEARCH_COLUMNS]
+            connection.executemany(insert, zip(*values))
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ('format', str(SQLITE_FORMAT)),
+            ('dataset_version', df.attrs.get('dataset_version', '')),
+            ('n_farms', str(len(df))),
+            ('journal_offset', str(journal_offset)),
+            ('writes', '0')
+        ])
+        connection.commit()
+        # Planner statistics, so selective dropdowns use the indexes and broad ones scan
+        connection.execute("ANALYZE")
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+
+
+def read_farm_sqlite_meta(path):
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return dict(connection.execute("SELECT key, value FROM meta"))
+    finally:
+        connection.close()
+
+
+# Held by the one process building or writing the database
+@contextmanager
+def _write_lock(path):
+    with open(f"{path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# Write journalled farm rows: an update rewrites the farm's row, an add takes the
+# next position, and the farm_segments cells the rows leave or enter are regrouped
+def _apply_writes(connection, entries):
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(farms)")][1:]
+    update = f"UPDATE farms SET {', '.join(f'{c} = ?' for c in columns)} WHERE position = ?"
+    insert = f"INSERT INTO farms VALUES (?{', ?' * len(columns)})"
+    search = f"INSERT INTO farm_search (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (?{', ?' * len(SEARCH_COLUMNS)})"
+    next_position = connection.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM farms").fetchone()[0]
+    cells = set()
+    for entry in entries:
+        row = entry['row']
+        values = [row.get(column) for column in columns]
+        old = None
+        if entry['op'] == 'update':
+            old = connection.execute(f"SELECT position, {', '.join(CUBE_DIMENSIONS)} FROM farms WHERE id = ?",
+                                     (row['id'],)).fetchone()
+        if old is not None:
+            position = old[0]
+            cells.add(old[1:])
+            connection.execute(update, values + [position])
+            connection.execute("DELETE FROM farm_search WHERE rowid = ?", (position,))
+        else:
+            position = next_position
+            next_position += 1
+            connection.execute(insert, [position] + values)
+        connection.execute(search, [position] + _search_values(row[column] for column in SEARCH_COLUMNS))
+        cells.add(tuple(str(row[d]) for d in CUBE_DIMENSIONS))
+
+    where = ' WHERE ' + ' AND '.join(f"{d} = ?" for d in CUBE_DIMENSIONS)
+    for cell in cells:
+        connection.execute(f"DELETE FROM farm_segments{where}", cell)
+        connection.execute(f"INSERT INTO farm_segments {SEGMENTS_SQL.format(where=where)}", cell)
+
+
+# Apply the live store's write journal to the database. meta records how far into
+# the journal the database is; the lines after that are applied in one transaction
+# that moves it on, so whichever worker gets here first applies each line once.
+# A rebase to a new base table (a rebuilt data drop) rebuilds the database from the
+# table load_base(version) opens. Call it holding the write lock.
+def apply_farm_journal(path, journal_path, load_base=None):
+    meta = read_farm_sqlite_meta(path)
+    offset = int(meta['journal_offset'])
+    try:
+        with open(journal_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except OSError:
+        return
+    # A line still being written is applied next time
+    lines = data[:data.rfind(b'\n') + 1].splitlines(keepends=True)
+    entries = [json.loads(line) for line in lines]
+    base, start = meta['dataset_version'], 0
+    for i, entry in enumerate(entries):
+        if entry['op'] == 'rebase' and entry['base'] == base:
+            base, start = entry['table'], i + 1
+    if start:
+        df = load_base(base)
+        df.attrs['dataset_version'] = base
+        write_farm_sqlite(df, path, journal_offset=offset + sum(len(line) for line in lines[:start]))
+    writes = [entry for entry in entries[start:] if entry['base'] == base and entry['op'] in ('add', 'update')]
+
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            _apply_writes(connection, writes)
+            connection.execute("UPDATE meta SET value = ? WHERE key = 'journal_offset'",
+                               (str(offset + sum(len(line) for line in lines)),))
+            connection.execute("UPDATE meta SET value = CAST(value AS INTEGER) + ? WHERE key = 'writes'",
+                               (len(writes),))
+    finally:
+        connection.close()
+
+
+# Build the database for a base farm table once and attach to it, under a lock so
+# only one worker writes it. It is rebuilt when the base table changes, then brought
+# up to the write journal (see SqliteFarmStore.sync).
+def load_or_build_farm_sqlite(path, df, pool_size=DEFAULT_POOL_SIZE, journal_path=None, load_base=None):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with _write_lock(path):
+        try:
+            meta = read_farm_sqlite_meta(path)
+        except sqlite3.Error:
+            meta = {}
+        if (meta.get('format') != str(SQLITE_FORMAT)
+                or meta.get('dataset_version') != df.attrs.get('dataset_version')
+                or meta.get('n_farms') != str(len(df))):
+            write_farm_sqlite(df, path)
+    store = SqliteFarmStore(path, pool_size, journal_path, load_base)
+    store.sync()
+    return store
+
+
+# WHERE clause and parameters for the dashboard filters
+def filter_clause(search='', region='all', tier='all', risk='all'):
+    terms = []
+    params = []
+    if region != 'all':
+        terms.append("region = ?")
+        params.append(region)
+    if tier != 'all':
+        terms.append("supplier_tier = ?")
+        params.append(tier)
+    if risk != 'all':
+        terms.append("(drought_risk = ? OR flood_risk = ?)")
+        params += [risk, risk]
+    query = normalize_search(search)
+    if len(query) >= MIN_MATCH_LENGTH:
+        terms.append("position IN (SELECT rowid FROM farm_search WHERE farm_search MATCH ?)")
+        params.append('"' + query.replace('"', '""') + '"')
+    elif query:
+        matches = ' OR '.join(f"instr({column}, ?)" for column in SEARCH_COLUMNS)
+        terms.append(f"position IN (SELECT rowid FROM farm_search WHERE {matches})")
+        params += [query] * len(SEARCH_COLUMNS)
+    return (' WHERE ' + ' AND '.join(terms) if terms else ''), params
+
+
+# Read-only access to a farm database through a per-process connection pool.
+# Connections are never carried across a fork: a forked worker starts its own pool.
+# With a journal, sync() brings the database up to the live store's writes; its
+# version then follows the store's (base table version plus writes applied).
+class SqliteFarmStore:
+    def __init__(self, path, pool_size=DEFAULT_POOL_SIZE, journal_path=None, load_base=None):
+        self.path = path
+        self.pool_size = pool_size
+        self.journal_path = journal_path
+        self.load_base = load_base
+        self._lock = threading.Lock()
+        self._pid = None
+        self._journal_size = None
+        self._read_meta()
+
+    def _read_meta(self):
+        meta = read_farm_sqlite_meta(self.path)
+        writes = int(meta.get('writes', 0))
+        self.base_version = meta['dataset_version']
+        self.version = f"{self.base_version}+{writes}" if writes else self.base_version
+        self._dimensions = None
+
+    # Apply journalled writes the database does not hold yet; cheap when the
+    # journal has not grown since the last call
+    def sync(self):
+        if self.journal_path is None:
+            return
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            return
+        if size == self._journal_size:
+            return
+        with _write_lock(self.path):
+            apply_farm_journal(self.path, self.journal_path, self.load_base)
+        base_version = self.base_version
+        self._read_meta()
+        self._journal_size = size
+        if self.base_version != base_version:
+            # A rebuilt database is a new file: connections to the old one are dropped
+            with self._lock:
+                self._pid = None
+
+    def _connect(self):
+        connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False,
+                                     cached_statements=64)
+        connection.execute("PRAGMA query_only = ON")
+        connection.execute("PRAGMA mmap_size = 268435456")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = queue.LifoQueue()
+                self._opened = 0
+            pool = self._pool
+            try:
+                connection = pool.get_nowait()
+            except queue.Empty:
+                connection = None
+                if self._opened < self.pool_size:
+                    self._opened += 1
+                    connection = self._connect()
+        if connection is None:
+            connection = pool.get()
+        try:
+            yield connection
+        finally:
+            pool.put(connection)
+
+    # Sorted row positions matching the filters, or None when every farm is selected
+    def positions(self, search='', region='all', tier='all', risk='all'):
+        where, params = filter_clause(search, region, tier, risk)
+        if not where:
+            return None
+        with self.connection() as connection:
+            rows = connection.execute(POSITIONS_SQL.format(where=where), params)
+            return np.fromiter((row[0] for row in rows), dtype=np.int64)
+
+    # The values of each cube dimension among the farms, in the order AggregateCube
+    # gives them (the risk levels in their own order, anything else sorted)
+    def dimensions(self):
+        if self._dimensions is None:
+            dimensions = {}
+            with self.connection() as connection:
+                for d in CUBE_DIMENSIONS:
+                    values = {row[0] for row in connection.execute(f"SELECT DISTINCT {d} FROM farm_segments")}
+                    order = RISK_LEVELS if d in ('drought_risk', 'flood_risk') else []
+                    dimensions[d] = [v for v in order if v in values] + sorted(values - set(order))
+            self._dimensions = dimensions
+        return self._dimensions
+
+    # Aggregate cube of the filtered farms over dimensions (default: dimensions())
+    def cube(self, search='', region='all', tier='all', risk='all', dimensions=None):
+        dimensions = dimensions or self.dimensions()
+        where, params = filter_clause(search, region, tier, risk)
+        sql = SEGMENTS_SQL if (search or '').strip() else SEGMENT_SUMMARY_SQL
+        with self.connection() as connection:
+            rows = connection.execute(sql.format(where=where), params).fetchall()
+
+        shape = tuple(len(dimensions[d]) for d in CUBE_DIMENSIONS)
+        measures = {name: np.zeros(shape) for name in MEASURE_SQL}
+        lookups = [{value: i for i, value in enumerate(dimensions[d])} for d in CUBE_DIMENSIONS]
+        for row in rows:
+            cell = tuple(lookup[value] for lookup, value in zip(lookups, row))
+            for name, value in zip(MEASURE_SQL, row[len(CUBE_DIMENSIONS):]):
+                measures[name][cell] = value or 0
+        return AggregateCube.from_measures(dimensions, measures)
+
+    # Dashboard aggregates of the filtered farms, in the form of AggregateCube.summary()
+    def summary(self, dimensions=None, search='', region='all', tier='all', risk='all'):
+        return self.cube(search, region, tier, risk, dimensions).summary()
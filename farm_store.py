@@ -0,0 +1,148 @@
+import fcntl
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from farm_data import generate_farm_data, GENERATOR_VERSION
+from farm_schema import apply_farm_schema
+
+# Columnar on-disk farm store.
+#
+# Each column is written as its own .npy file next to a meta.json describing the
+# schema. Workers open the files with mmap_mode='r', so every gunicorn worker
+# reads the same pages from the OS page cache instead of holding a private copy,
+# and every worker answers from exactly the same portfolio.
+#
+# String columns are stored as categorical codes with their categories kept in
+# meta.json, so they map zero-copy as well. Columns with too many distinct values
+# to be worth a dictionary (farm ids) are stored as fixed-width bytes and decoded
+# once per worker.
+#
+# Each build of a store is its own directory (<path>.build-<version>) and <path> is
+# a symlink to the current one. A rebuild writes a new directory and swaps the link
+# with one rename, so <path> always leads to a complete store, and open_farm_store
+# resolves the link once and reads every file from that one build. The build it
+# replaced is kept until the next rebuild, so a reader that resolved the link just
+# before the swap can still finish opening it.
+
+META_FILE = 'meta.json'
+STORE_FORMAT = 3
+MAX_CATEGORIES = 32767
+
+
+def _builds(path):
+    parent, name = os.path.split(path)
+    return [os.path.join(parent, entry) for entry in os.listdir(parent or '.') if entry.startswith(f"{name}.build-")]
+
+
+# `source` records how a generated table was made (seed, generator version), so a
+# store can tell whether it still holds the portfolio being asked for
+def write_farm_store(df, path, source=None):
+    path = os.path.normpath(path)
+    version = uuid.uuid4().hex
+    build_path = f"{path}.build-{version}"
+    os.makedirs(build_path)
+
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        entry = {'name': name}
+        if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+            cat = pd.Categorical(series)
+            if len(cat.categories) <= MAX_CATEGORIES:
+                entry['kind'] = 'category'
+                entry['categories'] = [str(c) for c in cat.categories]
+                values = cat.codes
+            else:
+                entry['kind'] = 'bytes'
+                values = series.to_numpy().astype('S')
+        else:
+            entry['kind'] = 'array'
+            values = series.to_numpy()
+        np.save(os.path.join(build_path, f"{name}.npy"), values, allow_pickle=False)
+        columns.append(entry)
+
+    meta = {
+        'format': STORE_FORMAT,
+        'version': version,
+        'n_rows': len(df),
+        'source': source,
+        'columns': columns
+    }
+    with open(os.path.join(build_path, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and previous is None:
+        shutil.rmtree(path)  # a store written before builds were versioned
+    link = f"{path}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(build_path), link)
+    os.replace(link, path)
+    for build in _builds(path):
+        if build not in (build_path, previous):
+            shutil.rmtree(build, ignore_errors=True)
+    return meta
+
+
+# Remove a store with all of its builds
+def remove_farm_store(path):
+    path = os.path.normpath(path)
+    if os.path.islink(path):
+        os.remove(path)
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+    for build in _builds(path):
+        shutil.rmtree(build, ignore_errors=True)
+
+
+def read_farm_store_meta(path):
+    with open(os.path.join(path, META_FILE)) as f:
+        return json.load(f)
+
+
+def open_farm_store(path):
+    path = os.path.realpath(path)
+    meta = read_farm_store_meta(path)
+    data = {}
+    for entry in meta['columns']:
+        values = np.load(os.path.join(path, f"{entry['name']}.npy"), mmap_mode='r')
+        if entry['kind'] == 'category':
+            dtype = pd.CategoricalDtype(entry['categories'])
+            data[entry['name']] = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        elif entry['kind'] == 'bytes':
+            data[entry['name']] = np.char.decode(values, 'utf-8').astype(object)
+        else:
+            data[entry['name']] = values
+    # copy=False keeps each column backed by its read-only mapping
+    df = pd.DataFrame(data, copy=False)
+    df.attrs['dataset_version'] = meta['version']
+    return apply_farm_schema(df)
+
+
+# Build the store once and attach to it. The first process to take the lock
+# generates and writes the columns; every other worker waits and then maps them,
+# still holding the lock so no rebuild can swap the store while it is being opened.
+# A store generated with a different size, seed or generator version is rebuilt.
+def load_or_build_farm_store(path, n_farms, seed=None):
+    source = {'seed': seed, 'generator': GENERATOR_VERSION}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                meta = read_farm_store_meta(path)
+            except (OSError, ValueError):
+                meta = None
+            if (meta is None or meta.get('format') != STORE_FORMAT or meta.get('n_rows') != n_farms
+                    or meta.get('source') != source):
+                write_farm_store(apply_farm_schema(generate_farm_data(n_farms=n_farms, seed=seed)), path,
+                                 source)
+            return open_farm_store(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
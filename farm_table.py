@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+# Rows the overlay has room for when the first farm is written; it doubles when full
+OVERLAY_ROWS = 1024
+
+
+# The integer type pandas keeps the codes of a categorical with n categories in
+def _codes_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+# Farm rows written since the base table was loaded, one array per column
+# (categoricals as int32 codes into the table's categories). Rows are only ever
+# appended: a full overlay is copied into arrays twice the size, and a row, once
+# written, never changes, so every table built over the overlay keeps reading its
+# own rows however many are added after them.
+class _Overlay:
+    def __init__(self, base):
+        self.n_rows = 0
+        self.columns = {}
+        for column in base.columns:
+            series = base[column]
+            dtype = np.int32 if isinstance(series.dtype, pd.CategoricalDtype) else series.to_numpy()[:0].dtype
+            self.columns[column] = np.empty(OVERLAY_ROWS, dtype=dtype)
+
+    def append(self, values):
+        if self.n_rows == len(next(iter(self.columns.values()))):
+            self.columns = {column: np.concatenate([array, np.empty_like(array)])
+                            for column, array in self.columns.items()}
+        row = self.n_rows
+        for column, value in values.items():
+            self.columns[column][row] = value
+        self.n_rows += 1
+        return row
+
+
+class _ILocIndexer:
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            position = int(key) + len(self.table) if key < 0 else int(key)
+            return self.table.take([position]).iloc[0]
+        if isinstance(key, slice):
+            key = np.arange(len(self.table))[key]
+        return self.table.take(key)
+
+
+# The farm table as the live store serves it: a read-only base frame (the
+# memory-mapped farm store, a data drop or a generated portfolio) plus an overlay of
+# the farms written since, which reads merge with the base.
+#
+# The base is never copied or modified. An added farm goes into the next overlay
+# row and an edited one into a new overlay row that replaces its position, so a
+# write costs one row whatever the size of the table, and the mapped store's pages
+# stay shared by every worker. Writes return a new table; a table never changes
+# once made, so a reader holding one (e.g. an export streaming across several lock
+# releases) keeps a consistent view of the farms.
+#
+# It answers the part of the DataFrame interface the dashboard reads the farm table
+# through: len(), columns, dtypes, attrs, table[column] / table[columns], take()
+# and iloc[]. Until the first write these are the base frame's own; after it a
+# column read builds the merged column, and row reads touch just their rows.
+class FarmTable:
+    def __init__(self, base, overlay=None, appended=None, edited=None, dtypes=None, attrs=None, arrays=None):
+        self.base = base
+        # The base columns as arrays (categoricals as codes), shared by every table
+        # over the same base
+        self._arrays = {} if arrays is None else arrays
+        self.columns = base.columns
+        self.dtypes = base.dtypes if dtypes is None else dtypes
+        self.attrs = dict(base.attrs if attrs is None else attrs)
+        self.iloc = _ILocIndexer(self)
+        self._overlay = overlay
+        # Overlay row of each appended position, and of each edited base position
+        self._appended = np.empty(0, dtype=np.int64) if appended is None else appended
+        self._edited = {} if edited is None else edited
+        self._edited_positions = np.array(sorted(self._edited), dtype=np.int64)
+        self._edited_rows = np.array([self._edited[p] for p in self._edited_positions], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.base) + len(self._appended)
+
+    @property
+    def written(self):
+        return bool(len(self._appended) or self._edited)
+
+    # A table with the farm at position set to the one-row frame row_df (in the
+    # table's dtypes; categorical values may be new labels). position len(self)
+    # appends the farm.
+    def with_row(self, position, row_df):
+        overlay = self._overlay if self._overlay is not None else _Overlay(self.base)
+        dtypes = self.dtypes.copy()
+        values = {}
+        row = row_df.iloc[0]
+        for column in self.columns:
+            value = row[column]
+            dtype = dtypes[column]
+            if isinstance(dtype, pd.CategoricalDtype):
+                categories = dtype.categories
+                if pd.isna(value):
+                    value = -1
+                elif value in categories:
+                    value = categories.get_loc(value)
+                else:
+                    # A new label goes after the existing ones, so the base codes stay valid
+                    dtypes[column] = pd.CategoricalDtype(categories.append(pd.Index([value])))
+                    value = len(categories)
+            values[column] = value
+        overlay_row = overlay.append(values)
+
+        appended, edited = self._appended, self._edited
+        if position >= len(self.base):
+            appended = appended.copy() if position < len(self) else np.append(appended, -1)
+            appended[position - len(self.base)] = overlay_row
+        else:
+            edited = dict(edited)
+            edited[position] = overlay_row
+        return FarmTable(self.base, overlay, appended, edited, dtypes, self.attrs, self._arrays)
+
+    # Overlay row of each position, -1 for positions read from the base
+    def _rows(self, positions):
+        rows = np.full(len(positions), -1, dtype=np.int64)
+        appended = positions >= len(self.base)
+        rows[appended] = self._appended[positions[appended] - len(self.base)]
+        if len(self._edited_positions):
+            i = np.minimum(np.searchsorted(self._edited_positions, positions), len(self._edited_positions) - 1)
+            edited = self._edited_positions[i] == positions
+            rows[edited] = self._edited_rows[i[edited]]
+        return rows
+
+    def _base_array(self, column):
+        if column not in self._arrays:
+            series = self.base[column]
+            categorical = isinstance(series.dtype, pd.CategoricalDtype)
+            self._arrays[column] = series.cat.codes.to_numpy() if categorical else series.to_numpy()
+        return self._arrays[column]
+
+    # Values of a column at the given positions (None = every row), whose overlay
+    # rows (_rows) a caller reading several columns passes in
+    def _column(self, column, positions=None, rows=None):
+        dtype = self.dtypes[column]
+        categorical = isinstance(dtype, pd.CategoricalDtype)
+        base = self._base_array(column)
+        overlay = self._overlay.columns[column] if self._overlay is not None else base[:0]
+        if positions is None:
+            values = np.concatenate([base, overlay[self._appended]])
+            values[self._edited_positions] = overlay[self._edited_rows]
+        else:
+            rows = self._rows(positions) if rows is None else rows
+            from_base = rows < 0
+            if from_base.all():
+                values = base[positions]
+            else:
+                values = np.empty(len(positions), dtype=np.result_type(base.dtype, overlay.dtype))
+                values[from_base] = base[positions[from_base]]
+                values[~from_base] = overlay[rows[~from_base]]
+        if categorical:
+            values = values.astype(_codes_dtype(len(dtype.categories)), copy=False)
+            return pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        return values
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            return pd.DataFrame({column: self[column] for column in key}, copy=False)
+        if not self.written:
+            return self.base[key]
+        return pd.Series(self._column(key), name=key)
+
+    # The rows at the given positions as a DataFrame indexed by position
+    def take(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        if not self.written:
+            return self.base.take(positions)
+        rows = self._rows(positions)
+        return pd.DataFrame({column: self._column(column, positions, rows) for column in self.columns},
+                            index=positions, copy=False)
+
+    # The whole table as one DataFrame (a copy once anything was written)
+    def to_frame(self):
+        return self.take(np.arange(len(self))) if self.written else self.base
@@ -0,0 +1,197 @@
+import plotly.graph_objects as go
+from dash import Patch
+from plotly.subplots import make_subplots
+
+from farm_data import RISK_LEVELS
+
+
+# Figure templates.
+#
+# Building a go.Figure validates every property, and make_subplots in particular is
+# slow. Each chart's layout and trace skeleton is therefore built once, kept as a
+# plain dict, and per-request data arrays are injected into a shallow copy (or sent
+# as a Dash Patch). Plain dicts serialize straight to JSON without going back
+# through Plotly's validators.
+class FigureTemplate:
+    def __init__(self, build):
+        self._build = build
+        self._skeleton = None
+
+    def skeleton(self):
+        if self._skeleton is None:
+            self._skeleton = self._build().to_plotly_json()
+        return self._skeleton
+
+    # Full figure dict with trace properties replaced, e.g. {0: {'x': [...], 'y': [...]}},
+    # and optionally top-level layout properties (e.g. axis titles) replaced
+    def render(self, traces, title=None, layout=None):
+        skeleton = self.skeleton()
+        data = list(skeleton['data'])
+        for i, props in traces.items():
+            data[i] = dict(data[i], **props)
+        figure_layout = dict(skeleton['layout'], **(layout or {}))
+        if title is not None:
+            figure_layout['title'] = {'text': title}
+        return {'data': data, 'layout': figure_layout}
+
+    # The same update as a Patch against a graph already showing the skeleton
+    def patch(self, traces, title=''):
+        patched = Patch()
+        for i, props in traces.items():
+            for name, value in props.items():
+                patched['data'][i][name] = value
+        patched['layout']['title'] = {'text': title}
+        return patched
+
+
+def _regional_performance_figure():
+    fig = make_subplots(
+        rows=1, cols=1,
+        specs=[[{"secondary_y": True}]]
+    )
+    fig.add_trace(
+        go.Bar(x=[], y=[], name='Number of Farms', marker_color='#3b82f6'),
+        secondary_y=False
+    )
+    fig.add_trace(
+        go.Scatter(x=[], y=[], name='Avg Score', mode='lines+markers', marker_color='#10b981',
+                   line=dict(width=3)),
+        secondary_y=True
+    )
+    fig.add_trace(
+        go.Scatter(x=[], y=[], name='TNFD Compliance %', mode='lines+markers', marker_color='#f59e0b',
+                   line=dict(width=3)),
+        secondary_y=True
+    )
+    fig.update_xaxes(title_text="Region")
+    fig.update_yaxes(title_text="Number of Farms", secondary_y=False)
+    fig.update_yaxes(title_text="Score / Compliance %", secondary_y=True)
+    fig.update_layout(height=400, hovermode='x unified', plot_bgcolor='white',
+                      paper_bgcolor='white', font=dict(size=12))
+    return fig
+
+
+def _risk_assessment_figure():
+    fig = go.Figure()
+    fig.add_trace(go.Bar(name='Drought Risk', x=RISK_LEVELS, y=[], marker_color='#fbbf24'))
+    fig.add_trace(go.Bar(name='Flood Risk', x=RISK_LEVELS, y=[], marker_color='#60a5fa'))
+    fig.update_layout(barmode='stack', height=400, plot_bgcolor='white',
+                      paper_bgcolor='white', font=dict(size=12))
+    return fig
+
+
+def _tier_distribution_figure():
+    fig = go.Figure(go.Pie(labels=[], values=[], hole=0.4,
+                           hovertemplate='label=%{label}<br>value=%{value}<extra></extra>'))
+    fig.update_layout(height=400, showlegend=True, legend=dict(tracegroupgap=0),
+                      margin=dict(t=60))
+    return fig
+
+
+def _scheme_enrollment_figure():
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=['SFI Enrolled', 'CS Enrolled', 'Both Schemes'],
+        y=[],
+        marker_color=['#10b981', '#3b82f6', '#7c3aed']
+    ))
+    fig.update_layout(height=400, plot_bgcolor='white', paper_bgcolor='white',
+                      yaxis_title="Number of Farms")
+    return fig
+
+
+# Analytics charts. Selections up to the point threshold are drawn farm by farm
+# with WebGL (Scattergl); larger ones as a heatmap of server-side bins.
+def _farm_scatter_figure():
+    fig = go.Figure()
+    for name, color in (('TNFD Compliant', '#10b981'), ('Not Compliant', '#ef4444')):
+        fig.add_trace(go.Scattergl(
+            x=[], y=[], text=[], name=name, mode='markers',
+            marker=dict(color=color, size=5, opacity=0.6),
+            hovertemplate='%{text}<br>%{x}, %{y}<extra></extra>'
+        ))
+    fig.update_layout(height=500, plot_bgcolor='white', paper_bgcolor='white', font=dict(size=12),
+                      legend=dict(orientation='h', y=1.08))
+    return fig
+
+
+def _farm_density_figure():
+    fig = go.Figure(go.Heatmap(
+        x=[], y=[], z=[], customdata=[], colorscale='Viridis', hoverongaps=False,
+        colorbar=dict(title=dict(text='Farms')),
+        hovertemplate='%{x}, %{y}<br>%{z} farms<br>%{customdata}% TNFD compliant<extra></extra>'
+    ))
+    fig.update_layout(height=500, plot_bgcolor='white', paper_bgcolor='white', font=dict(size=12))
+    return fig
+
+
+def _metric_trend_figure():
+    fig = go.Figure()
+    for name, color in (('TNFD Compliance %', '#f59e0b'), ('Avg Score', '#10b981'),
+                        ('High Risk %', '#ef4444')):
+        fig.add_trace(go.Scatter(x=[], y=[], name=name, mode='lines+markers', marker_color=color,
+                                 line=dict(width=3)))
+    fig.update_layout(height=350, hovermode='x unified', plot_bgcolor='white', paper_bgcolor='white',
+                      font=dict(size=12), yaxis_title="Score / %")
+    return fig
+
+
+# Farm map: trace 0 holds aggregated grid tiles (size by farm count, colour by
+# average score), trace 1 individual farms once few enough are in view.
+# uirevision keeps the user's pan and zoom across data updates.
+def _farm_map_figure():
+    fig = go.Figure()
+    fig.add_trace(go.Scattermap(
+        lat=[], lon=[], customdata=[], name='Farms per area', mode='markers',
+        marker=dict(size=[], color=[], colorscale='RdYlGn', cmin=50, cmax=90, opacity=0.75,
+                    colorbar=dict(title=dict(text='Avg Score'))),
+        hovertemplate=('%{customdata[0]:,} farms<br>Avg score %{customdata[1]:.0f}<br>'
+                       '%{customdata[2]:.1f}% TNFD compliant<extra></extra>')
+    ))
+    fig.add_trace(go.Scattermap(
+        lat=[], lon=[], text=[], customdata=[], name='Farm', mode='markers',
+        marker=dict(size=9, color=[], colorscale='RdYlGn', cmin=50, cmax=90, showscale=False),
+        hovertemplate='%{text}<br>Score %{customdata:.0f}<extra></extra>'
+    ))
+    fig.update_layout(height=550, margin=dict(l=0, r=0, t=0, b=0), showlegend=False,
+                      uirevision='farm-map',
+                      map=dict(style='carto-positron', center=dict(lat=53.0, lon=-2.0), zoom=5))
+    return fig
+
+
+# Climate scenario charts: the distribution of milk lost over the Monte Carlo
+# trials (histogram bins computed on the server), and expected vs 1-in-20 loss
+# per region
+def _climate_loss_figure():
+    fig = go.Figure(go.Bar(x=[], y=[], width=[], marker_color='#60a5fa',
+                           hovertemplate='%{x:.1f} ML lost<br>%{y} trials<extra></extra>'))
+    fig.update_layout(height=350, plot_bgcolor='white', paper_bgcolor='white', font=dict(size=12),
+                      bargap=0, xaxis_title="Milk lost (million litres)", yaxis_title="Trials")
+    return fig
+
+
+def _climate_region_figure():
+    fig = go.Figure()
+    for name, color in (('Expected loss', '#f59e0b'), ('1-in-20 loss (P95)', '#ef4444')):
+        fig.add_trace(go.Bar(name=name, x=[], y=[], marker_color=color,
+                             hovertemplate='%{x}<br>%{y:.1f} ML<extra></extra>'))
+    fig.update_layout(barmode='group', height=350, plot_bgcolor='white', paper_bgcolor='white',
+                      font=dict(size=12), yaxis_title="Million litres", legend=dict(orientation='h', y=1.1))
+    return fig
+
+
+# Dashboard charts
+REGIONAL_PERFORMANCE = FigureTemplate(_regional_performance_figure)
+RISK_ASSESSMENT = FigureTemplate(_risk_assessment_figure)
+TIER_DISTRIBUTION = FigureTemplate(_tier_distribution_figure)
+SCHEME_ENROLLMENT = FigureTemplate(_scheme_enrollment_figure)
+
+# Analytics charts
+FARM_SCATTER = FigureTemplate(_farm_scatter_figure)
+FARM_DENSITY = FigureTemplate(_farm_density_figure)
+METRIC_TREND = FigureTemplate(_metric_trend_figure)
+FARM_MAP = FigureTemplate(_farm_map_figure)
+
+# TNFD page charts
+CLIMATE_LOSS_DISTRIBUTION = FigureTemplate(_climate_loss_figure)
+CLIMATE_REGION_LOSS = FigureTemplate(_climate_region_figure)
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+# Low-cardinality columns the dashboard dropdowns filter on
+INDEXED_COLUMNS = ('region', 'supplier_tier', 'drought_risk', 'flood_risk')
+
+
+def _encode(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), list(series.cat.categories)
+    codes, uniques = pd.factorize(series)
+    return codes, list(uniques)
+
+
+# Bitmap index over the dropdown columns.
+#
+# Each column is encoded once as categorical codes and every distinct value gets a
+# packed bitmap (one bit per farm). A filter combination is resolved with a few
+# bitwise ANDs / ORs over n/8 bytes and only the final bitmap is expanded into row
+# positions, so callbacks never scan or copy the full frame.
+#
+# Rows can be appended and their values changed in place; each is a bit flip, and
+# bitmaps grow by doubling so appends stay amortized O(1).
+class FilterIndex:
+    def __init__(self, df, columns=INDEXED_COLUMNS):
+        self.n_rows = len(df)
+        self.bitmaps = {}
+        for column in columns:
+            codes, values = _encode(df[column])
+            self.bitmaps[column] = {
+                value: np.packbits(codes == code) for code, value in enumerate(values)
+            }
+        self._empty = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+
+    def bitmap(self, column, value):
+        return self.bitmaps[column].get(value, self._empty)
+
+    def _set_bit(self, column, value, position, on):
+        bits = self.bitmaps[column].get(value)
+        if bits is None:
+            bits = self.bitmaps[column][value] = np.zeros_like(self._empty)
+        if on:
+            bits[position >> 3] |= 0x80 >> (position & 7)
+        else:
+            bits[position >> 3] &= ~np.uint8(0x80 >> (position & 7))
+
+    def _reserve(self, n_rows):
+        n_bytes = (n_rows + 7) // 8
+        if n_bytes <= len(self._empty):
+            return
+        capacity = max(n_bytes, 2 * len(self._empty))
+        grow = capacity - len(self._empty)
+        self._empty = np.zeros(capacity, dtype=np.uint8)
+        for bitmaps in self.bitmaps.values():
+            for value, bits in bitmaps.items():
+                bitmaps[value] = np.concatenate([bits, np.zeros(grow, dtype=np.uint8)])
+
+    # Add a row (a mapping of column -> value) at the next position
+    def append(self, row):
+        position = self.n_rows
+        self._reserve(position + 1)
+        for column in self.bitmaps:
+            self._set_bit(column, row[column], position, True)
+        self.n_rows += 1
+        return position
+
+    # Move a row from its old to its new values
+    def update(self, position, old_row, new_row):
+        for column in self.bitmaps:
+            if old_row[column] != new_row[column]:
+                self._set_bit(column, old_row[column], position, False)
+                self._set_bit(column, new_row[column], position, True)
+
+    # Combined bitmap for the dashboard filters, or None when nothing is filtered
+    def filter_bitmap(self, region='all', tier='all', risk='all'):
+        bits = None
+        if region != 'all':
+            bits = self.bitmap('region', region)
+        if tier != 'all':
+            tier_bits = self.bitmap('supplier_tier', tier)
+            bits = tier_bits if bits is None else bits & tier_bits
+        if risk != 'all':
+            risk_bits = self.bitmap('drought_risk', risk) | self.bitmap('flood_risk', risk)
+            bits = risk_bits if bits is None else bits & risk_bits
+        return bits
+
+    def to_positions(self, bits):
+        return np.flatnonzero(np.unpackbits(bits, count=self.n_rows))
+
+    # Keep only the given (sorted) positions whose bit is set
+    def restrict(self, bits, positions):
+        if bits is None:
+            return positions
+        return positions[(bits[positions >> 3] >> (7 - (positions & 7))) & 1 == 1]
+
+    # Row positions matching the filters, or None when every row matches
+    def positions(self, region='all', tier='all', risk='all'):
+        bits = self.filter_bitmap(region, tier, risk)
+        if bits is None:
+            return None
+        return self.to_positions(bits)
@@ -0,0 +1,436 @@
+import fcntl
+import json
+import os
+import re
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cube import AggregateCube
+from farm_schema import cast_column
+from farm_table import FarmTable
+from filter_index import FilterIndex
+from search_index import SearchIndex
+from spatial_index import SpatialGridIndex
+from table_query import TableQuery
+
+# Columns the store fills in itself when a farm is written
+GENERATED_COLUMNS = ('id', 'last_updated')
+
+
+def _json_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot store {type(value).__name__} in the write journal")
+
+
+# Shared / exclusive lock: any number of readers, or one writer. A waiting writer
+# holds back new readers so a stream of requests cannot starve it. Reads are
+# reentrant per thread (a reader may take the lock again, e.g. around a fork).
+class ReadWriteLock:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            with self._condition:
+                while self._writer or self._waiting_writers:
+                    self._condition.wait()
+                self._readers += 1
+        self._local.depth = depth + 1
+
+    def release_read(self):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+# The in-process farm table together with everything derived from it: the bitmap
+# filter index, the search index, the spatial grid index, the aggregate cube and
+# the table query helper. With indexed=False (a worker whose dashboard filters and
+# aggregates are answered by SQLite) the bitmap index, search index and cube are
+# neither built nor kept, and are None.
+#
+# Farms are added and edited through add_farm() / update_farm(). Each write is
+# appended to a journal file shared by every worker and applied locally: the row
+# goes into the table's overlay (farm_table.py) while the base table, e.g. the
+# shared memory-mapped store, is left as it is, and the derived structures are
+# updated for just that farm (a few bit flips, a delta entry, the touched cube
+# cells and the row's sort keys) instead of being rebuilt.
+# Other workers replay the journal lines they have not seen on their next sync(),
+# so every worker holds the same farms. The version is the base table's version
+# plus the number of writes applied to it, so it is the same in every worker, and
+# subscribers are notified whenever it changes.
+#
+# Supplier drops go through the journal too. load_drop() journals the drop farms
+# that are new or changed as writes; rebase() moves every worker to a new base
+# table that load_base(version) opens (e.g. a rebuilt drop with farms removed),
+# journalling the farms added and edited through the dashboard again against it.
+# Either way the dashboard's edits of a farm are laid over its drop row, so they
+# survive a reload.
+#
+# Readers hold the shared side of `lock` (reading()) while they use the table or
+# indexes; writes and replays take it exclusively. A reader that has to
+# let go of the lock part way through keeps a snapshot() of the table instead.
+class LiveFarmStore:
+    def __init__(self, df, journal_path=None, load_base=None, indexed=True):
+        self.journal_path = journal_path
+        self.load_base = load_base
+        self.indexed = indexed
+        self.lock = ReadWriteLock()
+        self._listeners = []
+        self._install(df, self._derived(df, indexed))
+        # A forked child (background job, process pool) gets a consistent table
+        # and a lock no thread of its own holds
+        os.register_at_fork(before=lambda: self.lock.acquire_read(),
+                            after_in_parent=lambda: self.lock.release_read(),
+                            after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self.lock = ReadWriteLock()
+
+    @staticmethod
+    def _derived(df, indexed=True):
+        return {
+            'index': FilterIndex(df) if indexed else None,
+            'search_index': SearchIndex(df) if indexed else None,
+            'spatial_index': SpatialGridIndex(df),
+            'cube': AggregateCube(df) if indexed else None,
+            'table_query': TableQuery(df)
+        }
+
+    def _install(self, df, derived):
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0:
+            df = df.set_axis(pd.RangeIndex(len(df)), copy=False)
+        self.df = FarmTable(df)
+        for name, value in derived.items():
+            setattr(self, name, value)
+        self.base_version = df.attrs.get('dataset_version') or uuid.uuid4().hex
+        df.attrs['dataset_version'] = self.base_version
+        self.version = self.base_version
+        self.df.attrs['dataset_version'] = self.version
+        self._writes = 0
+        self._journal_offset = 0
+        self._id_index = None
+        self._appended_ids = {}
+        self._next_number = None
+        # Drop files ({name: hash}) the table holds, and the dashboard's own writes
+        # per farm id: the changed fields, or every field of a farm it added
+        self.drop_files = df.attrs.get('drop_files')
+        self._edits = {}
+        self._added = set()
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def reading(self):
+        return self.lock.read()
+
+    # The current table, to read on after the lock is released: a write makes a new
+    # table rather than changing this one. Take it while reading().
+    def snapshot(self):
+        return self.df
+
+    # Apply journalled writes from other workers; cheap when there are none
+    def sync(self):
+        if self.journal_path is None:
+            return False
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            return False
+        if size == self._journal_offset:
+            return False
+        rebased = self._load_rebase()
+        with self.lock.write():
+            if not self._replay(rebased):
+                return False
+            self._commit()
+        return True
+
+    # Journal lines not replayed yet, and how far they reach. A line still being
+    # written is picked up on the next sync.
+    def _unread(self):
+        if self.journal_path is None or not os.path.exists(self.journal_path):
+            return [], 0
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._journal_offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        return [json.loads(line) for line in data[:end].splitlines()], end
+
+    # The newest base table a chain of rebases moves this one to, and the index of
+    # the first entry written against it
+    def _rebased(self, entries):
+        base, start = self.base_version, 0
+        for i, entry in enumerate(entries):
+            if entry['op'] == 'rebase' and entry['base'] == base:
+                base, start = entry['table'], i + 1
+        return base, start
+
+    # Open and index the base table the journal moves to before taking the lock, so
+    # readers are not held up while it is built
+    def _load_rebase(self):
+        base, _ = self._rebased(self._unread()[0])
+        if base == self.base_version:
+            return None
+        df = self._open_base(base)
+        return base, df, self._derived(df, self.indexed)
+
+    def _open_base(self, version):
+        df = self.load_base(version) if self.load_base is not None else None
+        if df is None:
+            raise RuntimeError(f"The farm table {version} the write journal moves to cannot be opened")
+        return df
+
+    def _replay(self, rebased=None):
+        entries, end = self._unread()
+        offset = self._journal_offset + end
+        base, start = self._rebased(entries)
+        if base != self.base_version:
+            if rebased is None or rebased[0] != base:
+                df = self._open_base(base)
+                rebased = base, df, self._derived(df, self.indexed)
+            self._install(rebased[1], rebased[2])
+            entries = entries[start:]
+        entries = [entry for entry in entries if entry['base'] == self.base_version]
+        self._apply_all(entries)
+        self._journal_offset = offset
+        return len(entries) + (start > 0)
+
+    # Exclusive access to the end of the journal (None without a journal)
+    @contextmanager
+    def _journal(self):
+        if self.journal_path is None:
+            yield None
+            return
+        with open(self.journal_path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _append(self, journal, entries):
+        lines = [json.dumps(entry, default=_json_value) for entry in entries]
+        if journal is not None:
+            journal.write(''.join(line + '\n' for line in lines).encode())
+            journal.flush()
+        return [json.loads(line) for line in lines]
+
+    def _write(self, journal, entries):
+        entries = self._append(journal, [dict(entry, base=self.base_version) for entry in entries])
+        if journal is not None:
+            self._journal_offset = journal.tell()
+        self._apply_all(entries)
+        self._commit()
+        return entries
+
+    def _has_farm(self, farm_id):
+        try:
+            self.position_of(farm_id)
+            return True
+        except KeyError:
+            return False
+
+    def position_of(self, farm_id):
+        if farm_id in self._appended_ids:
+            return self._appended_ids[farm_id]
+        if self._id_index is None:
+            self._id_index = pd.Index(self.df.base['id'])
+        try:
+            return int(self._id_index.get_loc(farm_id))
+        except KeyError:
+            raise KeyError(f"Unknown farm id: {farm_id}") from None
+
+    def get_farm(self, farm_id):
+        with self.reading():
+            return self.df.iloc[self.position_of(farm_id)].to_dict()
+
+    def _new_farm_id(self):
+        if self._next_number is None:
+            numbers = pd.to_numeric(self.df['id'].astype(str).str.extract(r'(\d+)$')[0], errors='coerce')
+            self._next_number = int(numbers.max()) + 1 if numbers.notna().any() else 1
+        return f"FARM_{str(self._next_number).zfill(3)}"
+
+    # Cast a one-row frame to the store's dtypes; categoricals are widened for the
+    # row only, the table buffer takes new categories when the row is written
+    def _conform(self, row_df):
+        for column in self.df.columns:
+            dtype = self.df.dtypes[column]
+            if isinstance(dtype, pd.CategoricalDtype):
+                new_values = [v for v in row_df[column].dropna().unique() if v not in dtype.categories]
+                if new_values:
+                    dtype = pd.CategoricalDtype(list(dtype.categories) + sorted(new_values))
+                row_df[column] = pd.Categorical(row_df[column], dtype=dtype)
+            else:
+                row_df[column] = cast_column(row_df[column], dtype.name)
+        return row_df[list(self.df.columns)]
+
+    def _check_record(self, record, partial=False):
+        unknown = set(record) - set(self.df.columns)
+        if unknown:
+            raise ValueError(f"Unknown farm fields: {', '.join(sorted(unknown))}")
+        missing = set(self.df.columns) - set(record) - set(GENERATED_COLUMNS)
+        if missing and not partial:
+            raise ValueError(f"Missing farm fields: {', '.join(sorted(missing))}")
+
+    # Apply journal entries in order. Their rows are cast to the store's dtypes in
+    # one frame, and the cube takes the replaced and the new rows in one go each.
+    def _apply_all(self, entries):
+        writes = [entry for entry in entries if entry['op'] in ('add', 'update')]
+        rows = self._conform(pd.DataFrame([entry['row'] for entry in writes])) if writes else None
+        replaced = []
+        i = 0
+        for entry in entries:
+            if entry['op'] == 'drop':
+                self.drop_files = entry['files']
+            elif entry['op'] in ('add', 'update'):
+                old_df = self._apply(entry, rows.iloc[[i]].reset_index(drop=True))
+                if old_df is not None:
+                    replaced.append(old_df)
+                i += 1
+        if self.cube is not None and replaced:
+            self.cube.add_rows(pd.concat(replaced, ignore_index=True), sign=-1)
+        if self.cube is not None and writes:
+            self.cube.add_rows(rows)
+
+    # Apply one write to the table and the indexes (the cube is left to
+    # _apply_all); returns the row an update replaced
+    def _apply(self, entry, row_df):
+        row = entry['row']
+        if not entry.get('drop'):
+            if entry['op'] == 'add':
+                self._added.add(row['id'])
+            changes = entry.get('changes', row)
+            self._edits.setdefault(row['id'], {}).update({k: v for k, v in changes.items() if k != 'id'})
+        if entry['op'] == 'add':
+            position = len(self.df)
+            self.df = self.df.with_row(position, row_df)
+            self.table_query.set_row(self.df, position)
+            self._appended_ids[row['id']] = position
+            if self.indexed:
+                self.index.append(row)
+                self.search_index.set_row(position, row)
+            self.spatial_index.append(row_df)
+            number = re.search(r'(\d+)$', str(row['id']))
+            if self._next_number is not None and number:
+                self._next_number = max(self._next_number, int(number.group(1)) + 1)
+            old_df = None
+        else:
+            position = self.position_of(row['id'])
+            old_df = self.df.take([position]).reset_index(drop=True)
+            self.df = self.df.with_row(position, row_df)
+            self.table_query.set_row(self.df, position)
+            if self.indexed:
+                self.index.update(position, old_df.iloc[0].to_dict(), row)
+                self.search_index.set_row(position, row)
+            self.spatial_index.update(position, old_df, row_df)
+        self._writes += 1
+        return old_df
+
+    def _commit(self):
+        if self.indexed and self.search_index.needs_rebuild():
+            self.search_index = SearchIndex(self.df)
+        self._notify()
+
+    def _notify(self):
+        self.version = f"{self.base_version}+{self._writes}" if self._writes else self.base_version
+        self.df.attrs['dataset_version'] = self.version
+        for listener in self._listeners:
+            listener(self.version)
+
+    def add_farm(self, record):
+        self._check_record(record)
+        with self.lock.write(), self._journal() as journal:
+            # Writes from other workers first, so the new id is not taken
+            if self._replay():
+                self._commit()
+            row = dict(record, id=self._new_farm_id(), last_updated=datetime.now().strftime('%Y-%m-%d'))
+            self._conform(pd.DataFrame([row]))
+            entry, = self._write(journal, [{'op': 'add', 'row': row}])
+        return entry['row']['id']
+
+    def update_farm(self, farm_id, changes):
+        self._check_record(changes, partial=True)
+        with self.lock.write(), self._journal() as journal:
+            if self._replay():
+                self._commit()
+            old_row = self.df.iloc[self.position_of(farm_id)].to_dict()
+            changes = dict(changes, last_updated=datetime.now().strftime('%Y-%m-%d'))
+            new_row = dict(old_row, **changes, id=old_row['id'])
+            self._conform(pd.DataFrame([new_row]))
+            entry, = self._write(journal, [{'op': 'update', 'row': new_row, 'changes': changes}])
+        return entry['row']
+
+    # Bring the table to a new state of the supplier drops (files: {name: hash}).
+    # rows holds the drop farms that are new or changed; each is journalled as a
+    # write with the dashboard's edits of the farm laid over it.
+    def load_drop(self, files, rows):
+        with self.lock.write(), self._journal() as journal:
+            if self._replay():
+                self._commit()
+            entries = []
+            for row in rows.to_dict('records'):
+                row = dict(row, **self._edits.get(row['id'], {}))
+                entries.append({'op': 'update' if self._has_farm(row['id']) else 'add', 'row': row, 'drop': True})
+            self._write(journal, entries + [{'op': 'drop', 'files': files}])
+
+    # Move this and every other worker to the base table load_base(version) opens.
+    # The dashboard's writes are journalled again against it: an edited farm keeps
+    # its edits over its new row, an added farm is added again, and the edits of a
+    # farm no longer in the table go with it.
+    def rebase(self, version):
+        df = self._open_base(version)
+        positions = pd.Index(df['id'])
+        with self.lock.write(), self._journal() as journal:
+            if self._replay():
+                self._commit()
+            entries = []
+            for farm_id, changes in self._edits.items():
+                if farm_id in positions:
+                    row = df.iloc[positions.get_loc(farm_id)].to_dict()
+                    entries.append({'op': 'update', 'row': dict(row, **changes), 'changes': changes})
+                elif farm_id in self._added:
+                    entries.append({'op': 'add', 'row': dict(changes, id=farm_id)})
+            # Applied like any other worker's, by the sync below
+            self._append(journal, [{'op': 'rebase', 'base': self.base_version, 'table': version}]
+                         + [dict(entry, base=version) for entry in entries])
+        self.sync()
@@ -0,0 +1,413 @@
+import concurrent.futures
+import hashlib
+import html
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cube import CUBE_DIMENSIONS
+from farm_data import RISK_LEVELS
+
+try:
+    from fpdf import FPDF
+except ImportError:  # HTML reports still work without fpdf2
+    FPDF = None
+
+# TNFD disclosure reports.
+#
+# A report is a list of independent sections (the whole portfolio, one per region,
+# one per supplier tier). Each section's content - metrics, chart data and the
+# lowest-scoring farms - is computed and rendered to an HTML fragment in a worker
+# process; sections are then cached on disk under a hash of the section's own
+# inputs (its cells of the aggregate cube, the id and version of each of its farms,
+# and the history), so a write to one farm only recomputes the sections that farm
+# is in. The finished HTML or PDF is cached under the hash of its section keys and
+# served as a file.
+
+# Bump when the section content or rendering changes, so cached sections are redone
+REPORT_FORMAT = 2
+REPORT_FORMATS = {
+    'html': ('text/html', 'html'),
+    'pdf': ('application/pdf', 'pdf')
+}
+REPORT_SCOPES = {
+    'portfolio': "Portfolio overview",
+    'region': "By region",
+    'supplier_tier': "By supplier tier"
+}
+WORST_FARMS = 10
+# Farm columns a section reads row by row (the rest come from the cube)
+SECTION_COLUMNS = ['id', 'name', 'region', 'supplier_tier', 'overall_score', 'tnfd_compliant']
+SCORE_BANDS = list(range(0, 100, 10))
+CHART_COLORS = ['#10b981', '#3b82f6', '#f59e0b', '#7c3aed']
+
+
+def report_available(fmt):
+    return fmt == 'html' or (fmt in REPORT_FORMATS and FPDF is not None)
+
+
+# Section specs for the chosen scopes, in report order
+def report_sections(dimensions, scopes):
+    sections = []
+    if 'portfolio' in scopes:
+        sections.append({'scope': 'portfolio', 'value': None})
+    for scope in ('region', 'supplier_tier'):
+        if scope in scopes:
+            sections.extend({'scope': scope, 'value': value} for value in dimensions[scope])
+    return sections
+
+
+def _digest(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _section_filters(section):
+    scope, value = section['scope'], section['value']
+    return value if scope == 'region' else 'all', value if scope == 'supplier_tier' else 'all'
+
+
+# Positions of the farms in a section
+def section_positions(df, section):
+    if section['scope'] == 'portfolio':
+        return np.arange(len(df))
+    return np.flatnonzero((df[section['scope']] == section['value']).to_numpy())
+
+
+# A version of every farm row: a hash of the columns sections read from it, which
+# changes whenever an edit touches them
+def row_versions(df):
+    return pd.util.hash_pandas_object(df[SECTION_COLUMNS], index=False).to_numpy()
+
+
+# The cube cells a section's metrics and breakdowns are summed from (the non-empty
+# ones, by their labels)
+def _section_cells(cube, section):
+    mask = cube.cell_mask(*_section_filters(section)) & (cube.measures['count'] > 0)
+    labels = [[cube.dimensions[d][i] for d, i in zip(CUBE_DIMENSIONS, cell)] for cell in np.argwhere(mask)]
+    return {'labels': labels, **{name: cube.measures[name][mask].tolist() for name in sorted(cube.measures)}}
+
+
+def section_key(df, cube, versions, history_key, section):
+    positions = section_positions(df, section)
+    rows = hashlib.sha256(versions[positions].tobytes())
+    return _digest({'format': REPORT_FORMAT, 'history': history_key, 'section': section,
+                    'cells': _section_cells(cube, section), 'rows': rows.hexdigest()})
+
+
+def report_key(section_keys, fmt):
+    return _digest({'format': REPORT_FORMAT, 'sections': section_keys, 'output': fmt})
+
+
+# Content-addressed store of rendered sections: one JSON file per key, written
+# atomically so concurrent jobs on the same host can share it
+class SectionCache:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        tmp_path = f"{self._path(key)}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self._path(key))
+
+
+def _pct(part, whole):
+    return part / whole * 100 if whole else 0.0
+
+
+# Metrics, chart data and lowest-scoring farms of one section
+def section_content(df, cube, history, section):
+    scope, value = section['scope'], section['value']
+    region, tier = _section_filters(section)
+    agg = cube.summary(region, tier)
+    n = agg['count']
+
+    positions = section_positions(df, section)
+    if scope == 'portfolio':
+        title, subtitle = "Supplier Portfolio", "All supplier farms"
+    else:
+        title, subtitle = value, "Region" if scope == 'region' else "Supplier tier"
+
+    metrics = [
+        ["Supplier farms", f"{int(n):,}"],
+        ["TNFD compliance", f"{_pct(agg['compliant'], n):.1f}%"],
+        ["Average overall score", f"{agg['score_sum'] / n if n else 0:.0f}/100"],
+        ["High climate risk", f"{_pct(agg['high_risk'], n):.1f}%"],
+        ["Natural habitat", f"{agg['habitat_ha']:,.0f} ha"],
+        ["Soil health compliance", f"{_pct(agg['soil_ok'], n):.1f}%"],
+        ["Average water efficiency", f"{agg['water_sum'] / n if n else 0:.0f}%"],
+        ["Average biodiversity score", f"{agg['biodiversity_sum'] / n if n else 0:.0f}/100"],
+        ["SFI enrolment", f"{_pct(agg['sfi'], n):.1f}%"],
+        ["CS enrolment", f"{_pct(agg['cs'], n):.1f}%"]
+    ]
+
+    charts = []
+    if scope == 'region':
+        by_tier = agg['by_tier']
+        charts.append({'title': "Farms by supplier tier", 'kind': 'bar', 'unit': '',
+                       'labels': list(by_tier.index), 'values': [int(v) for v in by_tier]})
+    else:
+        by_region = agg['by_region']
+        charts.append({'title': "TNFD compliance by region (%)", 'kind': 'bar', 'unit': '%',
+                       'labels': list(by_region.index),
+                       'values': [round(v, 1) for v in by_region['compliant'] / by_region['count'] * 100]})
+    charts.append({'title': "Farms at each climate risk level", 'kind': 'bar', 'unit': '',
+                   'labels': [f"{kind} {level}" for kind in ('Drought', 'Flood') for level in RISK_LEVELS],
+                   'values': [int(agg[f"by_{kind}"].get(level, 0))
+                              for kind in ('drought', 'flood') for level in RISK_LEVELS]})
+    scores = df['overall_score'].to_numpy()[positions]
+    bands = np.bincount(np.minimum(scores // 10, 9).astype(np.int64), minlength=10)
+    charts.append({'title': "Overall score distribution", 'kind': 'bar', 'unit': '',
+                   'labels': [f"{b}-{b + 9}" for b in SCORE_BANDS], 'values': bands.tolist()})
+    if history is not None:
+        trend = history.trend('month', region, tier)
+        charts.append({'title': "TNFD compliance by month (%)", 'kind': 'line', 'unit': '%',
+                       'labels': list(trend.index),
+                       'values': [None if np.isnan(v) else round(v, 1)
+                                  for v in trend.get('compliance_pct', np.full(len(trend), np.nan))]})
+
+    k = min(WORST_FARMS, len(scores))
+    lowest = np.argpartition(scores, k - 1)[:k] if k else np.array([], dtype=np.int64)
+    worst = positions[lowest[np.argsort(scores[lowest], kind='stable')]]
+    rows = df.iloc[worst]
+    table = {
+        'columns': ["Farm", "ID", "Region", "Tier", "Score", "TNFD"],
+        'rows': [[str(r['name']), str(r['id']), str(r['region']), str(r['supplier_tier']),
+                  int(r['overall_score']), "Yes" if r['tnfd_compliant'] else "No"]
+                 for _, r in rows.iterrows()]
+    }
+    return {'title': title, 'subtitle': subtitle, 'metrics': metrics, 'charts': charts, 'table': table}
+
+
+# Axis label slanted under its bar so long region names do not overlap
+def _svg_label(x, y, label):
+    return (f'<text x="{x:.1f}" y="{y + 8:.1f}" text-anchor="end" transform="rotate(-30 {x:.1f} {y + 8:.1f})">'
+            f'{html.escape(str(label))}</text>')
+
+
+def _svg_chart(chart, width=420, height=240):
+    labels, values = chart['labels'], chart['values']
+    top = max([v for v in values if v is not None] + [1])
+    plot_h = height - 75
+    step = (width - 20) / max(len(labels), 1)
+    parts = [f'<svg width="{width}" height="{height}" viewBox="0 0 {width} {height}" '
+             f'xmlns="http://www.w3.org/2000/svg" font-family="sans-serif" font-size="10">']
+    if chart['kind'] == 'bar':
+        for i, (label, value) in enumerate(zip(labels, values)):
+            bar_h = plot_h * value / top
+            x = 10 + i * step
+            parts.append(f'<rect x="{x + step * 0.15:.1f}" y="{20 + plot_h - bar_h:.1f}" width="{step * 0.7:.1f}" '
+                         f'height="{bar_h:.1f}" fill="{CHART_COLORS[0]}"/>')
+            parts.append(f'<text x="{x + step / 2:.1f}" y="{16 + plot_h - bar_h:.1f}" text-anchor="middle">'
+                         f'{value:,}{chart["unit"]}</text>')
+            parts.append(_svg_label(x + step / 2, 24 + plot_h, label))
+    else:
+        points = [(10 + (i + 0.5) * step, 20 + plot_h - plot_h * v / top)
+                  for i, v in enumerate(values) if v is not None]
+        parts.append(f'<polyline fill="none" stroke="{CHART_COLORS[2]}" stroke-width="2" points="'
+                     + ' '.join(f"{x:.1f},{y:.1f}" for x, y in points) + '"/>')
+        for i, label in enumerate(labels):
+            if i % 2 == 0:
+                parts.append(_svg_label(10 + (i + 0.5) * step, 24 + plot_h, label))
+        if points:
+            parts.append(f'<text x="{points[-1][0]:.1f}" y="{points[-1][1] - 6:.1f}" text-anchor="end">'
+                         f'{values[-1]}{chart["unit"]}</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def section_html(content):
+    metrics = ''.join(f"<tr><th>{html.escape(label)}</th><td>{html.escape(value)}</td></tr>"
+                      for label, value in content['metrics'])
+    charts = ''.join(f"<figure><figcaption>{html.escape(chart['title'])}</figcaption>{_svg_chart(chart)}</figure>"
+                     for chart in content['charts'])
+    head = ''.join(f"<th>{html.escape(c)}</th>" for c in content['table']['columns'])
+    rows = ''.join('<tr>' + ''.join(f"<td>{html.escape(str(v))}</td>" for v in row) + '</tr>'
+                   for row in content['table']['rows'])
+    return (f"<section><h2>{html.escape(content['title'])}</h2><p class=\"subtitle\">"
+            f"{html.escape(content['subtitle'])}</p><table class=\"metrics\">{metrics}</table>"
+            f"<div class=\"charts\">{charts}</div><h3>Lowest-scoring farms</h3>"
+            f"<table class=\"farms\"><tr>{head}</tr>{rows}</table></section>")
+
+
+REPORT_CSS = """
+body { font-family: sans-serif; color: #1f2937; margin: 2rem; }
+h1 { color: #1e40af; } h2 { color: #059669; margin-bottom: 0; }
+.subtitle { color: #6b7280; margin-top: 0.2rem; }
+section { page-break-before: always; }
+table { border-collapse: collapse; margin: 1rem 0; }
+th, td { text-align: left; padding: 0.3rem 0.8rem; border-bottom: 1px solid #e5e7eb; }
+.charts { display: flex; flex-wrap: wrap; gap: 1rem; }
+figure { margin: 0; } figcaption { font-weight: bold; font-size: 0.9rem; }
+"""
+
+
+def render_html(title, generated, sections):
+    body = ''.join(section['html'] for section in sections)
+    return (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title>"
+            f"<style>{REPORT_CSS}</style></head><body><h1>{html.escape(title)}</h1>"
+            f"<p>Generated {generated}</p>{body}</body></html>").encode()
+
+
+def _pdf_text(value):
+    return str(value).encode('latin-1', 'replace').decode('latin-1')
+
+
+# Label shortened to fit under its bar
+def _pdf_fit(pdf, label, width):
+    text = _pdf_text(label)
+    while len(text) > 1 and pdf.get_string_width(text) > width:
+        text = text[:-1]
+    return text
+
+
+def _pdf_chart(pdf, chart, x, y, w, h):
+    labels, values = chart['labels'], chart['values']
+    top = max([v for v in values if v is not None] + [1])
+    plot_h = h - 16
+    step = w / max(len(labels), 1)
+    pdf.set_font('Helvetica', 'B', 8)
+    pdf.text(x, y, _pdf_text(chart['title']))
+    pdf.set_font('Helvetica', '', 6)
+    base = y + 4 + plot_h
+    if chart['kind'] == 'bar':
+        pdf.set_fill_color(16, 185, 129)
+        for i, (label, value) in enumerate(zip(labels, values)):
+            bar_h = plot_h * value / top
+            pdf.rect(x + i * step + step * 0.15, base - bar_h, step * 0.7, bar_h, style='F')
+            pdf.text(x + i * step + step * 0.1, base - bar_h - 1, _pdf_text(f"{value:,}{chart['unit']}"))
+            pdf.text(x + i * step + step * 0.1, base + 4, _pdf_fit(pdf, label, step * 0.9))
+    else:
+        pdf.set_draw_color(245, 158, 11)
+        pdf.set_line_width(0.6)
+        points = [(x + (i + 0.5) * step, base - plot_h * v / top) for i, v in enumerate(values) if v is not None]
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            pdf.line(x0, y0, x1, y1)
+        for i, label in enumerate(labels):
+            if i % 3 == 0:
+                pdf.text(x + i * step, base + 4, _pdf_text(label))
+        pdf.set_line_width(0.2)
+        pdf.set_draw_color(0, 0, 0)
+
+
+def render_pdf(title, generated, sections):
+    pdf = FPDF(format='A4')
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    pdf.set_font('Helvetica', 'B', 20)
+    pdf.cell(0, 12, _pdf_text(title), new_x='LMARGIN', new_y='NEXT')
+    pdf.set_font('Helvetica', '', 10)
+    pdf.cell(0, 8, _pdf_text(f"Generated {generated}"), new_x='LMARGIN', new_y='NEXT')
+
+    for section in sections:
+        content = section['content']
+        pdf.add_page()
+        pdf.set_font('Helvetica', 'B', 16)
+        pdf.cell(0, 10, _pdf_text(content['title']), new_x='LMARGIN', new_y='NEXT')
+        pdf.set_font('Helvetica', '', 9)
+        pdf.cell(0, 6, _pdf_text(content['subtitle']), new_x='LMARGIN', new_y='NEXT')
+        for label, value in content['metrics']:
+            pdf.cell(70, 5, _pdf_text(label))
+            pdf.cell(0, 5, _pdf_text(value), new_x='LMARGIN', new_y='NEXT')
+
+        y = pdf.get_y() + 8
+        for i, chart in enumerate(content['charts']):
+            _pdf_chart(pdf, chart, 10 + (i % 2) * 97, y + (i // 2) * 55, 90, 45)
+        pdf.set_y(y + ((len(content['charts']) + 1) // 2) * 55)
+
+        pdf.set_font('Helvetica', 'B', 9)
+        pdf.cell(0, 6, "Lowest-scoring farms", new_x='LMARGIN', new_y='NEXT')
+        widths = [50, 25, 35, 20, 15, 15]
+        for column, width in zip(content['table']['columns'], widths):
+            pdf.cell(width, 5, _pdf_text(column), border='B')
+        pdf.ln()
+        pdf.set_font('Helvetica', '', 8)
+        for row in content['table']['rows']:
+            for value, width in zip(row, widths):
+                pdf.cell(width, 5, _pdf_text(value))
+            pdf.ln()
+    return bytes(pdf.output())
+
+
+# Worker-side state: set once per pool process from the (forked) parent's table,
+# so the portfolio is never pickled to the workers
+_worker_state = {}
+
+
+def _init_worker(df, cube, history):
+    _worker_state.update(df=df, cube=cube, history=history)
+
+
+def _render_section(section):
+    content = section_content(_worker_state['df'], _worker_state['cube'], _worker_state['history'], section)
+    return {'content': content, 'html': section_html(content)}
+
+
+# Build (or reuse) a report for the chosen scopes and return its file name in
+# `directory`/artifacts plus generation stats. Sections missing from the cache are
+# rendered across `workers` processes; progress(done, total) is called as they
+# complete.
+def build_report(df, cube, history, scopes, fmt, directory, workers=1, progress=None):
+    started = time.perf_counter()
+    history_key = history.meta if history is not None else None
+    sections = report_sections(cube.dimensions, scopes)
+    versions = row_versions(df)
+    keys = [section_key(df, cube, versions, history_key, section) for section in sections]
+    artifacts = os.path.join(directory, 'artifacts')
+    os.makedirs(artifacts, exist_ok=True)
+    name = f"{report_key(keys, fmt)}.{REPORT_FORMATS[fmt][1]}"
+    if os.path.exists(os.path.join(artifacts, name)):
+        return name, {'sections': len(sections), 'rendered': 0, 'seconds': time.perf_counter() - started}
+
+    cache = SectionCache(os.path.join(directory, 'sections'))
+    rendered = {key: cache.get(key) for key in keys}
+    missing = [(key, section) for key, section in zip(keys, sections) if rendered[key] is None]
+    done = len(sections) - len(missing)
+    if progress:
+        progress(done, len(sections))
+
+    def finish(key, result):
+        nonlocal done
+        cache.put(key, result)
+        rendered[key] = result
+        done += 1
+        if progress:
+            progress(done, len(sections))
+
+    if workers > 1 and len(missing) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(workers, len(missing)), mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_worker, initargs=(df, cube, history)) as pool:
+            futures = {pool.submit(_render_section, section): key for key, section in missing}
+            for future in concurrent.futures.as_completed(futures):
+                finish(futures[future], future.result())
+    else:
+        _init_worker(df, cube, history)
+        for key, section in missing:
+            finish(key, _render_section(section))
+
+    title = "TNFD Disclosure Report"
+    generated = datetime.now().strftime('%d/%m/%Y %H:%M')
+    parts = [rendered[key] for key in keys]
+    data = render_pdf(title, generated, parts) if fmt == 'pdf' else render_html(title, generated, parts)
+    tmp_path = os.path.join(artifacts, f"{name}.tmp-{os.getpid()}")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, os.path.join(artifacts, name))
+    return name, {'sections': len(sections), 'rendered': len(missing), 'seconds': time.perf_counter() - started}
@@ -0,0 +1,81 @@
+import json
+import threading
+from collections import OrderedDict
+
+import plotly
+
+
+def normalize_search(search_value):
+    return (search_value or '').strip().casefold()
+
+
+def payload_size(value):
+    return len(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+# Bounded LRU cache for callback results.
+#
+# Entries are keyed on the normalized filter inputs plus the dataset version, so a
+# data change can never serve stale results; invalidate() additionally drops every
+# entry from older versions to free their memory. Both the entry count and the
+# total serialized size of the stored values are capped.
+class ResultCache:
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        size = payload_size(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    # Drop entries whose key does not end with the current dataset version
+    def invalidate(self, version=None):
+        with self._lock:
+            stale = [key for key in self._entries if version is None or key[-1] != version]
+            for key in stale:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
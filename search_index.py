@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+# Columns the search box matches against
+SEARCH_COLUMNS = ('name', 'id')
+
+
+def _trigram_codes(values):
+    # Pack every 3-byte window of the UTF-8 encoded values into one int, vectorized
+    # over a (n_values, width) byte matrix. Windows running past a value's end are
+    # returned as -1.
+    raw = np.array([v.encode('utf-8') for v in values], dtype='S')
+    width = raw.dtype.itemsize
+    if width < 3:
+        return np.full((len(values), 0), -1, dtype=np.int64)
+    matrix = raw.view(np.uint8).reshape(len(values), width).astype(np.int64)
+    lengths = (matrix != 0).sum(axis=1)
+    codes = (matrix[:, :-2] << 16) | (matrix[:, 1:-1] << 8) | matrix[:, 2:]
+    codes[np.arange(width - 2)[None, :] + 3 > lengths[:, None]] = -1
+    return codes
+
+
+def _sorted_unique(values):
+    # Sort-and-diff dedupe; np.unique is several times slower on large int arrays
+    values = np.sort(values)
+    keep = np.ones(len(values), dtype=bool)
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+def _query_trigrams(query):
+    data = query.encode('utf-8')
+    return {(data[i] << 16) | (data[i + 1] << 8) | data[i + 2] for i in range(len(data) - 2)}
+
+
+# Case-folded trigram index over one text column.
+#
+# Postings are kept per distinct value rather than per row (farm names repeat
+# heavily), in CSR form: sorted trigram keys, offsets, and value ids. A second CSR
+# maps each distinct value back to its rows, so a query costs the posting list
+# intersection plus the size of its result, not a scan of the portfolio.
+class _ColumnSearchIndex:
+    def __init__(self, series):
+        codes, uniques = pd.factorize(series.astype(str).str.casefold())
+        self.values = np.asarray(uniques, dtype=object)
+
+        # value id -> rows
+        order = np.argsort(codes, kind='stable')
+        self.value_rows = order
+        self.value_offsets = np.searchsorted(codes[order], np.arange(len(self.values) + 1))
+
+        # trigram -> value ids
+        trigrams = _trigram_codes(self.values)
+        value_ids = np.broadcast_to(np.arange(len(self.values))[:, None], trigrams.shape)
+        valid = trigrams >= 0
+        pairs = _sorted_unique((trigrams[valid] << 32) | value_ids[valid])
+        keys = pairs >> 32
+        self.postings = pairs & 0xFFFFFFFF
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        self.keys = keys[starts]
+        self.offsets = np.append(starts, len(pairs))
+
+    def _posting(self, trigram):
+        i = np.searchsorted(self.keys, trigram)
+        if i == len(self.keys) or self.keys[i] != trigram:
+            return self.postings[:0]
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def matching_values(self, query):
+        n_bytes = len(query.encode('utf-8'))
+        if n_bytes < 3:
+            candidates = np.arange(len(self.values))
+        else:
+            lists = sorted((self._posting(t) for t in _query_trigrams(query)), key=len)
+            candidates = lists[0]
+            for posting in lists[1:]:
+                if not len(candidates):
+                    break
+                candidates = np.intersect1d(candidates, posting, assume_unique=True)
+            if n_bytes == 3:
+                return candidates
+        if not len(candidates):
+            return candidates
+        hits = pd.Series(self.values[candidates]).str.contains(query, regex=False).to_numpy()
+        return candidates[hits]
+
+    def rows(self, value_ids):
+        # Concatenate the row ranges of the matched values without a Python loop
+        starts = self.value_offsets[value_ids]
+        lengths = self.value_offsets[value_ids + 1] - starts
+        shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return self.value_rows[shifts + np.arange(lengths.sum())]
+
+
+# Substring search over farm names and IDs for the search box.
+#
+# Rows added or edited after the index was built are kept in a small delta that is
+# scanned directly; their stale postings are masked out. Callers rebuild the index
+# once the delta grows past needs_rebuild().
+class SearchIndex:
+    def __init__(self, df, columns=SEARCH_COLUMNS):
+        self.columns = {column: _ColumnSearchIndex(df[column]) for column in columns}
+        self.n_indexed = len(df)
+        self.delta = {}
+
+    # Record the current searchable text of an added or edited row
+    def set_row(self, position, row):
+        self.delta[position] = tuple(str(row[column]).casefold() for column in self.columns)
+
+    def needs_rebuild(self):
+        return len(self.delta) > max(1000, self.n_indexed // 100)
+
+    # Sorted row positions whose name or id contains the query, ignoring case
+    def positions(self, query):
+        query = query.casefold()
+        matches = [index.rows(index.matching_values(query)) for index in self.columns.values()]
+        positions = _sorted_unique(np.concatenate(matches))
+        if not self.delta:
+            return positions
+        changed = np.fromiter(self.delta, dtype=np.int64, count=len(self.delta))
+        hits = [p for p, texts in self.delta.items() if any(query in t for t in texts)]
+        positions = positions[~np.isin(positions, changed)]
+        return _sorted_unique(np.concatenate([positions, np.asarray(hits, dtype=np.int64)]))
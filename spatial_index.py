@@ -0,0 +1,171 @@
+import math
+
+import numpy as np
+
+# Finest zoom level of the grid: web-map tiles of about 3 km across at UK latitudes
+MAX_LEVEL = 13
+# Tiles are aggregated this many zoom levels below the map zoom (256 px map tiles
+# split into 32 px cells)
+TILE_DETAIL = 3
+DEFAULT_MAX_TILES = 4096
+DEFAULT_MAX_POINTS = 1000
+# Per-tile sums kept by the pyramid
+TILE_MEASURES = ('count', 'score_sum', 'compliant', 'lat_sum', 'lon_sum')
+
+
+# Web-map (Web Mercator) tile coordinates of points at a zoom level
+def tile_xy(latitude, longitude, level=MAX_LEVEL):
+    scale = 2 ** level
+    lat = np.radians(np.clip(np.asarray(latitude, dtype=np.float64), -85.05, 85.05))
+    x = (np.asarray(longitude, dtype=np.float64) + 180) / 360 * scale
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * scale
+    return (np.clip(x, 0, scale - 1).astype(np.uint32),
+            np.clip(y, 0, scale - 1).astype(np.uint32))
+
+
+def _tile_codes(x, y, level):
+    return (y.astype(np.int64) << level) | x.astype(np.int64)
+
+
+# Per-farm values summed into the tiles, for all rows or a row selection
+def _farm_measures(df, positions=None):
+    def column(name):
+        values = df[name].to_numpy()
+        return (values if positions is None else values[positions]).astype(np.float64)
+    return {
+        'count': np.ones(len(df) if positions is None else len(positions)),
+        'score_sum': column('overall_score'),
+        'compliant': column('tnfd_compliant'),
+        'lat_sum': column('latitude'),
+        'lon_sum': column('longitude')
+    }
+
+
+# Uniform-grid spatial index over the farm coordinates.
+#
+# Every farm is assigned to its web-map tile at MAX_LEVEL once, and a pyramid of
+# per-tile sums (count, score, compliance and coordinates) is built for every zoom
+# level from 0 to MAX_LEVEL, each level a sorted array of occupied tile codes. A
+# map viewport is answered at the zoom level that keeps its tile count bounded by
+# slicing one level, so panning across 1M farms never touches the farms
+# themselves. Filtered selections are aggregated on the fly from the per-farm tile
+# coordinates, which costs one pass over the selected rows.
+#
+# Appends and edits adjust the pyramid tile by tile, like the aggregate cube.
+class SpatialGridIndex:
+    def __init__(self, df):
+        x, y = tile_xy(df['latitude'].to_numpy(), df['longitude'].to_numpy())
+        self.n_rows = len(df)
+        self._x = x
+        self._y = y
+        # Farms are grouped once at the finest level; each coarser level groups the
+        # tiles of the finest one
+        finest = self._group(_tile_codes(x, y, MAX_LEVEL), _farm_measures(df))
+        tile_x = finest['code'] & ((1 << MAX_LEVEL) - 1)
+        tile_y = finest['code'] >> MAX_LEVEL
+        self.levels = []
+        for level in range(MAX_LEVEL):
+            shift = MAX_LEVEL - level
+            sums = {name: finest[name] for name in TILE_MEASURES}
+            self.levels.append(self._group(_tile_codes(tile_x >> shift, tile_y >> shift, level), sums))
+        self.levels.append(finest)
+
+    @staticmethod
+    def _group(codes, measures):
+        codes, inverse = np.unique(codes, return_inverse=True)
+        sums = {name: np.bincount(inverse, weights=values, minlength=len(codes))
+                for name, values in measures.items()}
+        return dict(sums, code=codes)
+
+    # Farm tile coordinates at MAX_LEVEL (rows appended after the build included)
+    def farm_tiles(self, positions=None):
+        if positions is None:
+            return self._x[:self.n_rows], self._y[:self.n_rows]
+        return self._x[positions], self._y[positions]
+
+    def _reserve(self, n_rows):
+        if n_rows <= len(self._x):
+            return
+        capacity = max(n_rows, 2 * len(self._x))
+        for name in ('_x', '_y'):
+            values = getattr(self, name)
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[:len(values)] = values
+            setattr(self, name, grown)
+
+    def _add_to_pyramid(self, x, y, measures, sign):
+        for level, tiles in enumerate(self.levels):
+            shift = MAX_LEVEL - level
+            code = int(_tile_codes(np.uint32(x >> shift), np.uint32(y >> shift), level))
+            i = int(np.searchsorted(tiles['code'], code))
+            if i == len(tiles['code']) or tiles['code'][i] != code:
+                for name in TILE_MEASURES:
+                    tiles[name] = np.insert(tiles[name], i, 0.0)
+                tiles['code'] = np.insert(tiles['code'], i, code)
+            for name in TILE_MEASURES:
+                tiles[name][i] += sign * measures[name]
+
+    # Add the farms of a frame (the rows appended to the table, in order)
+    def append(self, df):
+        x, y = tile_xy(df['latitude'].to_numpy(), df['longitude'].to_numpy())
+        self._reserve(self.n_rows + len(df))
+        self._x[self.n_rows:self.n_rows + len(df)] = x
+        self._y[self.n_rows:self.n_rows + len(df)] = y
+        self.n_rows += len(df)
+        measures = _farm_measures(df)
+        for i in range(len(df)):
+            self._add_to_pyramid(x[i], y[i], {name: values[i] for name, values in measures.items()}, 1)
+
+    # Replace a farm's contribution: old_df / new_df are one-row frames
+    def update(self, position, old_df, new_df):
+        for row_df, sign in ((old_df, -1), (new_df, 1)):
+            x, y = tile_xy(row_df['latitude'].to_numpy(), row_df['longitude'].to_numpy())
+            measures = {name: values[0] for name, values in _farm_measures(row_df).items()}
+            self._add_to_pyramid(x[0], y[0], measures, sign)
+        # x, y are the new row's tile after the loop
+        self._x[position] = x[0]
+        self._y[position] = y[0]
+
+    # Tile range of a (west, south, east, north) viewport at the coarsest level at
+    # or below the requested one whose range holds at most max_tiles tiles
+    def _tile_range(self, bounds, level, max_tiles):
+        west, south, east, north = bounds
+        while True:
+            x0, y0 = tile_xy([north], [west], level)
+            x1, y1 = tile_xy([south], [east], level)
+            x0, y0, x1, y1 = int(x0[0]), int(y0[0]), int(x1[0]), int(y1[0])
+            if level == 0 or (x1 - x0 + 1) * (y1 - y0 + 1) <= max_tiles:
+                return level, x0, y0, x1, y1
+            level -= 1
+
+    # Aggregated tiles of a viewport for a map zoom level. With positions (a row
+    # selection) only those farms are counted. Returns the level used and the
+    # occupied tiles' codes and sums.
+    def tiles(self, df, bounds, zoom, positions=None, max_tiles=DEFAULT_MAX_TILES):
+        level = int(min(max(math.floor(zoom) + TILE_DETAIL, 0), MAX_LEVEL))
+        level, x0, y0, x1, y1 = self._tile_range(bounds, level, max_tiles)
+        shift = MAX_LEVEL - level
+
+        if positions is None:
+            tiles = self.levels[level]
+            x = tiles['code'] & ((1 << level) - 1)
+            y = tiles['code'] >> level
+            # Tiles emptied by edits stay in the pyramid with a zero count
+            inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1) & (tiles['count'] > 0)
+            return level, {name: values[inside] for name, values in tiles.items()}
+
+        fx, fy = self.farm_tiles(positions)
+        x = fx >> shift
+        y = fy >> shift
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        return level, self._group(_tile_codes(x[inside], y[inside], level),
+                                  _farm_measures(df, positions[inside]))
+
+    # Row positions of the farms inside a viewport, optionally within a selection
+    def positions_in(self, bounds, positions=None):
+        level, x0, y0, x1, y1 = self._tile_range(bounds, MAX_LEVEL, float('inf'))
+        fx, fy = self.farm_tiles(positions)
+        inside = (fx >= x0) & (fx <= x1) & (fy >= y0) & (fy <= y1)
+        if positions is None:
+            return np.flatnonzero(inside)
+        return positions[inside]
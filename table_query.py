@@ -0,0 +1,211 @@
+import bisect
+import re
+
+import numpy as np
+import pandas as pd
+
+# One `{column} operator value` term of a DataTable filter_query. Operators may carry
+# the DataTable's case prefix (i/s), e.g. `icontains` or `s>=`.
+FILTER_TERM = re.compile(
+    r"^\{(?P<column>[^}]+)\}\s*(?P<case>[is]?)(?P<operator>>=|<=|!=|=|<|>|eq|ne|lt|le|gt|ge|contains|datestartswith)\s*(?P<value>.*)$"
+)
+OPERATOR_ALIASES = {'=': 'eq', '!=': 'ne', '<': 'lt', '<=': 'le', '>': 'gt', '>=': 'ge'}
+TRUE_VALUES = {'true', '1', 'yes', 'y', '✓'}
+# Range of the integer sort keys of text values
+SORT_KEY_LIMIT = 1 << 62
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"`':
+        value = value[1:-1].replace('\\' + value[0], value[0])
+    return value
+
+
+# Split a DataTable filter_query into (column, operator, value, case_sensitive) terms.
+# Terms the table can emit but we cannot evaluate (e.g. `is blank`) are skipped.
+def parse_filter_query(filter_query):
+    terms = []
+    for part in (filter_query or '').split(' && '):
+        match = FILTER_TERM.match(part.strip())
+        if match is None:
+            continue
+        operator = OPERATOR_ALIASES.get(match['operator'], match['operator'])
+        terms.append((match['column'], operator, _unquote(match['value']), match['case'] != 'i'))
+    return terms
+
+
+# Sort keys of a text or categorical column: every distinct value gets an integer
+# key in value order, spread evenly over SORT_KEY_LIMIT (missing values -1, sorting
+# first). A row set to a value not seen before is keyed halfway between its
+# neighbours, or one gap past the last value, so a write updates one key instead of
+# re-ranking the column; the keys are only rebuilt once a gap is used up. The
+# per-row keys have spare capacity for appended rows.
+class _SortKeys:
+    def __init__(self, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            labels = np.asarray(series.cat.categories, dtype=str)
+            order = np.argsort(labels, kind='stable')
+            self.values = labels[order].tolist()
+            ranks = np.empty(len(labels), dtype=np.int64)
+            ranks[order] = np.arange(len(labels))
+            codes = np.append(ranks, -1)[series.cat.codes.to_numpy()]
+        else:
+            codes, uniques = pd.factorize(series, sort=True)
+            self.values = [str(value) for value in uniques]
+        self.gap = SORT_KEY_LIMIT // (len(self.values) + 2)
+        self.value_keys = [(i + 1) * self.gap for i in range(len(self.values))]
+        self.n_rows = len(codes)
+        self._keys = np.where(codes >= 0, (codes.astype(np.int64) + 1) * self.gap, -1)
+
+    @property
+    def keys(self):
+        return self._keys[:self.n_rows]
+
+    # The key of a value, placing a new one between its neighbours (None when there
+    # is no room left)
+    def _key(self, value):
+        if pd.isna(value):
+            return -1
+        value = str(value)
+        i = bisect.bisect_left(self.values, value)
+        if i < len(self.values) and self.values[i] == value:
+            return self.value_keys[i]
+        low = self.value_keys[i - 1] if i else 0
+        if i < len(self.values):
+            key = (low + self.value_keys[i]) // 2
+        else:
+            key = low + self.gap
+        if key == low or key >= 2 * SORT_KEY_LIMIT:
+            return None
+        self.values.insert(i, value)
+        self.value_keys.insert(i, key)
+        return key
+
+    # Key one row (an edited row, or the next appended one); False when the column
+    # has to be re-keyed
+    def set_row(self, position, value):
+        key = self._key(value)
+        if key is None:
+            return False
+        if position >= len(self._keys):
+            grow = max(position + 1 - len(self._keys), len(self._keys) // 8, 1024)
+            self._keys = np.concatenate([self._keys, np.zeros(grow, dtype=np.int64)])
+        self._keys[position] = key
+        self.n_rows = max(self.n_rows, position + 1)
+        return True
+
+
+# Server-side filter / sort / page over the in-process farm frame.
+#
+# Queries work on row positions so a page never materializes more than its own rows.
+# String predicates on categorical columns are evaluated once per category and
+# broadcast through the codes. Numeric and boolean columns sort on their own values;
+# text and categorical columns on integer keys cached per column, which set_row()
+# keeps current as rows are added and edited.
+class TableQuery:
+    def __init__(self, df):
+        self.df = df
+        self._keys = {}
+
+    # Point at a different frame; cached sort keys are rebuilt on demand
+    def reset(self, df):
+        self.df = df
+        self._keys = {}
+
+    # Point at the frame after the row at position was added or changed, updating
+    # the cached sort keys for just that row
+    def set_row(self, df, position):
+        self.df = df
+        row = df.iloc[position] if self._keys else None
+        for column, keys in list(self._keys.items()):
+            if not keys.set_row(position, row[column]):
+                del self._keys[column]
+
+    def _match_strings(self, values, operator, value, case_sensitive):
+        values = pd.Series(values, dtype=object).astype(str)
+        if not case_sensitive:
+            values = values.str.casefold()
+            value = value.casefold()
+        if operator == 'contains':
+            return values.str.contains(value, regex=False).to_numpy()
+        if operator == 'datestartswith':
+            return values.str.startswith(value).to_numpy()
+        compare = {'eq': np.equal, 'ne': np.not_equal, 'lt': np.less, 'le': np.less_equal,
+                   'gt': np.greater, 'ge': np.greater_equal}[operator]
+        return compare(values.to_numpy(), value)
+
+    def _predicate(self, column, positions, operator, value, case_sensitive):
+        series = self.df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()[positions]
+            matches = self._match_strings(series.cat.categories, operator, value, case_sensitive)
+            return np.append(matches, False)[codes]
+        values = series.to_numpy()[positions]
+        if series.dtype == bool:
+            target = value.strip().casefold() in TRUE_VALUES
+            return values == target if operator != 'ne' else values != target
+        if np.issubdtype(series.dtype, np.number):
+            if operator == 'contains':
+                return self._match_strings(values, operator, value, case_sensitive)
+            try:
+                number = float(value)
+            except ValueError:
+                return np.zeros(len(values), dtype=bool)
+            compare = {'eq': np.equal, 'ne': np.not_equal, 'lt': np.less, 'le': np.less_equal,
+                       'gt': np.greater, 'ge': np.greater_equal,
+                       'datestartswith': np.equal}[operator]
+            return compare(values, number)
+        return self._match_strings(values, operator, value, case_sensitive)
+
+    def filter(self, positions, filter_query):
+        for column, operator, value, case_sensitive in parse_filter_query(filter_query):
+            if column not in self.df.columns:
+                continue
+            positions = positions[self._predicate(column, positions, operator, value, case_sensitive)]
+        return positions
+
+    def _rank(self, column):
+        series = self.df[column]
+        if not isinstance(series.dtype, pd.CategoricalDtype) and (
+                series.dtype == bool or np.issubdtype(series.dtype, np.number)):
+            return series.to_numpy()
+        if column not in self._keys:
+            self._keys[column] = _SortKeys(series)
+        return self._keys[column].keys
+
+    def sort(self, positions, sort_by):
+        keys = []
+        for spec in reversed(sort_by or []):
+            if spec['column_id'] not in self.df.columns:
+                continue
+            rank = self._rank(spec['column_id'])[positions]
+            rank = rank.astype(np.int64 if rank.dtype.kind in 'biu' else np.float64)
+            keys.append(-rank if spec['direction'] == 'desc' else rank)
+        if not keys:
+            return positions
+        return positions[np.lexsort(keys)]
+
+    # Positions of a row selection in ascending column order with their sort keys,
+    # for keyset pagination with page_after()
+    def keyset(self, positions, column):
+        if positions is None:
+            positions = np.arange(len(self.df))
+        rank = self._rank(column)
+        ordered = positions[np.argsort(rank[positions], kind='stable')]
+        return ordered, rank[ordered]
+
+    # The next `limit` positions of a keyset after the row at after_position (None =
+    # the first page): a binary search on the sort keys, however deep the page
+    def page_after(self, keyset, column, after_position=None, limit=50):
+        ordered, keys = keyset
+        start = 0
+        if after_position is not None:
+            start = int(np.searchsorted(keys, self._rank(column)[after_position], side='right'))
+        return ordered[start:start + limit]
+
+    # Filtered and sorted positions for a row selection (None = every row)
+    def query(self, positions, filter_query=None, sort_by=None):
+        if positions is None:
+            positions = np.arange(len(self.df))
+        return self.sort(self.filter(positions, filter_query), sort_by)
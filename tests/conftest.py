@@ -0,0 +1,28 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# The Dash app over a small seeded portfolio, imported once per test session (the
+# app builds its farm table at import time from the environment)
+@pytest.fixture(scope='session')
+def app_module():
+    env = {'FARM_COUNT': '400', 'FARM_SEED': '7', 'HISTORY_MONTHS': '0', 'FARM_BACKEND': 'pandas'}
+    saved = {name: os.environ.get(name) for name in
+             list(env) + ['FARM_DATA_DIR', 'FARM_INGEST_DIR', 'FARM_JOURNAL_PATH', 'FARM_SQLITE_PATH']}
+    for name in saved:
+        os.environ.pop(name, None)
+    os.environ.update(env)
+    try:
+        yield importlib.import_module('app')
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
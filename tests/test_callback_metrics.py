@@ -0,0 +1,58 @@
+import dash
+import pytest
+from dash import Input, Output, dcc, html
+
+from callback_metrics import CallbackMetrics
+
+
+def make_app(token=None):
+    app = dash.Dash(__name__)
+    app.layout = html.Div([dcc.Input(id='text'), html.Div(id='echo'), html.Div(id='length')])
+    metrics = CallbackMetrics(enabled=True, token=token)
+
+    @app.callback(Output('echo', 'children'), Input('text', 'value'))
+    @metrics.observe
+    def echo_text(value):
+        with metrics.phase('render'):
+            return value
+
+    @app.callback(Output('length', 'children'), Input('text', 'value'))
+    def text_length(value):
+        return len(value or '')
+
+    metrics.init_app(app)
+    return app
+
+
+def dispatch(client, output):
+    return client.post('/_dash-update-component', json={
+        'output': output, 'outputs': {'id': output.split('.')[0], 'property': 'children'},
+        'inputs': [{'id': 'text', 'property': 'value', 'value': 'hello'}], 'changedPropIds': ['text.value']
+    })
+
+
+def test_callbacks_are_timed_and_named():
+    client = make_app().server.test_client()
+    response = dispatch(client, 'echo.children')
+    assert response.status_code == 200
+    assert 'render;dur=' in response.headers['Server-Timing']
+    assert 'serialize;dur=' in response.headers['Server-Timing']
+    dispatch(client, 'length.children')
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'dash_callback_requests_total{callback="echo_text",status="200"} 1' in text
+    # Not observed: named after the callback function behind its output
+    assert 'dash_callback_requests_total{callback="text_length",status="200"} 1' in text
+
+
+def test_metrics_without_token_are_local_only():
+    client = make_app().server.test_client()
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '10.1.2.3'}).status_code == 403
+
+
+@pytest.mark.parametrize('header, status', [(None, 401), ('Bearer wrong', 401), ('Bearer s3cret', 200)])
+def test_metrics_token(header, status):
+    client = make_app(token='s3cret').server.test_client()
+    headers = {'Authorization': header} if header else {}
+    assert client.get('/metrics', headers=headers, environ_base={'REMOTE_ADDR': '10.1.2.3'}).status_code == status
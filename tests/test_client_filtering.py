@@ -0,0 +1,69 @@
+import itertools
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from client_filtering import client_payload
+from conftest import ROOT
+from live_store import LiveFarmStore
+
+NODE = shutil.which('node')
+
+# Loads the clientside module and answers each case with the dashboard's farm count
+# and the ids of the table rows
+RUNNER = """
+globalThis.window = globalThis;
+window.dash_clientside = {no_update: null};
+require(process.argv[1]);
+const {payload, cases} = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const figure = (...xs) => ({data: xs.map(x => ({x: x})), layout: {}});
+const levels = ['Low', 'Medium', 'High'];
+const results = cases.map(([search, region, tier, risk]) => {
+    const outputs = window.dash_clientside.farms.updateDashboard(
+        payload, search, region, tier, risk, figure([], [], []), figure(levels, levels), figure([]), figure([]));
+    return {count: Number(outputs[0]), ids: outputs[15].map(row => row.id)};
+});
+process.stdout.write(JSON.stringify(results));
+"""
+
+
+def run_clientside(payload, cases):
+    output = subprocess.run(
+        [NODE, '-e', RUNNER, os.path.join(ROOT, 'assets', 'dashboard_clientside.js')],
+        input=json.dumps({'payload': payload, 'cases': cases}), capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output)
+
+
+@pytest.mark.skipif(NODE is None, reason="needs node to run the clientside callbacks")
+def test_clientside_selection_matches_server(app_module, monkeypatch):
+    # The farms added here go into a store of the test's own, so they neither reach
+    # the app's shared store and journal nor leak into later tests
+    store = LiveFarmStore(app_module.live_store.df.to_frame())
+    monkeypatch.setattr(app_module, 'live_store', store)
+    record = {k: v for k, v in store.get_farm(store.df['id'].iloc[0]).items() if k not in ('id', 'last_updated')}
+    store.add_farm(dict(record, name='Großmann Straße Farm'))
+    store.add_farm(dict(record, name='ΣΟΦΊΑ Farm'))
+
+    df = store.df
+    searches = [None, '', '   ', 'oak', ' HILL ', 'farm_00', 'strasse', 'STRAẞE', 'σοφία', 'zzz']
+    regions = [None, 'all', df['region'].iloc[0], 'Atlantis']
+    tiers = [None, 'all', df['supplier_tier'].iloc[0]]
+    risks = [None, 'all', 'High']
+    cases = [list(case) for case in itertools.product(searches, regions, tiers, risks)]
+
+    results = run_clientside(client_payload(df), cases)
+    for case, result in zip(cases, results):
+        selection = app_module.compute_selection(app_module.normalize_search(case[0]), *case[1:])
+        positions = selection['positions']
+        ids = df['id'].tolist() if positions is None else df['id'].iloc[positions].tolist()
+        assert result['count'] == int(selection['agg']['count']), case
+        assert sorted(result['ids']) == sorted(ids), case
+    # The folded searches found the added farms, and cleared dropdowns nothing
+    assert results[cases.index(['strasse', 'all', 'all', 'all'])]['count'] == 1
+    assert results[cases.index(['STRAẞE', 'all', 'all', 'all'])]['count'] == 1
+    assert results[cases.index(['σοφία', 'all', 'all', 'all'])]['count'] == 1
+    assert results[cases.index([None, None, 'all', 'all'])]['count'] == 0
@@ -0,0 +1,116 @@
+import pandas as pd
+import pytest
+
+from farm_data import generate_farm_data
+import farm_ingest
+from farm_ingest import FarmFileIngestor, ingest_file
+
+
+@pytest.fixture
+def farms():
+    return generate_farm_data(n_farms=6, seed=3).drop(columns=['latitude', 'longitude'])
+
+
+def write_drop(path, farms):
+    farms.to_csv(path, index=False)
+    return str(path)
+
+
+def reasons(rejects):
+    return [] if rejects is None else list(zip(rejects['row'], rejects['column'], rejects['reason']))
+
+
+def test_valid_drop_loads_every_farm(tmp_path, farms):
+    loaded, rejects = ingest_file(write_drop(tmp_path / 'drop.csv', farms))
+    assert rejects is None
+    assert loaded['id'].tolist() == farms['id'].tolist()
+    assert list(loaded.index) == [1, 2, 3, 4, 5, 6]
+
+
+@pytest.mark.parametrize('chunk_rows', [100, 1])
+def test_rejected_row_does_not_claim_its_id(tmp_path, farms, chunk_rows):
+    farms.loc[1, 'id'] = farms.loc[0, 'id']
+    farms.loc[0, 'size'] = -5
+    loaded, rejects = ingest_file(write_drop(tmp_path / 'drop.csv', farms), chunk_rows=chunk_rows)
+    assert reasons(rejects) == [(1, 'size', 'must be between 1 and 10000')]
+    assert loaded['id'].tolist() == farms['id'].iloc[1:].tolist()
+
+
+@pytest.mark.parametrize('chunk_rows', [100, 2])
+def test_later_valid_duplicate_is_rejected(tmp_path, farms, chunk_rows):
+    farms.loc[4, 'id'] = farms.loc[1, 'id']
+    loaded, rejects = ingest_file(write_drop(tmp_path / 'drop.csv', farms), chunk_rows=chunk_rows)
+    assert reasons(rejects) == [(5, 'id', 'duplicate farm id')]
+    assert len(loaded) == 5 and loaded['id'].is_unique
+
+
+def test_blank_ids_are_reported_once(tmp_path, farms):
+    farms.loc[[2, 3], 'id'] = ''
+    loaded, rejects = ingest_file(write_drop(tmp_path / 'drop.csv', farms))
+    assert reasons(rejects) == [(3, 'id', 'must not be empty'), (4, 'id', 'must not be empty')]
+    assert len(loaded) == 4
+
+
+def test_bad_values_are_rejected_per_column(tmp_path, farms):
+    farms = farms.astype(str)
+    farms.loc[0, 'region'] = 'Atlantis'
+    farms.loc[1, 'tnfd_compliant'] = 'maybe'
+    farms.loc[2, 'herd_size'] = '12.5'
+    loaded, rejects = ingest_file(write_drop(tmp_path / 'drop.csv', farms))
+    assert [(row, column) for row, column, _ in reasons(rejects)] == [
+        (1, 'region'), (2, 'tnfd_compliant'), (3, 'herd_size')]
+    assert loaded['id'].tolist() == farms['id'].iloc[3:].tolist()
+
+
+def test_missing_required_column_fails_the_file(tmp_path, farms):
+    with pytest.raises(ValueError, match='missing columns: region'):
+        ingest_file(write_drop(tmp_path / 'drop.csv', farms.drop(columns=['region'])))
+
+
+def test_ingestor_keeps_first_file_on_cross_file_duplicates(tmp_path, farms):
+    write_drop(tmp_path / 'a.csv', farms.iloc[:4])
+    write_drop(tmp_path / 'b.csv', farms.iloc[3:])
+    ingestor = FarmFileIngestor(str(tmp_path))
+    assert ingestor.scan()
+    table = ingestor.table()
+    assert table['id'].tolist() == farms['id'].tolist()
+    assert reasons(ingestor.rejects()) == [(1, 'id', "duplicate farm id (first seen in a.csv)")]
+    assert not ingestor.scan()
+
+    farms.loc[5, 'size'] = 0
+    write_drop(tmp_path / 'b.csv', farms.iloc[3:])
+    assert ingestor.scan()
+    assert ingestor.table()['id'].tolist() == farms['id'].iloc[:5].tolist()
+    assert ingestor.table().attrs['dataset_version'] != table.attrs['dataset_version']
+
+
+# A changed file is parsed once into the cache; changes() reports just the farms
+# that differ from the earlier state of the drop
+def test_changes_against_the_cached_drop(tmp_path, farms, monkeypatch):
+    drops, cache = tmp_path / 'drops', str(tmp_path / 'cache')
+    drops.mkdir()
+    write_drop(drops / 'a.csv', farms.iloc[:3])
+    write_drop(drops / 'b.csv', farms.iloc[3:])
+    ingestor = FarmFileIngestor(str(drops), cache_dir=cache)
+    ingestor.scan()
+    before = ingestor.files()
+    reader = FarmFileIngestor(str(drops), cache_dir=cache)
+    monkeypatch.setattr(farm_ingest, 'ingest_file', None)
+    assert reader.scan()
+    assert reader.table()['latitude'].tolist() == ingestor.table()['latitude'].tolist()
+    monkeypatch.undo()
+
+    farms.loc[4, 'overall_score'] = 12
+    farms.loc[6] = farms.loc[5].copy()
+    farms.loc[6, 'id'] = 'FARM_NEW'
+    write_drop(drops / 'b.csv', farms.iloc[3:])
+    assert ingestor.scan()
+    rows, removed = ingestor.changes(before)
+    assert rows['id'].tolist() == [farms.loc[4, 'id'], 'FARM_NEW']
+    assert removed == []
+
+    after = ingestor.files()
+    write_drop(drops / 'a.csv', farms.iloc[:2])
+    ingestor.scan()
+    rows, removed = ingestor.changes(after)
+    assert not len(rows) and removed == [farms.loc[2, 'id']]
@@ -0,0 +1,82 @@
+import itertools
+
+import pytest
+
+from farm_data import generate_farm_data
+from farm_schema import apply_farm_schema
+from farm_sqlite import SqliteFarmStore, load_or_build_farm_sqlite, write_farm_sqlite
+from live_store import LiveFarmStore
+
+
+def farm_table(n_farms=300, seed=5):
+    df = apply_farm_schema(generate_farm_data(n_farms=n_farms, seed=seed))
+    df.attrs['dataset_version'] = 'base-1'
+    return df
+
+
+# A store and database of the module's own, so the farms added here stay out of
+# other tests
+@pytest.fixture(scope='module')
+def stores(tmp_path_factory):
+    store = LiveFarmStore(farm_table())
+    record = {k: v for k, v in store.get_farm(store.df['id'].iloc[0]).items() if k not in ('id', 'last_updated')}
+    for name in ('Weißenburg Hof', 'WEISSE Wiese', 'ÉCOLE Farm', 'Ωmega Dairy', '50%_Farm'):
+        store.add_farm(dict(record, name=name))
+    path = str(tmp_path_factory.mktemp('sqlite') / 'farms.sqlite')
+    write_farm_sqlite(store.df, path)
+    return store, SqliteFarmStore(path)
+
+
+# The SQLite backend selects the same farms as the in-memory search and bitmap
+# indexes, for short (scanned) and long (trigram) queries, ASCII or not
+def test_sqlite_search_matches_pandas(stores):
+    store, sql = stores
+    df = store.df
+    searches = ['', 'oak', ' HILL ', 'farm_00', 'ß', 'ss', 'SS', 'weiß', 'WEISS', 'weisse',
+                'é', 'École', 'ω', 'ΩMEGA', '%', '_', '50%_', 'zzz']
+    regions = ['all', df['region'].iloc[0]]
+    risks = ['all', 'High']
+    for search, region, risk in itertools.product(searches, regions, risks):
+        query = search.strip().casefold()
+        expected = store.index.positions(region, 'all', risk)
+        if query:
+            expected = store.index.restrict(store.index.filter_bitmap(region, 'all', risk),
+                                            store.search_index.positions(query))
+        positions = sql.positions(search, region, 'all', risk)
+        if expected is None:
+            assert positions is None
+            continue
+        assert sorted(positions.tolist()) == sorted(expected.tolist()), (search, region, risk)
+        summary = sql.summary(search=search, region=region, risk=risk)
+        assert int(summary['count']) == len(expected), (search, region, risk)
+
+
+# Farms added and edited through the live store reach the database through its
+# journal, so the SQL path answers like indexes rebuilt from the written table
+def test_journalled_writes_reach_sqlite(tmp_path):
+    df = farm_table(n_farms=200)
+    journal = str(tmp_path / 'writes.jsonl')
+    store = LiveFarmStore(df, journal, indexed=False)
+    sql = load_or_build_farm_sqlite(str(tmp_path / 'farms.sqlite'), df, journal_path=journal)
+    record = {k: v for k, v in store.get_farm(store.df['id'].iloc[0]).items() if k not in ('id', 'last_updated')}
+    added = store.add_farm(dict(record, name='Zebra Weißhof', region='Orkney', drought_risk='High'))
+    store.update_farm(store.df['id'].iloc[3], {'name': 'Changed Farm', 'supplier_tier': 'Bronze'})
+    store.update_farm(added, {'flood_risk': 'Low', 'overall_score': 3})
+
+    sql.sync()
+    assert sql.version == store.version == 'base-1+3'
+    rebuilt = LiveFarmStore(store.df.to_frame())
+    for search, region, tier in itertools.product(['', 'weiss', 'changed', 'zebra'], ['all', 'Orkney'],
+                                                  ['all', 'Bronze']):
+        expected = rebuilt.index.positions(region, tier, 'all')
+        if search:
+            expected = rebuilt.index.restrict(rebuilt.index.filter_bitmap(region, tier, 'all'),
+                                              rebuilt.search_index.positions(search))
+        positions = sql.positions(search, region, tier)
+        if expected is None:
+            assert positions is None
+            continue
+        assert sorted(positions.tolist()) == sorted(expected.tolist()), (search, region, tier)
+    for region, tier in itertools.product(['all', 'Orkney'], ['all', 'Bronze']):
+        assert sql.summary(region=region, tier=tier)['score_sum'] == pytest.approx(
+            rebuilt.cube.summary(region, tier, 'all')['score_sum']), (region, tier)
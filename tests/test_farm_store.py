@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+from farm_store import load_or_build_farm_store, open_farm_store, remove_farm_store
+
+
+def test_rebuild_swaps_the_store_and_keeps_the_previous_build(tmp_path):
+    path = str(tmp_path / 'farms')
+    first = load_or_build_farm_store(path, 50, seed=1)
+    assert os.path.islink(path)
+    assert load_or_build_farm_store(path, 50, seed=1).attrs['dataset_version'] == first.attrs['dataset_version']
+
+    second = load_or_build_farm_store(path, 60, seed=2)
+    third = load_or_build_farm_store(path, 70, seed=3)
+    assert len(second) == 60 and len(third) == 70
+    assert open_farm_store(path).attrs['dataset_version'] == third.attrs['dataset_version']
+    builds = sorted(name for name in os.listdir(tmp_path) if name.startswith('farms.build-'))
+    # The current build and the one it replaced; older builds are removed
+    assert len(builds) == 2
+    # Frames mapped from an earlier build stay readable after it is removed
+    assert np.asarray(first['size']).sum() > 0
+
+    remove_farm_store(path)
+    assert sorted(os.listdir(tmp_path)) == ['farms.lock']
+
+
+def test_store_written_before_versioned_builds_is_replaced(tmp_path):
+    path = tmp_path / 'farms'
+    (path / 'old').mkdir(parents=True)
+    (path / 'meta.json').write_text('{"format": 1}')
+    df = load_or_build_farm_store(str(path), 40, seed=1)
+    assert os.path.islink(path) and len(df) == 40
@@ -0,0 +1,197 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from farm_data import generate_farm_data
+import farm_table as farm_table_module
+from farm_schema import apply_farm_schema
+from farm_store import open_farm_store, write_farm_store
+from live_store import LiveFarmStore
+from search_index import SearchIndex
+
+
+def farm_table(n_farms=300, seed=3, version='base-1'):
+    df = apply_farm_schema(generate_farm_data(n_farms=n_farms, seed=seed))
+    df.attrs['dataset_version'] = version
+    return df
+
+
+def farm_record(store, position=0, **changes):
+    record = store.df.iloc[position].to_dict()
+    for column in ('id', 'last_updated'):
+        record.pop(column)
+    return dict(record, **changes)
+
+
+def same_positions(actual, expected):
+    if expected is None:
+        return actual is None
+    return actual is not None and actual.tolist() == expected.tolist()
+
+
+# Every structure the store updates in place answers like one rebuilt from its table
+def assert_matches_rebuild(store, searches):
+    df = store.df.to_frame()
+    fresh = LiveFarmStore._derived(df)
+    regions = ['all'] + list(df['region'].cat.categories)
+    tiers = ['all'] + list(df['supplier_tier'].cat.categories)
+    risks = ['all', 'Low', 'Medium', 'High']
+    for region, tier, risk in itertools.product(regions, tiers, risks):
+        assert same_positions(store.index.positions(region, tier, risk),
+                              fresh['index'].positions(region, tier, risk)), (region, tier, risk)
+        totals = store.cube.totals(region, tier, risk)
+        expected = fresh['cube'].totals(region, tier, risk)
+        assert totals == pytest.approx(expected), (region, tier, risk)
+
+    for query in searches:
+        query = query.casefold()
+        assert store.search_index.positions(query).tolist() == fresh['search_index'].positions(query).tolist(), query
+
+    for sort_by in ([{'column_id': 'name', 'direction': 'asc'}],
+                    [{'column_id': 'region', 'direction': 'desc'}, {'column_id': 'id', 'direction': 'asc'}],
+                    [{'column_id': 'supplier_tier', 'direction': 'asc'},
+                     {'column_id': 'overall_score', 'direction': 'desc'}]):
+        assert (store.table_query.query(None, sort_by=sort_by).tolist()
+                == fresh['table_query'].query(None, sort_by=sort_by).tolist()), sort_by
+
+
+def test_writes_keep_indexes_consistent():
+    store = LiveFarmStore(farm_table())
+    first_id = store.df['id'].iloc[0]
+    added = store.add_farm(farm_record(store, name='Aardvark Meadows', region='Isle of Man', drought_risk='High'))
+    store.add_farm(farm_record(store, 5, name='Zygote Dairy'))
+    store.update_farm(first_id, {'name': 'Middle Earth Farm', 'supplier_tier': 'Bronze', 'flood_risk': 'High',
+                                 'tnfd_compliant': False, 'overall_score': 12})
+    store.update_farm(added, {'region': store.df['region'].iloc[1], 'name': 'Aardvark Lane'})
+
+    assert store.version == 'base-1+4'
+    assert store.get_farm(added)['name'] == 'Aardvark Lane'
+    assert store.get_farm(first_id)['supplier_tier'] == 'Bronze'
+    assert_matches_rebuild(store, ['aardvark', 'AARDVARK MEADOWS', 'middle earth', 'zygote', 'farm_0', 'ma'])
+
+
+def test_rebuilt_search_index_keeps_results(monkeypatch):
+    monkeypatch.setattr(SearchIndex, 'needs_rebuild', lambda self: len(self.delta) > 10)
+    store = LiveFarmStore(farm_table(n_farms=50))
+    record = farm_record(store)
+    for i in range(12):
+        store.add_farm(dict(record, name=f"Rebuild Farm {i}"))
+    assert len(store.search_index.delta) == 1
+    assert len(store.search_index.positions('rebuild farm 1')) == 3
+    assert_matches_rebuild(store, ['rebuild farm 11', 'rebuild farm 1', 'farm_0'])
+
+
+def test_journal_is_replayed_across_workers(tmp_path):
+    journal = str(tmp_path / 'writes.jsonl')
+    writer = LiveFarmStore(farm_table(), journal)
+    reader = LiveFarmStore(farm_table(), journal)
+
+    added = writer.add_farm(farm_record(writer, name='Journal Farm', region='Orkney'))
+    writer.update_farm(writer.df['id'].iloc[3], {'name': 'Edited Elsewhere', 'drought_risk': 'Low'})
+    assert reader.sync()
+    assert not reader.sync()
+    assert reader.version == writer.version
+    pd.testing.assert_frame_equal(reader.df.to_frame(), writer.df.to_frame())
+    assert reader.get_farm(added)['region'] == 'Orkney'
+    assert_matches_rebuild(reader, ['journal farm', 'edited elsewhere', 'orkney'])
+
+    # A write from the second worker replays the first worker's writes before taking an id
+    other = reader.add_farm(farm_record(reader, name='Second Worker Farm'))
+    assert other != added
+    assert writer.sync()
+    pd.testing.assert_frame_equal(writer.df.to_frame(), reader.df.to_frame())
+
+
+def test_journal_is_not_replayed_onto_another_table(tmp_path):
+    journal = str(tmp_path / 'writes.jsonl')
+    writer = LiveFarmStore(farm_table(), journal)
+    other = LiveFarmStore(farm_table(seed=4, version='base-2'), journal)
+    writer.add_farm(farm_record(writer, name='Journal Farm'))
+
+    assert not other.sync()
+    assert other.version == 'base-2'
+    assert len(other.df) == 300
+    assert not len(other.search_index.positions('journal farm'))
+
+
+def test_snapshot_reads_the_table_as_taken(monkeypatch):
+    monkeypatch.setattr(farm_table_module, 'OVERLAY_ROWS', 4)
+    store = LiveFarmStore(farm_table(n_farms=40))
+    store.add_farm(farm_record(store, name='Early Farm'))
+    with store.reading():
+        snapshot = store.snapshot()
+    before = snapshot.to_frame()
+    store.update_farm(store.df['id'].iloc[2], {'name': 'Changed Name', 'region': 'Orkney'})
+    store.update_farm(store.df['id'].iloc[40], {'name': 'Early Farm Renamed'})
+    for i in range(20):
+        store.df = store.df.with_row(len(store.df), store.df.take([0]))
+
+    assert len(snapshot) == 41
+    pd.testing.assert_frame_equal(snapshot.to_frame(), before)
+    assert store.df['name'].iloc[2] == 'Changed Name'
+    assert store.df['name'].iloc[40] == 'Early Farm Renamed'
+
+
+# Writes go into the overlay: the memory-mapped store is neither copied nor written
+def test_writes_leave_the_mapped_store_alone(tmp_path):
+    write_farm_store(farm_table(n_farms=200), str(tmp_path / 'farms'))
+    base = open_farm_store(str(tmp_path / 'farms'))
+    scores = base['overall_score'].to_numpy()
+    store = LiveFarmStore(base)
+    first_id = store.df['id'].iloc[0]
+    added = store.add_farm(farm_record(store, name='Overlay Farm', region='Orkney', overall_score=3))
+    store.update_farm(first_id, {'overall_score': 99, 'name': 'Edited Farm'})
+
+    assert store.df.base is base
+    assert not scores.flags.writeable
+    assert np.shares_memory(store.df.base['overall_score'].to_numpy(), scores)
+    assert base['overall_score'].iloc[0] != 99
+    assert len(store.df) == 201
+    assert store.get_farm(first_id)['overall_score'] == 99
+    assert store.get_farm(added)['region'] == 'Orkney'
+    rows = store.df.take([200, 0, 1])
+    assert rows['name'].tolist() == ['Overlay Farm', 'Edited Farm', base['name'].iloc[1]]
+    assert rows.index.tolist() == [200, 0, 1]
+    assert store.df['overall_score'].tolist() == [99] + base['overall_score'].tolist()[1:] + [3]
+
+
+# A drop change reaches every worker through the journal, as writes or as a move to
+# a rebuilt table, and the dashboard's own edits survive both
+def test_drop_changes_keep_dashboard_edits(tmp_path):
+    journal = str(tmp_path / 'writes.jsonl')
+    tables = {'drop-1': farm_table(n_farms=50, version='drop-1')}
+    tables['drop-1'].attrs['drop_files'] = {'a.csv': '1'}
+    writer = LiveFarmStore(tables['drop-1'], journal, tables.get)
+    reader = LiveFarmStore(tables['drop-1'], journal, tables.get)
+    edited, removed = writer.df['id'].iloc[3], writer.df['id'].iloc[4]
+    writer.update_farm(edited, {'name': 'Dashboard Name'})
+    added = writer.add_farm(farm_record(writer, name='Dashboard Farm'))
+
+    rows = tables['drop-1'].iloc[[3, 7]].copy()
+    rows['overall_score'] = 1
+    rows.loc[len(rows)] = tables['drop-1'].iloc[0]
+    rows.iloc[-1, rows.columns.get_loc('id')] = 'FARM_DROP'
+    writer.load_drop({'a.csv': '2'}, rows)
+    assert reader.sync()
+    for store in (writer, reader):
+        assert store.drop_files == {'a.csv': '2'}
+        assert store.get_farm(edited)['name'] == 'Dashboard Name'
+        assert store.get_farm(edited)['overall_score'] == 1
+        assert store.get_farm('FARM_DROP')['name'] == tables['drop-1']['name'].iloc[0]
+    assert reader.version == writer.version
+
+    tables['drop-2'] = farm_table(n_farms=50, version='drop-2').drop(index=4).reset_index(drop=True)
+    tables['drop-2'].attrs.update(dataset_version='drop-2', drop_files={'a.csv': '3'})
+    writer.rebase('drop-2')
+    assert reader.sync()
+    for store in (writer, reader):
+        assert store.base_version == 'drop-2'
+        assert store.drop_files == {'a.csv': '3'}
+        assert store.get_farm(edited)['name'] == 'Dashboard Name'
+        assert store.get_farm(added)['name'] == 'Dashboard Farm'
+        with pytest.raises(KeyError):
+            store.get_farm(removed)
+    pd.testing.assert_frame_equal(reader.df.to_frame(), writer.df.to_frame())
+    assert_matches_rebuild(reader, ['dashboard', 'farm_0'])
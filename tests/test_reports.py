@@ -0,0 +1,28 @@
+from aggregate_cube import AggregateCube
+from farm_data import generate_farm_data
+from farm_schema import apply_farm_schema
+from live_store import LiveFarmStore
+from reports import report_sections, row_versions, section_key
+
+
+def section_keys(store):
+    sections = report_sections(store.cube.dimensions, ['portfolio', 'region', 'supplier_tier'])
+    versions = row_versions(store.df)
+    return {(s['scope'], s['value']): section_key(store.df, store.cube, versions, None, s) for s in sections}
+
+
+# An edit changes the keys of the sections the farm is in (before and after) and
+# no others, and a fresh cube over the same farms keys them the same
+def test_section_keys_follow_their_own_farms():
+    store = LiveFarmStore(apply_farm_schema(generate_farm_data(n_farms=300, seed=4)))
+    before = section_keys(store)
+    farm = store.get_farm(store.df['id'].iloc[5])
+    other_tier = next(t for t in store.cube.dimensions['supplier_tier'] if t != farm['supplier_tier'])
+    store.update_farm(farm['id'], {'supplier_tier': other_tier, 'overall_score': 1})
+    after = section_keys(store)
+
+    changed = {section for section in before if before[section] != after[section]}
+    assert changed == {('portfolio', None), ('region', farm['region']),
+                       ('supplier_tier', farm['supplier_tier']), ('supplier_tier', other_tier)}
+    store.cube = AggregateCube(store.df.to_frame(), store.cube.dimensions)
+    assert section_keys(store) == after
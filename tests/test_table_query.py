@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+from table_query import TableQuery, parse_filter_query
+
+
+def farm_frame():
+    return pd.DataFrame({
+        'id': ['FARM_003', 'FARM_001', 'FARM_004', 'FARM_002', 'FARM_005'],
+        'name': ['Oak Farm', 'Straße Hof', 'ash farm', None, 'Birch "B" Farm'],
+        'region': pd.Categorical(['Wales', 'Scotland', 'Wales', None, 'North West']),
+        'overall_score': np.array([70, 85, 55, 85, 90], dtype=np.uint8),
+        'tnfd_compliant': [True, False, True, True, False]
+    })
+
+
+def test_parse_filter_query():
+    assert parse_filter_query(None) == []
+    assert parse_filter_query('') == []
+    assert parse_filter_query('{name} icontains oak && {overall_score} >= 80') == [
+        ('name', 'contains', 'oak', False), ('overall_score', 'ge', '80', True)]
+    assert parse_filter_query('{region} s= "North West"') == [('region', 'eq', 'North West', True)]
+    assert parse_filter_query("{name} contains 'O\\'Neill'") == [('name', 'contains', "O'Neill", True)]
+    # Terms the table can emit but the query cannot evaluate are skipped
+    assert parse_filter_query('{name} is blank && {overall_score} != 85') == [('overall_score', 'ne', '85', True)]
+
+
+def test_filter():
+    query = TableQuery(farm_frame())
+    everything = np.arange(5)
+    assert query.filter(everything, '{name} icontains FARM').tolist() == [0, 2, 4]
+    assert query.filter(everything, '{name} contains Farm').tolist() == [0, 4]
+    assert query.filter(everything, '{name} icontains STRASSE').tolist() == [1]
+    assert query.filter(everything, '{region} = Wales && {overall_score} > 60').tolist() == [0]
+    assert query.filter(everything, '{region} icontains north').tolist() == [4]
+    assert query.filter(everything, '{overall_score} = 85').tolist() == [1, 3]
+    assert query.filter(everything, '{overall_score} >= high').tolist() == []
+    assert query.filter(everything, '{overall_score} contains 5').tolist() == [1, 2, 3]
+    assert query.filter(everything, '{tnfd_compliant} = yes').tolist() == [0, 2, 3]
+    assert query.filter(everything, '{tnfd_compliant} != true').tolist() == [1, 4]
+    assert query.filter(everything, '{unknown} = 1').tolist() == [0, 1, 2, 3, 4]
+    assert query.filter(np.array([2, 4]), '{name} icontains farm').tolist() == [2, 4]
+
+
+def test_sort():
+    query = TableQuery(farm_frame())
+    assert query.query(None, sort_by=[{'column_id': 'id', 'direction': 'asc'}]).tolist() == [1, 3, 0, 2, 4]
+    # Missing text sorts first
+    assert query.query(None, sort_by=[{'column_id': 'region', 'direction': 'asc'},
+                                      {'column_id': 'overall_score', 'direction': 'desc'}]).tolist() == [3, 4, 1, 0, 2]
+    assert query.query(None, sort_by=[{'column_id': 'overall_score', 'direction': 'desc'},
+                                      {'column_id': 'id', 'direction': 'desc'}]).tolist() == [4, 3, 1, 0, 2]
+    assert query.query(None, '{region} = Wales', [{'column_id': 'name', 'direction': 'desc'}]).tolist() == [2, 0]
+    assert query.query(None, sort_by=[{'column_id': 'unknown', 'direction': 'asc'}]).tolist() == [0, 1, 2, 3, 4]
+
+
+# Sort keys kept current one row at a time order rows as keys built from the edited frame do
+def test_set_row_keeps_sort_keys():
+    df = farm_frame()
+    query = TableQuery(df)
+    sort_by = [{'column_id': 'region', 'direction': 'asc'}, {'column_id': 'name', 'direction': 'asc'}]
+    query.query(None, sort_by=sort_by)
+
+    df = pd.concat([df, farm_frame().iloc[[0]]], ignore_index=True)
+    df['region'] = df['region'].cat.add_categories(['Anglesey', 'Zetland'])
+    df.loc[5, ['region', 'name']] = ['Zetland', 'Aaron Farm']
+    query.set_row(df, 5)
+    df.loc[2, ['region', 'name']] = ['Anglesey', 'Zed Farm']
+    query.set_row(df, 2)
+    assert query.query(None, sort_by=sort_by).tolist() == TableQuery(df).query(None, sort_by=sort_by).tolist()
+
+    # Values squeezed between the same two neighbours until the gap is used up
+    for i in range(70):
+        df.loc[0, 'name'] = 'Oak Farm' + 'a' * i
+        query.set_row(df, 0)
+    assert query.query(None, sort_by=sort_by).tolist() == TableQuery(df).query(None, sort_by=sort_by).tolist()
+
+
+def test_keyset_pages():
+    df = pd.DataFrame({'id': [f"FARM_{i:03d}" for i in np.random.default_rng(0).permutation(23)]})
+    query = TableQuery(df)
+    keyset = query.keyset(None, 'id')
+    pages = []
+    after = None
+    while True:
+        page = query.page_after(keyset, 'id', after, limit=5)
+        if not len(page):
+            break
+        pages.append(page)
+        after = page[-1]
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert df['id'].iloc[np.concatenate(pages)].tolist() == sorted(df['id'])
+
+    subset = query.keyset(np.array([4, 9, 1]), 'id')
+    assert sorted(query.page_after(subset, 'id', limit=10).tolist()) == [1, 4, 9]
+    assert df['id'].iloc[query.page_after(subset, 'id', limit=10)].is_monotonic_increasing
+    first = query.page_after(subset, 'id', limit=1)[0]
+    assert query.page_after(subset, 'id', first, limit=10).tolist() == query.page_after(subset, 'id', limit=10)[1:].tolist()
+    # A farm outside the selection (e.g. filtered out since the last page) pages from its key
+    outside = int(np.flatnonzero(df['id'] == 'FARM_010')[0])
+    assert df['id'].iloc[query.page_after(subset, 'id', outside)].tolist() == sorted(
+        value for value in df['id'].iloc[[4, 9, 1]] if value > 'FARM_010')
+    assert not len(query.page_after(query.keyset(np.array([], dtype=np.int64), 'id'), 'id'))